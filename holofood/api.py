@@ -1,16 +1,18 @@
 import operator
 from enum import Enum
 from functools import reduce
-from typing import Optional, List
+from datetime import datetime
+from typing import Optional, List, Type, Dict
 
 from django.db.models import Q
-from django.db.models.functions import Lower
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
-from ninja import ModelSchema, NinjaAPI, Field
+from ninja import ModelSchema, NinjaAPI, Field, Query, Schema
+from ninja.errors import ValidationError
 from ninja.pagination import RouterPaginated
 from pydantic import AnyHttpUrl
 
+from holofood import search
 from holofood.models import (
     Sample,
     SampleStructuredDatum,
@@ -22,8 +24,10 @@ from holofood.models import (
     ViralFragment,
     Animal,
     AnimalStructuredDatum,
+    AbstractStructuredDatum,
     GenomeSampleContainment,
 )
+from holofood.stats import get_portal_stats
 from holofood.utils import holofood_config
 
 api = NinjaAPI(
@@ -45,6 +49,7 @@ SAMPLES = "Samples"
 ANALYSES = "Analysis Summaries"
 GENOMES = "Genomes"
 VIRUSES = "Viruses"
+STATS = "Statistics"
 
 
 class System(Enum):
@@ -109,9 +114,7 @@ class AnimalSlimSchema(ModelSchema):
 
     @staticmethod
     def resolve_sample_types(obj: Animal):
-        if obj.sample_types is None:
-            return []
-        return obj.sample_types.split(",")
+        return obj.sample_types
 
     sample_types: List[str]
 
@@ -211,6 +214,18 @@ class GenomeWithContainingSamplesSchema(GenomeSchema):
     samples_containing: List[GenomeSampleContainmentSchema]
 
 
+class ContainmentMatrixSchema(Schema):
+    genomes: List[str]
+    samples: List[str]
+    genome_index: List[int] = Field(
+        ..., description="Index into `genomes` of each containment"
+    )
+    sample_index: List[int] = Field(
+        ..., description="Index into `samples` of each containment"
+    )
+    containment: List[float]
+
+
 class ViralCatalogueSchema(ModelSchema):
     related_genome_catalogue: GenomeCatalogueSchema
     analysis_summaries: List[RelatedAnalysisSummarySchema]
@@ -274,6 +289,27 @@ class AnalysisSummarySchema(RelatedAnalysisSummarySchema):
         model_fields = ["title"]
 
 
+class CountSchema(Schema):
+    total: int
+
+
+class CountBySystemSchema(CountSchema):
+    by_system: Dict[str, int]
+
+
+class SampleCountSchema(CountBySystemSchema):
+    by_sample_type: Dict[str, int]
+
+
+class StatsSchema(Schema):
+    samples: SampleCountSchema
+    animals: CountBySystemSchema
+    genomes: CountBySystemSchema
+    viral_fragments: CountBySystemSchema
+    analysis_summaries: CountSchema
+    computed_at: datetime
+
+
 @api.get(
     "/samples/{sample_accession}",
     response=SampleSchema,
@@ -287,6 +323,65 @@ def get_sample(request, sample_accession: str):
     return sample
 
 
+def _ids_with_measurement_in_range(
+    datum_model: Type[AbstractStructuredDatum],
+    owner_field: str,
+    marker_name: str,
+    min_measurement: Optional[float],
+    max_measurement: Optional[float],
+):
+    """
+    Subquery of the owner (sample/animal) IDs with a numeric measurement for the named marker,
+    within an (inclusive) range. Uses the (marker, measurement_numeric) index.
+    """
+    datums = datum_model.objects.filter(
+        marker_id__in=SampleMetadataMarker.objects.ids_for_name(marker_name),
+        measurement_numeric__isnull=False,
+    )
+    if min_measurement is not None:
+        datums = datums.filter(measurement_numeric__gte=min_measurement)
+    if max_measurement is not None:
+        datums = datums.filter(measurement_numeric__lte=max_measurement)
+    return datums.values_list(owner_field, flat=True)
+
+
+def _check_measurement_range(
+    metadata_marker: Optional[str],
+    min_measurement: Optional[float],
+    max_measurement: Optional[float],
+):
+    """
+    A range (`min=`/`max=`) is for the measurements of `metadata_marker=`, so is invalid without it
+    (rather than silently ignored).
+    """
+    if metadata_marker:
+        return
+    errors = [
+        {
+            "loc": ["query", param],
+            "msg": "requires a metadata_marker, whose measurements to filter by",
+            "type": "value_error",
+        }
+        for param, value in [("min", min_measurement), ("max", max_measurement)]
+        if value is not None
+    ]
+    if errors:
+        raise ValidationError(errors)
+
+
+def _ids_with_truthy_measurement(
+    datum_model: Type[AbstractStructuredDatum], owner_field: str, marker_name: str
+):
+    """
+    Subquery of the owner (sample/animal) IDs where the named marker is present,
+    and not one of the FALSY_MEASUREMENTS. Uses the partial (marker, owner) index of truthy datums.
+    """
+    return datum_model.objects.filter(
+        marker_id__in=SampleMetadataMarker.objects.ids_for_name(marker_name),
+        measurement_is_truthy=True,
+    ).values_list(owner_field, flat=True)
+
+
 @api.get(
     "/samples",
     response=List[SampleSlimSchema],
@@ -297,6 +392,8 @@ def get_sample(request, sample_accession: str):
     "Use the `/samples/{sample_accession}` endpoint to retrieve those. "
     "Sample metadata *can* be filtered for with `require_metadata_marker=`: this finds samples where "
     "the named metadata marker is present and none of `['0', 'false', 'unknown', 'n/a', 'null]`. "
+    "Numeric sample metadata can be filtered by range with `metadata_marker=` and `min=` and/or `max=` "
+    "(inclusive): this finds samples where the named marker's measurement is a number within the range. "
     "Use `/sample_metadata_markers` to find the exact marker name of interest.",
     tags=[SAMPLES],
 )
@@ -308,28 +405,42 @@ def list_samples(
     sample_type: SampleType = None,
     animal_accession: str = None,
     require_metadata_marker: str = None,
+    metadata_marker: str = None,
+    min_measurement: float = Query(None, alias="min"),
+    max_measurement: float = Query(None, alias="max"),
 ):
+    _check_measurement_range(metadata_marker, min_measurement, max_measurement)
     q_objects = []
     if system:
         q_objects.append(Q(animal__system__icontains=system.value))
     if accession:
-        q_objects.append(Q(accession__icontains=accession))
+        q_objects.append(search.contains(Sample, "accession", accession))
     if animal_accession:
-        q_objects.append(Q(animal__accession__icontains=animal_accession))
+        q_objects.append(search.contains(Sample, "animal__accession", animal_accession))
     if title:
-        q_objects.append(Q(title__icontains=title))
+        q_objects.append(search.contains(Sample, "title", title))
     if sample_type:
         q_objects.append(Q(sample_type__iexact=sample_type.value))
     if require_metadata_marker:
-        sample_ids_with_metadata = (
-            SampleStructuredDatum.objects.filter(
-                marker__name__iexact=require_metadata_marker
+        q_objects.append(
+            Q(
+                accession__in=_ids_with_truthy_measurement(
+                    SampleStructuredDatum, "sample_id", require_metadata_marker
+                )
+            )
+        )
+    if metadata_marker:
+        q_objects.append(
+            Q(
+                accession__in=_ids_with_measurement_in_range(
+                    SampleStructuredDatum,
+                    "sample_id",
+                    metadata_marker,
+                    min_measurement,
+                    max_measurement,
+                )
             )
-            .annotate(measurement_lower=Lower("measurement"))
-            .exclude(measurement_lower__in=("0", "false", "unknown", "n/a", "null"))
-            .values_list("sample_id", flat=True)
         )
-        q_objects.append(Q(accession__in=sample_ids_with_metadata))
     if not q_objects:
         return Sample.objects.all()
     return Sample.objects.filter(reduce(operator.and_, q_objects))
@@ -360,6 +471,8 @@ def get_animal(request, animal_accession: str):
     "the named metadata marker is present and none of `['0', 'false', 'unknown', 'n/a', 'null]`. "
     "The `require_sample_type=` filter finds only animals where "
     "at least one derived sample of the specified type exists. "
+    "Numeric animal metadata can be filtered by range with `metadata_marker=` and `min=` and/or `max=` "
+    "(inclusive): this finds animals where the named marker's measurement is a number within the range. "
     "Use `/sample_metadata_markers` to find the exact marker name of interest.",
     tags=[SAMPLES],
 )
@@ -369,24 +482,38 @@ def list_animals(
     accession: str = None,
     require_metadata_marker: str = None,
     require_sample_type: SampleType = None,
+    metadata_marker: str = None,
+    min_measurement: float = Query(None, alias="min"),
+    max_measurement: float = Query(None, alias="max"),
 ):
+    _check_measurement_range(metadata_marker, min_measurement, max_measurement)
     q_objects = []
     if system:
         q_objects.append(Q(system__icontains=system.value))
     if accession:
-        q_objects.append(Q(accession__icontains=accession))
+        q_objects.append(search.contains(Animal, "accession", accession))
     if require_metadata_marker:
-        animal_ids_with_metadata = (
-            AnimalStructuredDatum.objects.filter(
-                marker__name__iexact=require_metadata_marker
+        q_objects.append(
+            Q(
+                accession__in=_ids_with_truthy_measurement(
+                    AnimalStructuredDatum, "animal_id", require_metadata_marker
+                )
             )
-            .annotate(measurement_lower=Lower("measurement"))
-            .exclude(measurement_lower__in=("0", "false", "unknown", "n/a", "null"))
-            .values_list("animal_id", flat=True)
         )
-        q_objects.append(Q(accession__in=animal_ids_with_metadata))
     if require_sample_type:
-        q_objects.append(Q(sample_types__icontains=require_sample_type.value))
+        q_objects.append(Animal.objects.with_sample_type(require_sample_type.value))
+    if metadata_marker:
+        q_objects.append(
+            Q(
+                accession__in=_ids_with_measurement_in_range(
+                    AnimalStructuredDatum,
+                    "animal_id",
+                    metadata_marker,
+                    min_measurement,
+                    max_measurement,
+                )
+            )
+        )
     if not q_objects:
         return Animal.objects.all()
     return Animal.objects.filter(reduce(operator.and_, q_objects))
@@ -470,6 +597,40 @@ def list_genome_catalogue_genomes(request, catalogue_id: str):
     return catalogue.genomes.all()
 
 
+@api.get(
+    "/genome-catalogues/{catalogue_id}/containment",
+    response=ContainmentMatrixSchema,
+    summary="Fetch the Genome × Sample containment matrix of a Catalogue",
+    description="Every containment of the Catalogue's Genomes in Samples, as a sparse (COO) matrix: "
+    "the i-th containment is of `genomes[genome_index[i]]` in `samples[sample_index[i]]`. "
+    "Only Genomes and Samples with any containments (of at least `min_containment`, if given) are listed. "
+    "A TSV version, including a dense layout, is available from the export API.",
+    url_name="get_genome_catalogue_containment",
+    tags=[GENOMES],
+)
+def get_genome_catalogue_containment(
+    request,
+    catalogue_id: str,
+    min_containment: float = Query(None, ge=0, le=1),
+):
+    get_object_or_404(GenomeCatalogue, id=catalogue_id)
+    genomes, samples = {}, {}
+    genome_index, sample_index, containment = [], [], []
+    for genome, sample, value in GenomeSampleContainment.objects.catalogue_matrix(
+        catalogue_id, min_containment
+    ):
+        genome_index.append(genomes.setdefault(genome, len(genomes)))
+        sample_index.append(samples.setdefault(sample, len(samples)))
+        containment.append(value)
+    return ContainmentMatrixSchema(
+        genomes=list(genomes),
+        samples=list(samples),
+        genome_index=genome_index,
+        sample_index=sample_index,
+        containment=containment,
+    )
+
+
 @api.get(
     "/genome-catalogues/{genome_catalogue_id}/genomes/{genome_id}",
     response=GenomeWithContainingSamplesSchema,
@@ -526,4 +687,17 @@ def get_viral_catalogue(request, catalogue_id: str):
 )
 def list_viral_catalogue_fragments(request, catalogue_id: str):
     catalogue = get_object_or_404(ViralCatalogue, id=catalogue_id)
-    return catalogue.viral_fragments.all()
+    return catalogue.viral_fragments.select_related("cluster_representative")
+
+
+@api.get(
+    "/stats",
+    response=StatsSchema,
+    summary="Fetch summary statistics of the HoloFood database.",
+    description="Counts of samples, animals, genomes, viral fragments and (published) analysis summaries. "
+    "Most are broken down by system, and samples also by sample type. "
+    "Statistics are cached, and recomputed after data are added or changed.",
+    tags=[STATS],
+)
+def get_stats(request):
+    return get_portal_stats()
@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Optional
+
+from django.core.cache import cache
+from django.utils.encoding import force_str
+from django.utils.text import slugify
+
+from holofood.metrics import observe_cache_lookup, HIT, STALE, MISS
+
+
+class UpstreamError(Exception):
+    """
+    A (possibly cached) failure of an external service.
+    """
+
+    pass
+
+
+class StaleWhileRevalidateCache:
+    """
+    Caches the results of a slow (e.g. external API) fetch function, using Django's cache framework.
+
+    - Fresh values (younger than `ttl`) are served straight from the cache.
+    - Stale values (older than `ttl`, but younger than `ttl` + `stale_ttl`) are served immediately,
+      whilst a background thread fetches a replacement.
+    - Negative results (e.g. empty lists from a 404) are cached for `negative_ttl`.
+    - Errors are cached for `error_ttl`, during which `get` raises `UpstreamError`
+      rather than calling the failing service again.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        ttl: timedelta,
+        stale_ttl: timedelta = timedelta(0),
+        negative_ttl: Optional[timedelta] = None,
+        error_ttl: timedelta = timedelta(0),
+        is_negative: Callable[[Any], bool] = lambda value: not value,
+    ):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl if negative_ttl is not None else ttl
+        self.error_ttl = error_ttl
+        self.is_negative = is_negative
+
+    def make_key(self, key: str) -> str:
+        return f"{self.prefix}:{slugify(force_str(key))}"
+
+    def _store(self, key: str, value: Any = None, error: str = None):
+        if error is not None:
+            fresh_for = self.error_ttl
+            keep_for = self.error_ttl
+        else:
+            fresh_for = self.negative_ttl if self.is_negative(value) else self.ttl
+            keep_for = fresh_for + self.stale_ttl
+        if keep_for.total_seconds() <= 0:
+            return
+        cache.set(
+            self.make_key(key),
+            {
+                "value": value,
+                "error": error,
+                "fresh_until": time.time() + fresh_for.total_seconds(),
+            },
+            timeout=keep_for.total_seconds(),
+        )
+
+    def refresh(self, key: str, fetch: Callable[[], Any]) -> Any:
+        """
+        Fetch a value now and cache it (or cache the error, and raise UpstreamError).
+        """
+        try:
+            value = fetch()
+        except Exception as e:
+            logging.error(f"Could not fetch {self.make_key(key)}: {e}")
+            self._store(key, error=str(e))
+            raise UpstreamError(str(e)) from e
+        self._store(key, value)
+        return value
+
+    def _revalidate_in_background(self, key: str, fetch: Callable[[], Any]):
+        lock_key = f"{self.make_key(key)}:revalidating"
+        if not cache.add(lock_key, True, timeout=60):
+            # Another thread/process is already revalidating this key
+            return
+
+        def revalidate():
+            try:
+                value = fetch()
+            except Exception as e:
+                # Keep serving the stale value until it expires (rather than caching the error),
+                # and hold the lock so that upstream is not retried until error_ttl has passed
+                logging.warning(
+                    f"Could not revalidate {self.make_key(key)}, still serving stale: {e}"
+                )
+                cache.set(lock_key, True, timeout=self.error_ttl.total_seconds() or 1)
+            else:
+                self._store(key, value)
+                cache.delete(lock_key)
+
+        threading.Thread(target=revalidate, daemon=True).start()
+
+    def get(self, key: str, fetch: Callable[[], Any]) -> Any:
+        """
+        Get a value from the cache if present, otherwise fetch (and cache) it.
+        :param key: Cache key, unique within this cache's prefix (e.g. an accession).
+        :param fetch: Function (without args) that fetches a fresh value.
+        :return: The cached or fetched value.
+        """
+        entry = cache.get(self.make_key(key))
+        if entry is None:
+            observe_cache_lookup(self.prefix, MISS)
+            return self.refresh(key, fetch)
+        if entry["error"] is not None:
+            observe_cache_lookup(self.prefix, HIT)
+            raise UpstreamError(entry["error"])
+        if time.time() > entry["fresh_until"]:
+            observe_cache_lookup(self.prefix, STALE)
+            logging.info(f"Serving stale {self.make_key(key)} whilst revalidating")
+            self._revalidate_in_background(key, fetch)
+        else:
+            observe_cache_lookup(self.prefix, HIT)
+        return entry["value"]
@@ -19,7 +19,7 @@ from __future__ import annotations
 from datetime import timedelta
 import json
 from pathlib import Path
-from typing import Any, List
+from typing import Any, Dict, List
 
 from pydantic import BaseSettings, AnyHttpUrl, BaseModel
 
@@ -29,12 +29,24 @@ def data_config_source(settings: BaseSettings) -> dict[str, Any]:
     return json.loads(Path("config/data_config.json").read_text(encoding))
 
 
+class HttpConfig(BaseModel):
+    pool_connections: int = 10
+    pool_maxsize: int = 10
+    request_timeout: timedelta = timedelta(seconds=30)
+    request_retries: int = 3
+    retry_backoff_factor: float = 0.5
+    retry_on_statuses: List[int] = [429, 500, 502, 503, 504]
+    concurrent_lookups_workers: int = 16
+    detail_page_lookups_deadline: timedelta = timedelta(seconds=10)
+
+
 class BiosamplesConfig(BaseModel):
     api_root: AnyHttpUrl = "https://www.ebi.ac.uk/biosamples"
     project_id: str = "HF"
     username: str = ""
     password: str = ""
     auth_url: AnyHttpUrl = "https://www.ebi.ac.uk/ena/submit/webin/auth/token"
+    token_refresh_margin: timedelta = timedelta(minutes=1)
 
 
 class EnaConfig(BaseModel):
@@ -44,6 +56,11 @@ class EnaConfig(BaseModel):
     portal_api_root: AnyHttpUrl = "https://www.ebi.ac.uk/ena/portal/api"
     browser_api_root: AnyHttpUrl = "https://www.ebi.ac.uk/ena/browser/api"
     browser_url: AnyHttpUrl = "https://www.ebi.ac.uk/ena/browser/view"
+    filereport_cache_ttl: timedelta = timedelta(days=1)
+    filereport_cache_stale_ttl: timedelta = timedelta(days=7)
+    filereport_cache_negative_ttl: timedelta = timedelta(hours=1)
+    filereport_cache_error_ttl: timedelta = timedelta(minutes=5)
+    search_batch_size: int = 100
 
 
 class MgnifyConfig(BaseModel):
@@ -52,6 +69,10 @@ class MgnifyConfig(BaseModel):
     request_cadence: timedelta = timedelta(seconds=3)
     request_timeout: timedelta = timedelta(seconds=15.05)
     request_retries: int = 3
+    analyses_cache_ttl: timedelta = timedelta(days=1)
+    analyses_cache_stale_ttl: timedelta = timedelta(days=7)
+    analyses_cache_negative_ttl: timedelta = timedelta(hours=1)
+    analyses_cache_error_ttl: timedelta = timedelta(minutes=5)
 
 
 class MetabolightsConfig(BaseModel):
@@ -59,6 +80,9 @@ class MetabolightsConfig(BaseModel):
     web_url: AnyHttpUrl = "https://www.ebi.ac.uk/metabolights"
     user_token: str = None
     biosample_column_name_in_sample_table: str = "Characteristics[BioSamples accession]"
+    study_index_ttl: timedelta = timedelta(hours=6)
+    study_index_max_age: timedelta = timedelta(days=30)
+    study_index_error_ttl: timedelta = timedelta(minutes=5)
 
 
 class SampleTableConfig(BaseModel):
@@ -77,15 +101,37 @@ class TablesConfig(BaseModel):
 class DocsConfig(BaseModel):
     docs_url: AnyHttpUrl = "https://docs.holofooddata.org"
     portal_doi: str = "10.5281/zenodo.7684071"
+    search_index_ttl: timedelta = timedelta(hours=1)
+    search_index_error_ttl: timedelta = timedelta(minutes=5)
+    search_index_timeout: timedelta = timedelta(seconds=5)
 
 
 class PortalConfig(BaseModel):
     url_root: AnyHttpUrl = "https://www.holofooddata.org"
+    stats_cache_ttl: timedelta = timedelta(days=1)
+
+
+class MonitoringConfig(BaseModel):
+    # /metrics for Prometheus. Off by default, since it would be public. If a token is set,
+    # scrapers must send it as `Authorization: Bearer <token>`.
+    metrics_endpoint: bool = False
+    metrics_token: str = ""
+    server_timing_header: bool = True
+    latency_budget: timedelta = timedelta(seconds=5)
+    query_budget: int = 50
+    view_query_budgets: Dict[str, int] = {}  # by URL name, e.g. {"samples_list": 10}
+    raise_over_query_budget: bool = False  # e.g. in tests, rather than only warning
+
+
+class ExportsConfig(BaseModel):
+    # Prebuilt, gzipped TSV exports (see export_snapshots.py). Relative to the project's BASE_DIR, if not absolute.
+    snapshots_dir: str = "export-snapshots"
 
 
 class HolofoodConfig(BaseSettings):
     mock_apis: bool = False
 
+    http: HttpConfig = HttpConfig()
     biosamples: BiosamplesConfig = BiosamplesConfig()
     ena: EnaConfig = EnaConfig()
     mgnify: MgnifyConfig = MgnifyConfig()
@@ -93,6 +139,8 @@ class HolofoodConfig(BaseSettings):
     metabolights: MetabolightsConfig = MetabolightsConfig()
     tables: TablesConfig = TablesConfig()
     portal: PortalConfig = PortalConfig()
+    monitoring: MonitoringConfig = MonitoringConfig()
+    exports: ExportsConfig = ExportsConfig()
 
     class Config:
         env_prefix = "holofood_"
@@ -1,9 +1,16 @@
 import csv
-from io import StringIO
-from typing import MutableMapping, List
+import logging
+from enum import Enum
+from itertools import groupby
+from operator import itemgetter
+from typing import MutableMapping, List, Iterable, Iterator, Type, Optional, Dict
 
+from django.core.validators import slug_re
+from django.db.models import QuerySet, FilteredRelation, Q
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from ninja import NinjaAPI
+from django.utils.text import compress_sequence
+from ninja import NinjaAPI, Schema, Query
 from ninja.renderers import BaseRenderer
 
 from holofood.api import (
@@ -14,8 +21,28 @@ from holofood.api import (
     AnimalSlimSchema,
     AnimalStructuredDatumSchema,
     GenomeSampleContainmentSchema,
+    System,
+    SampleType,
+)
+from holofood.export_arrow import StreamingArrowResponse, PARQUET, ARROW
+from holofood.export_snapshots import (
+    get_snapshot,
+    write_snapshot,
+    snapshot_response,
+)
+from holofood.models import (
+    Sample,
+    GenomeCatalogue,
+    ViralCatalogue,
+    Animal,
+    Genome,
+    GenomeSampleContainment,
+    SampleMetadataMarker,
+    SampleStructuredDatum,
+    AnimalStructuredDatum,
+    GENOMES_EXPORT_SNAPSHOT,
+    VIRAL_FRAGMENTS_EXPORT_SNAPSHOT,
 )
-from holofood.models import Sample, GenomeCatalogue, ViralCatalogue, Animal, Genome
 
 
 class CSVRenderer(BaseRenderer):
@@ -34,21 +61,234 @@ class CSVRenderer(BaseRenderer):
     def _flatten_data(cls, dict_field: MutableMapping, parent_path: str = ""):
         return dict(cls._flatten_data_generator(dict_field, parent_path))
 
+    @classmethod
+    def iter_lines(cls, data: Iterable[MutableMapping]) -> Iterator[str]:
+        """
+        Render rows as TSV lines, one at a time. The header is taken from the first row.
+        """
+        csv_data = csv.writer(_LineBuffer(), delimiter="\t")
+        headers = None
+        for obj in data:
+            row = cls._flatten_data(obj)
+            if headers is None:
+                headers = row.keys()
+                yield csv_data.writerow(headers)
+            yield csv_data.writerow(row.values())
+
     def render(self, request, data, *, response_status):
-        stream = StringIO()
-        csv_data = csv.writer(stream, delimiter="\t")
+        if isinstance(data, MutableMapping):
+            # A single object, e.g. error details like {"detail": "Not Found"}
+            data = [data]
+        return "".join(self.iter_lines(data))
+
+
+class _LineBuffer:
+    """
+    A file-like object for csv.writer, which returns each written line rather than storing it.
+    """
+
+    def write(self, line: str) -> str:
+        return line
+
+
+class StreamingTSVResponse(StreamingHttpResponse):
+    """
+    Streams a (large) queryset as TSV: objects are fetched in chunks, serialized with a schema,
+    and written line by line, so memory use does not grow with the size of the export.
+    Return this from an export endpoint instead of the queryset, which Ninja would otherwise
+    serialize in full (and CSVRenderer render) before responding.
+    """
+
+    chunk_size = 2000
+
+    def __init__(self, queryset: QuerySet, schema: Type[Schema], **kwargs):
+        super().__init__(
+            CSVRenderer.iter_lines(_schema_rows(queryset, schema)),
+            content_type=CSVRenderer.media_type,
+            **kwargs,
+        )
+
+
+class ExportFormat(Enum):
+    tsv: str = "tsv"
+    parquet: str = PARQUET
+    arrow: str = ARROW
+
+
+def export_response(
+    queryset: QuerySet,
+    schema: Type[Schema],
+    export_format: ExportFormat,
+    dictionary_encoded: Iterable[str] = (),
+) -> StreamingHttpResponse:
+    """
+    Stream a queryset in the requested export format.
+    :param dictionary_encoded: Columns with many repeated values, to make categorical
+        in Parquet/Arrow exports (see StreamingArrowResponse).
+    """
+    if export_format == ExportFormat.tsv:
+        return StreamingTSVResponse(queryset, schema)
+    return StreamingArrowResponse(
+        queryset, schema, export_format.value, set(dictionary_encoded)
+    )
+
+
+def _schema_rows(queryset: QuerySet, schema: Type[Schema]) -> Iterator[dict]:
+    for obj in queryset.iterator(chunk_size=StreamingTSVResponse.chunk_size):
+        yield schema.from_orm(obj).dict()
+
+
+def build_export_snapshots(catalogue_ids: Optional[List[str]] = None) -> List[str]:
+    """
+    (Re)build the export snapshots of Genome and Viral Catalogues, which are then served
+    (gzipped) by the export endpoints without any DB work, until their data next changes.
+    :param catalogue_ids: Only build snapshots for these (Genome or Viral) Catalogues. Default all.
+    :return: Descriptions of the snapshots built, e.g. ["genomes of mag-cat-v1.0 (1a2b3c...)"]
+    """
+    built = []
+    exports = [
+        (GENOMES_EXPORT_SNAPSHOT, GenomeCatalogue, "genomes", GenomeSchema, []),
+        (
+            VIRAL_FRAGMENTS_EXPORT_SNAPSHOT,
+            ViralCatalogue,
+            "viral_fragments",
+            ViralFragmentSchema,
+            ["cluster_representative"],
+        ),
+    ]
+    for kind, catalogue_model, related_name, schema, related in exports:
+        catalogues = catalogue_model.objects.all()
+        if catalogue_ids is not None:
+            catalogues = catalogues.filter(id__in=catalogue_ids)
+        for catalogue in catalogues:
+            if not slug_re.fullmatch(catalogue.id):
+                # Snapshots are stored by catalogue ID, which therefore has to be safe as a path
+                logging.warning(
+                    f"Not building a snapshot of {catalogue.id}: not a slug"
+                )
+                continue
+            rows = _schema_rows(
+                getattr(catalogue, related_name).select_related(*related), schema
+            )
+            snapshot = write_snapshot(kind, catalogue.id, CSVRenderer.iter_lines(rows))
+            built.append(f"{related_name} of {catalogue.id} ({snapshot.digest[:12]})")
+    return built
+
+
+def _marker_columns(
+    markers: Iterable[SampleMetadataMarker], reserved: Iterable[str]
+) -> Dict[int, str]:
+    """
+    Column names for metadata markers: the marker name, plus its type if the name is ambiguous.
+    :return: Marker ID -> column name
+    """
+    markers = list(markers)
+    names = [marker.name for marker in markers] + list(reserved)
+    return {
+        marker.id: (
+            marker.name
+            if names.count(marker.name) == 1
+            else f"{marker.name} ({marker.type})"
+        )
+        for marker in markers
+    }
+
+
+def metadata_matrix_rows(
+    data: QuerySet, owner: str, owner_columns: Dict[str, str]
+) -> Iterator[dict]:
+    """
+    Pivot structured metadata into a matrix: one row per sample (or animal) with any data,
+    and one column per metadata marker. Makes one query for the markers, and one ordered scan
+    over the data.
+    :param data: SampleStructuredDatum or AnimalStructuredDatum queryset, e.g. filtered by system
+    :param owner: The data's foreign key to the sample/animal, i.e. "sample" or "animal"
+    :param owner_columns: Leading columns, as column name -> data field path,
+        e.g. {"accession": "sample", "sample_type": "sample__sample_type"}
+    """
+    markers = SampleMetadataMarker.objects.filter(
+        id__in=data.values("marker_id")
+    ).order_by("type", "name")
+    columns = _marker_columns(markers, reserved=owner_columns.keys())
+    values = (
+        data.order_by(owner)
+        .values_list(owner, *owner_columns.values(), "marker_id", "measurement")
+        .iterator(chunk_size=StreamingTSVResponse.chunk_size)
+    )
+    for _, owner_data in groupby(values, key=itemgetter(0)):
+        row = None
+        for datum in owner_data:
+            if row is None:
+                row = dict(zip(owner_columns.keys(), datum[1:-2]))
+                row.update(dict.fromkeys(columns.values()))
+            row[columns[datum[-2]]] = datum[-1]
+        yield row
+
+
+def _metadata_matrix_response(
+    data: QuerySet, owner: str, owner_columns: Dict[str, str]
+) -> StreamingHttpResponse:
+    return StreamingHttpResponse(
+        CSVRenderer.iter_lines(metadata_matrix_rows(data, owner, owner_columns)),
+        content_type=CSVRenderer.media_type,
+    )
+
 
-        for idx, obj in enumerate(data):
-            if idx == 0:
-                headers = self._flatten_data(obj).keys()
-                csv_data.writerow(headers)
-            csv_data.writerow(self._flatten_data(obj).values())
-        return stream.getvalue()
+class ContainmentLayout(Enum):
+    sparse: str = "sparse"
+    dense: str = "dense"
 
 
+def dense_containment_rows(
+    catalogue_id: str, min_containment: Optional[float] = None
+) -> Iterator[dict]:
+    """
+    A catalogue's Genome × Sample containment matrix: one row per genome (including any that are
+    contained in no samples), and one column per sample that contains any genome.
+    Absent (or below min_containment) containments are 0.
+    Makes one query for the samples, then one ordered scan over the genomes and their containments.
+    """
+    containment_filter = Q(genome__catalogue_id=catalogue_id)
+    if min_containment is not None:
+        containment_filter &= Q(containment__gte=min_containment)
+    samples = list(
+        GenomeSampleContainment.objects.filter(containment_filter)
+        .order_by("sample_id")
+        .values_list("sample_id", flat=True)
+        .distinct()
+    )
+    join_condition = Q(samples_containing__pk__isnull=False)
+    if min_containment is not None:
+        join_condition &= Q(samples_containing__containment__gte=min_containment)
+    values = (
+        Genome.objects.filter(catalogue_id=catalogue_id)
+        .annotate(
+            contained=FilteredRelation("samples_containing", condition=join_condition)
+        )
+        .order_by("accession")
+        .values_list("accession", "contained__sample_id", "contained__containment")
+        .iterator(chunk_size=StreamingTSVResponse.chunk_size)
+    )
+    for genome, genome_containments in groupby(values, key=itemgetter(0)):
+        row = {"genome": genome, **dict.fromkeys(samples, 0.0)}
+        for _, sample, containment in genome_containments:
+            if sample is not None:
+                row[sample] = containment
+        yield row
+
+
+METADATA_DICTIONARY_ENCODED = [
+    "marker__name",
+    "marker__type",
+    "marker__canonical_url",
+    "units",
+]
+
 export_api = NinjaAPI(
     title="HoloFood Data Portal Export API",
-    description="Download TSV exports of the HoloFood Data Portal data.",
+    description="Download TSV exports of the HoloFood Data Portal data. "
+    "Add `?format=parquet` or `?format=arrow` for (typed, compressed) Apache Parquet "
+    "or Arrow IPC stream files instead.",
     urls_namespace="export",
     csrf=True,
     renderer=CSVRenderer(),
@@ -61,10 +301,43 @@ export_api = NinjaAPI(
     summary="Fetch a list of Samples as a TSV",
     url_name="samples_list",
 )
-def list_samples(
+def list_samples(request, format: ExportFormat = ExportFormat.tsv):
+    return export_response(
+        Sample.objects.all(), SampleSlimSchema, format, dictionary_encoded=["animal"]
+    )
+
+
+@export_api.get(
+    "/samples/metadata",
+    response=List[Dict[str, Optional[str]]],
+    summary="Fetch a matrix of all Samples' metadata as a TSV",
+    description="One row per Sample (that has any matching metadata), "
+    "and one column per metadata marker. "
+    "Optionally filtered by the Samples' system and type, and by the markers' type.",
+    url_name="samples_metadata_matrix",
+)
+def get_samples_metadata_matrix(
     request,
+    system: Optional[System] = None,
+    sample_type: Optional[SampleType] = None,
+    marker_type: Optional[str] = None,
 ):
-    return Sample.objects.all()
+    data = SampleStructuredDatum.objects.all()
+    if system:
+        data = data.filter(sample__animal__system=system.value)
+    if sample_type:
+        data = data.filter(sample__sample_type=sample_type.value)
+    if marker_type:
+        data = data.filter(marker__type=marker_type)
+    return _metadata_matrix_response(
+        data,
+        "sample",
+        {
+            "accession": "sample",
+            "animal": "sample__animal",
+            "sample_type": "sample__sample_type",
+        },
+    )
 
 
 @export_api.get(
@@ -74,9 +347,16 @@ def list_samples(
     description="Retrieve a table of metadata for a single Sample by its ENA accession.",
     url_name="sample_metadata_list",
 )
-def get_sample_metadata(request, sample_accession: str):
+def get_sample_metadata(
+    request, sample_accession: str, format: ExportFormat = ExportFormat.tsv
+):
     sample = get_object_or_404(Sample, accession=sample_accession)
-    return sample.structured_metadata.all()
+    return export_response(
+        sample.structured_metadata.all(),
+        SampleStructuredDatumSchema,
+        format,
+        dictionary_encoded=METADATA_DICTIONARY_ENCODED,
+    )
 
 
 @export_api.get(
@@ -85,10 +365,37 @@ def get_sample_metadata(request, sample_accession: str):
     summary="Fetch a list of Animals (host-level BioSamples) as a TSV",
     url_name="animals_list",
 )
-def list_animals(
+def list_animals(request, format: ExportFormat = ExportFormat.tsv):
+    return export_response(
+        Animal.objects.all(),
+        AnimalSlimSchema,
+        format,
+        dictionary_encoded=["sample_types"],
+    )
+
+
+@export_api.get(
+    "/animals/metadata",
+    response=List[Dict[str, Optional[str]]],
+    summary="Fetch a matrix of all Animals' metadata as a TSV",
+    description="One row per Animal (that has any matching metadata), "
+    "and one column per metadata marker. "
+    "Optionally filtered by the Animals' system, and by the markers' type.",
+    url_name="animals_metadata_matrix",
+)
+def get_animals_metadata_matrix(
     request,
+    system: Optional[System] = None,
+    marker_type: Optional[str] = None,
 ):
-    return Animal.objects.all()
+    data = AnimalStructuredDatum.objects.all()
+    if system:
+        data = data.filter(animal__system=system.value)
+    if marker_type:
+        data = data.filter(marker__type=marker_type)
+    return _metadata_matrix_response(
+        data, "animal", {"accession": "animal", "system": "animal__system"}
+    )
 
 
 @export_api.get(
@@ -98,21 +405,89 @@ def list_animals(
     description="Retrieve a table of metadata for a single Animal by its BioSamples accession.",
     url_name="animal_metadata_list",
 )
-def get_animal_metadata(request, animal_accession: str):
+def get_animal_metadata(
+    request, animal_accession: str, format: ExportFormat = ExportFormat.tsv
+):
     animal = get_object_or_404(Animal, accession=animal_accession)
-    return animal.structured_metadata.all()
+    return export_response(
+        animal.structured_metadata.all(),
+        AnimalStructuredDatumSchema,
+        format,
+        dictionary_encoded=METADATA_DICTIONARY_ENCODED,
+    )
 
 
 @export_api.get(
     "/genome-catalogues/{catalogue_id}/genomes",
     response=List[GenomeSchema],
     summary="Fetch the list of Genomes from a Catalogue as a TSV",
-    description="Download a TSV export of the Genome Catalogue MAGs",
+    description="Download a TSV export of the Genome Catalogue MAGs. "
+    "Sent gzip-compressed (with Range support) to clients that accept it.",
     url_name="genomes_list",
 )
-def list_genome_catalogue_genomes(request, catalogue_id: str):
+def list_genome_catalogue_genomes(
+    request, catalogue_id: str, format: ExportFormat = ExportFormat.tsv
+):
+    if format == ExportFormat.tsv:
+        snapshot = get_snapshot(GENOMES_EXPORT_SNAPSHOT, catalogue_id)
+        if snapshot:
+            return snapshot_response(request, snapshot)
+    catalogue = get_object_or_404(GenomeCatalogue, id=catalogue_id)
+    return export_response(
+        catalogue.genomes.all(),
+        GenomeSchema,
+        format,
+        dictionary_encoded=["cluster_representative", "taxonomy"],
+    )
+
+
+@export_api.get(
+    "/genome-catalogues/{catalogue_id}/containment",
+    response=List[Dict[str, Optional[str]]],
+    summary="Fetch the Genome × Sample containment matrix of a Catalogue, as a TSV",
+    description="Every containment of the Catalogue's Genomes in Samples. "
+    "The `sparse` layout (default) has one `genome`, `sample`, `containment` row per containment. "
+    "The `dense` layout has one row per Genome and one column per Sample, "
+    "with 0 for no containment, and is gzip-compressed for clients that accept it. "
+    "Containments below `min_containment` are left out (or 0).",
+    url_name="genome_catalogue_containment",
+)
+def get_genome_catalogue_containment(
+    request,
+    catalogue_id: str,
+    min_containment: float = Query(None, ge=0, le=1),
+    layout: ContainmentLayout = ContainmentLayout.sparse,
+):
     catalogue = get_object_or_404(GenomeCatalogue, id=catalogue_id)
-    return catalogue.genomes.all()
+    if layout == ContainmentLayout.sparse:
+        containments = GenomeSampleContainment.objects.catalogue_matrix(
+            catalogue.id, min_containment
+        )
+        rows = (
+            {"genome": genome, "sample": sample, "containment": containment}
+            for genome, sample, containment in containments.iterator(
+                chunk_size=StreamingTSVResponse.chunk_size
+            )
+        )
+        return StreamingHttpResponse(
+            CSVRenderer.iter_lines(rows), content_type=CSVRenderer.media_type
+        )
+
+    lines = (
+        line.encode()
+        for line in CSVRenderer.iter_lines(
+            dense_containment_rows(catalogue.id, min_containment)
+        )
+    )
+    accepts_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+    response = StreamingHttpResponse(
+        compress_sequence(lines) if accepts_gzip else lines,
+        content_type=CSVRenderer.media_type,
+    )
+    if accepts_gzip:
+        response["Content-Encoding"] = "gzip"
+    response["Vary"] = "Accept-Encoding"
+    return response
 
 
 @export_api.get(
@@ -127,18 +502,37 @@ def list_genome_catalogue_genomes(request, catalogue_id: str):
     "to find samples which contain the kmers of genome.",
     url_name="get_samples_containing_genome",
 )
-def get_genome(request, genome_catalogue_id: str, genome_id: str):
+def get_genome(
+    request,
+    genome_catalogue_id: str,
+    genome_id: str,
+    format: ExportFormat = ExportFormat.tsv,
+):
     genome = get_object_or_404(Genome, accession=genome_id)
-    return genome.samples_containing
+    return export_response(
+        genome.samples_containing.all(), GenomeSampleContainmentSchema, format
+    )
 
 
 @export_api.get(
     "/viral-catalogues/{catalogue_id}/fragments",
     response=List[ViralFragmentSchema],
     summary="Fetch the list of Viral Fragments (sequences) from a Catalogue as a TSV",
-    description="Download a TSV export of the Viral Catalogue fragments",
+    description="Download a TSV export of the Viral Catalogue fragments. "
+    "Sent gzip-compressed (with Range support) to clients that accept it.",
     url_name="viral_fragments_list",
 )
-def list_viral_catalogue_fragments(request, catalogue_id: str):
+def list_viral_catalogue_fragments(
+    request, catalogue_id: str, format: ExportFormat = ExportFormat.tsv
+):
+    if format == ExportFormat.tsv:
+        snapshot = get_snapshot(VIRAL_FRAGMENTS_EXPORT_SNAPSHOT, catalogue_id)
+        if snapshot:
+            return snapshot_response(request, snapshot)
     catalogue = get_object_or_404(ViralCatalogue, id=catalogue_id)
-    return catalogue.viral_fragments.all()
+    return export_response(
+        catalogue.viral_fragments.select_related("cluster_representative"),
+        ViralFragmentSchema,
+        format,
+        dictionary_encoded=["mgnify_analysis_accession", "taxonomy"],
+    )
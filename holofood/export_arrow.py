@@ -0,0 +1,254 @@
+import json
+from datetime import datetime
+from enum import Enum
+from typing import (
+    Any,
+    Collection,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Type,
+)
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from ninja import Schema
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST, ModelField
+
+PARQUET = "parquet"
+ARROW = "arrow"
+
+MEDIA_TYPES = {
+    PARQUET: "application/vnd.apache.parquet",
+    ARROW: "application/vnd.apache.arrow.stream",
+}
+
+_SCALAR_TYPES = [
+    (bool, pa.bool_()),
+    (int, pa.int64()),
+    (float, pa.float64()),
+    (datetime, pa.timestamp("us", tz="UTC")),
+]
+
+CATEGORICAL = pa.dictionary(pa.int32(), pa.string())
+
+
+class ArrowColumn(NamedTuple):
+    """
+    One column of an Arrow export: a (possibly nested) field of the exported schema.
+    """
+
+    path: List[str]  # e.g. ["marker", "name"] for the `marker__name` column
+    type: pa.DataType
+    is_json: bool = False  # free-form (or recursive) values, written as JSON text
+
+    @property
+    def name(self) -> str:
+        # Same column names as the TSV export
+        return "__".join(self.path)
+
+
+def _is_categorical(schema: Type[BaseModel], field_name: str) -> bool:
+    """
+    Whether a schema field is a model field with choices, e.g. Sample.sample_type.
+    """
+    model = getattr(getattr(schema, "Config", None), "model", None)
+    if model is None:
+        return False
+    try:
+        return bool(model._meta.get_field(field_name).choices)
+    except FieldDoesNotExist:
+        # E.g. a resolved field like canonical_url
+        return False
+
+
+def _field_type(field: ModelField, categorical: bool) -> Optional[pa.DataType]:
+    """
+    The Arrow type of a schema field, or None if it is free-form JSON (e.g. metadata).
+    """
+    if field.shape == SHAPE_LIST:
+        item_type = _field_type(field.sub_fields[0], categorical)
+        return None if item_type is None else pa.list_(item_type)
+    if not isinstance(field.type_, type):
+        return None
+    for python_type, arrow_type in _SCALAR_TYPES:
+        if issubclass(field.type_, python_type):
+            return arrow_type
+    if issubclass(field.type_, (str, Enum)):
+        return CATEGORICAL if categorical else pa.string()
+    return None
+
+
+def arrow_columns(
+    schema: Type[BaseModel],
+    dictionary_encoded: Collection[str] = (),
+    _prefix: List[str] = None,
+    _ancestors: tuple = (),
+) -> Iterator[ArrowColumn]:
+    """
+    The typed columns of an export of a schema.
+    Nested schemas are flattened (like the TSV export), except recursive ones (which are JSON text).
+    :param schema: E.g. GenomeSchema
+    :param dictionary_encoded: Names of (string) columns with many repeated values, e.g. "taxonomy",
+        to dictionary-encode (i.e. make categorical). Fields with choices always are.
+    """
+    prefix = _prefix or []
+    for name, field in schema.__fields__.items():
+        path = prefix + [name]
+        if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+            if field.type_ in _ancestors + (schema,):
+                yield ArrowColumn(path, pa.string(), is_json=True)
+            else:
+                yield from arrow_columns(
+                    field.type_, dictionary_encoded, path, _ancestors + (schema,)
+                )
+            continue
+        categorical = (
+            _is_categorical(schema, name) or "__".join(path) in dictionary_encoded
+        )
+        arrow_type = _field_type(field, categorical)
+        if arrow_type is None:
+            # Free-form JSON, whose keys vary by object
+            yield ArrowColumn(path, pa.string(), is_json=True)
+        else:
+            yield ArrowColumn(path, arrow_type)
+
+
+def _column_value(row: dict, column: ArrowColumn) -> Any:
+    value = row
+    for key in column.path:
+        if value is None:
+            return None
+        value = value.get(key)
+    if column.is_json and value is not None:
+        return json.dumps(value)
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def arrow_batches(
+    rows: Iterable[dict], columns: List[ArrowColumn], batch_size: int
+) -> Iterator[pa.RecordBatch]:
+    """
+    Convert (serialized) rows into record batches of at most batch_size rows, one batch at a time.
+    """
+    schema = pa.schema([(column.name, column.type) for column in columns])
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield _record_batch(batch, columns, schema)
+            batch = []
+    if batch:
+        yield _record_batch(batch, columns, schema)
+
+
+def _record_batch(
+    rows: List[dict], columns: List[ArrowColumn], schema: pa.Schema
+) -> pa.RecordBatch:
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array([_column_value(row, column) for row in rows], type=column.type)
+            for column in columns
+        ],
+        schema=schema,
+    )
+
+
+class _ChunkBuffer:
+    """
+    A write-only file-like object for Arrow writers, which keeps the written bytes only until they are taken.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def writable(self) -> bool:
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_arrow_export(
+    rows: Iterable[dict],
+    schema: Type[BaseModel],
+    export_format: str,
+    batch_size: int,
+    dictionary_encoded: Collection[str] = (),
+) -> Iterator[bytes]:
+    """
+    Write rows as a Parquet file (one row group per batch) or an Arrow IPC stream,
+    yielding the bytes written after each batch.
+    """
+    columns = list(arrow_columns(schema, dictionary_encoded))
+    arrow_schema = pa.schema([(column.name, column.type) for column in columns])
+    sink = _ChunkBuffer()
+    if export_format == PARQUET:
+        writer = pq.ParquetWriter(sink, arrow_schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(sink, arrow_schema)
+    try:
+        for batch in arrow_batches(rows, columns, batch_size):
+            writer.write_batch(batch)
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+class StreamingArrowResponse(StreamingHttpResponse):
+    """
+    Streams a (large) queryset as Parquet or Arrow IPC, with columns typed by the schema's fields:
+    numbers stay numbers, fields with choices (and any dictionary_encoded columns) are categorical,
+    and free-form JSON fields are JSON text.
+    Like StreamingTSVResponse, objects are fetched and written one batch at a time.
+    """
+
+    batch_size = 10000
+
+    def __init__(
+        self,
+        queryset: QuerySet,
+        schema: Type[Schema],
+        export_format: str,
+        dictionary_encoded: Collection[str] = (),
+        **kwargs,
+    ):
+        rows = (
+            schema.from_orm(obj).dict()
+            for obj in queryset.iterator(chunk_size=self.batch_size)
+        )
+        super().__init__(
+            iter_arrow_export(
+                rows, schema, export_format, self.batch_size, dictionary_encoded
+            ),
+            content_type=MEDIA_TYPES[export_format],
+            **kwargs,
+        )
@@ -0,0 +1,219 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.core.validators import slug_re
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import parse_etags
+
+from holofood.utils import holofood_config
+
+MEDIA_TYPE = "text/tab-separated-values"
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class ExportSnapshot(NamedTuple):
+    """
+    A gzipped TSV export, prebuilt for serving without any DB work.
+    """
+
+    path: Path
+    digest: str  # SHA-256 of the uncompressed TSV, i.e. the data version
+    size: int  # bytes, compressed
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.digest}"'
+
+    @property
+    def gzip_etag(self) -> str:
+        return f'"{self.digest}-gzip"'
+
+
+def _snapshots_dir(kind: str, key: str) -> Optional[Path]:
+    """
+    :param kind: Type of export, e.g. "genomes"
+    :param key: What is exported, e.g. a catalogue ID
+    :return: The directory of the export's snapshots, or None if kind or key isn't a slug
+        (e.g. a catalogue ID from a URL, like "..", which must not become a path).
+    """
+    if not (slug_re.fullmatch(kind) and slug_re.fullmatch(key)):
+        return None
+    # Relative to the project, not the working directory, so that every process
+    # (web workers and management commands) uses the same snapshots
+    return Path(settings.BASE_DIR) / holofood_config.exports.snapshots_dir / kind / key
+
+
+def get_snapshot(kind: str, key: str) -> Optional[ExportSnapshot]:
+    """
+    The current snapshot of an export, if one has been built (and not invalidated since).
+    Reads only the snapshot's small manifest file.
+    """
+    directory = _snapshots_dir(kind, key)
+    if directory is None:
+        return None
+    try:
+        manifest = json.loads((directory / "current.json").read_text())
+    except (FileNotFoundError, NotADirectoryError, ValueError):
+        return None
+    path = directory / manifest["file"]
+    if not path.is_file():
+        return None
+    return ExportSnapshot(path=path, digest=manifest["digest"], size=manifest["size"])
+
+
+def write_snapshot(kind: str, key: str, lines: Iterable[str]) -> ExportSnapshot:
+    """
+    Write (gzip) an export's TSV lines as its new current snapshot, replacing any previous one.
+    The file is named by the digest of its content, and swapped in atomically.
+    """
+    directory = _snapshots_dir(kind, key)
+    if directory is None:
+        raise ValueError(f"Export snapshots need slugs, not {kind!r} and {key!r}")
+    directory.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as tmp:
+        # mtime=0 so that identical data gives identical files
+        with gzip.GzipFile(fileobj=tmp, mode="wb", mtime=0) as gz:
+            for line in lines:
+                encoded = line.encode("utf-8")
+                digest.update(encoded)
+                gz.write(encoded)
+    filename = f"{digest.hexdigest()}.tsv.gz"
+    path = directory / filename
+    os.replace(tmp.name, path)
+
+    snapshot = ExportSnapshot(
+        path=path, digest=digest.hexdigest(), size=path.stat().st_size
+    )
+    manifest = {
+        "file": filename,
+        "digest": snapshot.digest,
+        "size": snapshot.size,
+        "created": timezone.now().isoformat(),
+    }
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, suffix=".tmp", delete=False
+    ) as tmp:
+        json.dump(manifest, tmp)
+    os.replace(tmp.name, directory / "current.json")
+
+    for old in directory.glob("*.tsv.gz"):
+        if old.name != filename:
+            old.unlink(missing_ok=True)
+    logging.info(f"Wrote {kind} export snapshot for {key}: {filename}")
+    return snapshot
+
+
+def delete_snapshot(kind: str, key: str):
+    """
+    Invalidate an export's snapshot, e.g. because its data changed.
+    Until it is rebuilt, the export is generated on each request.
+    """
+    directory = _snapshots_dir(kind, key)
+    if directory is not None and directory.exists():
+        shutil.rmtree(directory, ignore_errors=True)
+        logging.info(f"Deleted {kind} export snapshot for {key}")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    The (inclusive) byte range requested by a single-range `Range` header.
+    :return: (start, end), or None to serve the whole file (e.g. multiple or unparseable ranges).
+    """
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header)
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range, e.g. the last 500 bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def _read_file(
+    path: Path, start: int = 0, length: Optional[int] = None
+) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = f.read(
+                READ_CHUNK_SIZE
+                if remaining is None
+                else min(READ_CHUNK_SIZE, remaining)
+            )
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def _read_decompressed(path: Path) -> Iterator[bytes]:
+    with gzip.open(path, "rb") as f:
+        while chunk := f.read(READ_CHUNK_SIZE):
+            yield chunk
+
+
+def snapshot_response(request, snapshot: ExportSnapshot) -> HttpResponse:
+    """
+    Serve a snapshot: gzipped as-is (Content-Encoding: gzip, with Range support) to clients that
+    accept gzip, otherwise decompressed on the fly. Supports conditional requests by ETag.
+    """
+    accepts_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+    etag = snapshot.gzip_etag if accepts_gzip else snapshot.etag
+
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponse(status=304)
+    elif not accepts_gzip:
+        response = StreamingHttpResponse(
+            _read_decompressed(snapshot.path), content_type=MEDIA_TYPE
+        )
+    else:
+        byte_range = None
+        if "Range" in request.headers and request.headers.get("If-Range", etag) == etag:
+            try:
+                byte_range = _parse_range(request.headers["Range"], snapshot.size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{snapshot.size}"
+                return response
+        if byte_range is None:
+            response = StreamingHttpResponse(
+                _read_file(snapshot.path), content_type=MEDIA_TYPE
+            )
+            response["Content-Length"] = snapshot.size
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                _read_file(snapshot.path, start, end - start + 1),
+                status=206,
+                content_type=MEDIA_TYPE,
+            )
+            response["Content-Length"] = end - start + 1
+            response["Content-Range"] = f"bytes {start}-{end}/{snapshot.size}"
+        response["Content-Encoding"] = "gzip"
+        response["Accept-Ranges"] = "bytes"
+
+    response["ETag"] = etag
+    response["Vary"] = "Accept-Encoding"
+    return response
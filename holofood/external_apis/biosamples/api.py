@@ -1,28 +1,20 @@
 import logging
 from json import JSONDecodeError
-from typing import List
+from typing import Iterator, List
 
 import requests
 
+from holofood.external_apis.biosamples.auth import WEBIN_TOKEN
+from holofood.external_apis.ena.browser_api import SampleAttribute
+from holofood.external_apis.http import session
 from holofood.utils import holofood_config
 
 API_ROOT = holofood_config.biosamples.api_root.rstrip("/")
 
 
 def get_auth_headers():
-    if holofood_config.biosamples.username:
-        auth_data = {
-            "authRealms": ["ENA"],
-            "username": holofood_config.biosamples.username,
-            "password": holofood_config.biosamples.password,
-        }
-        token_response = requests.post(
-            f"{holofood_config.biosamples.auth_url}", json=auth_data
-        )
-        if not token_response.status_code == 200:
-            logging.error(token_response.text)
-            raise Exception("Could not get token for BioSamples API")
-        return {"Authorization": f"Bearer {token_response.text}"}
+    if WEBIN_TOKEN:
+        return {"Authorization": f"Bearer {WEBIN_TOKEN.get_token()}"}
     return {}
 
 
@@ -33,7 +25,7 @@ def get_sample_structured_data(sample: str) -> dict:
 
     logging.info(f"Fetching {sample} structured data from Biosamples {API_ROOT = }")
 
-    response = requests.get(f"{API_ROOT}/structureddata/{sample}", headers=auth_headers)
+    response = session.get(f"{API_ROOT}/structureddata/{sample}", headers=auth_headers)
     if response.status_code == requests.codes.not_found:
         logging.info(f"No structureddata for sample {sample}")
         return {}
@@ -56,7 +48,7 @@ def get_biosample(sample: str) -> dict:
 
     logging.info(f"Fetching {sample} from Biosamples {API_ROOT = }")
 
-    response = requests.get(f"{API_ROOT}/samples/{sample}", headers=auth_headers)
+    response = session.get(f"{API_ROOT}/samples/{sample}", headers=auth_headers)
     if response.status_code == requests.codes.not_found:
         logging.info(f"No biosample for sample {sample}")
         return {}
@@ -68,13 +60,43 @@ def get_biosample(sample: str) -> dict:
     return data
 
 
-def get_project_samples(
+def structured_data_from_biosample(biosample: dict) -> dict:
+    """
+    Extract the structured data sections from a biosample document (e.g. from `get_biosample`).
+    :param biosample: Dict of the JSON for a biosample.
+    :return: Dict of metadata sections keyed by type, like `get_sample_structured_data` returns.
+    """
+    return {
+        data_section.get("type"): data_section.get("content", [])
+        for data_section in biosample.get("structuredData", [])
+    }
+
+
+def checklist_from_biosample(biosample: dict) -> List[SampleAttribute]:
+    """
+    Convert the characteristics of a biosample document into checklist items.
+    These mirror the sample attributes of the ENA checklist, so avoid a separate ENA request.
+    :param biosample: Dict of the JSON for a biosample.
+    :return: List of checklist items, like `get_checklist_metadata` returns.
+    """
+    return [
+        SampleAttribute(
+            tag=characteristic,
+            value=values[0].get("text"),
+            units=values[0].get("unit"),
+        )
+        for characteristic, values in biosample.get("characteristics", {}).items()
+        if len(values) > 0
+    ]
+
+
+def get_project_sample_pages(
     project_attr: str,
     webin_filter: List[str],
     max_pages: int = None,
     begin_at_cursor: str = None,
     updated_since: str = None,
-) -> List[dict]:
+) -> Iterator[List[dict]]:
     """
     Generator for pages of biosamples for a specific project. Each page is up to 200 biosamples.
 
@@ -83,12 +105,10 @@ def get_project_samples(
     :param project_attr: e.g. HoloFood - the biosamples search value for attr:project:<value>
     :param webin_filter: list of webin IDs to limit results to. Discards samples from other submitters.
     :param max_pages: Max number of pages to yield.
-    :return: List of dicts, each representing the JSON for a biosample.
+    :return: Lists of dicts, each list being a page and each dict representing the JSON for a biosample.
     """
-    auth_headers = get_auth_headers()
-    if auth_headers:
+    if WEBIN_TOKEN:
         logging.info("Using authenticated BioSamples API")
-        logging.info(auth_headers)
 
     logging.info(
         f"Fetching samples from Biosamples {API_ROOT = } for {project_attr = }"
@@ -102,7 +122,8 @@ def get_project_samples(
     pages = 0
 
     while next_url is not None:
-        response = requests.get(next_url, headers=auth_headers)
+        # Token is cached, but may be refreshed during a long pagination
+        response = session.get(next_url, headers=get_auth_headers())
         logging.info(f"Fetching samples page from Biosamples {next_url}")
         try:
             data = response.json()
@@ -121,6 +142,31 @@ def get_project_samples(
                 next_url = None
 
         samples = data.get("_embedded", {}).get("samples", [])
-        for sample in samples:
-            if sample.get("webinSubmissionAccountId") in webin_filter:
-                yield sample
+        yield [
+            sample
+            for sample in samples
+            if sample.get("webinSubmissionAccountId") in webin_filter
+        ]
+
+
+def get_project_samples(
+    project_attr: str,
+    webin_filter: List[str],
+    max_pages: int = None,
+    begin_at_cursor: str = None,
+    updated_since: str = None,
+) -> Iterator[dict]:
+    """
+    Generator for biosamples for a specific project, flattened from the pages of `get_project_sample_pages`.
+
+    :param updated_since: ISO8601 formatted date string to filter for samples updated since
+    :param begin_at_cursor: Starting cursor value for pagination
+    :param project_attr: e.g. HoloFood - the biosamples search value for attr:project:<value>
+    :param webin_filter: list of webin IDs to limit results to. Discards samples from other submitters.
+    :param max_pages: Max number of pages to fetch.
+    :return: Dicts, each representing the JSON for a biosample.
+    """
+    for page in get_project_sample_pages(
+        project_attr, webin_filter, max_pages, begin_at_cursor, updated_since
+    ):
+        yield from page
@@ -0,0 +1,88 @@
+import base64
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Optional, Tuple
+
+from holofood.external_apis.http import session
+from holofood.utils import holofood_config
+
+
+class WebinTokenProvider:
+    """
+    Fetches a JWT from the Webin auth service, caches it,
+    and refreshes it shortly before it expires.
+    Thread-safe: concurrent callers share one token, and only one of them refreshes it.
+    """
+
+    # Used if the token's expiry cannot be decoded
+    fallback_lifetime = timedelta(minutes=10)
+
+    def __init__(
+        self,
+        auth_url: str,
+        username: str,
+        password: str,
+        refresh_margin: timedelta = timedelta(minutes=1),
+    ):
+        self.auth_url = auth_url
+        self.username = username
+        self.password = password
+        self.refresh_margin_seconds = refresh_margin.total_seconds()
+        self._lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._expires_at: float = 0
+
+    @staticmethod
+    def decode_expiry(token: str) -> Optional[float]:
+        """
+        Read the expiry time from a JWT's payload, without verifying its signature.
+        :param token: JWT string, e.g. header.payload.signature
+        :return: Expiry as a unix timestamp, or None if it could not be read.
+        """
+        try:
+            payload = token.split(".")[1]
+            payload += "=" * (-len(payload) % 4)
+            return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+        except (IndexError, ValueError, KeyError, TypeError):
+            return None
+
+    def _fetch_token(self) -> Tuple[str, float]:
+        logging.info(f"Fetching Webin auth token from {self.auth_url}")
+        auth_data = {
+            "authRealms": ["ENA"],
+            "username": self.username,
+            "password": self.password,
+        }
+        token_response = session.post(f"{self.auth_url}", json=auth_data)
+        if not token_response.status_code == 200:
+            logging.error(token_response.text)
+            raise Exception("Could not get token for BioSamples API")
+        token = token_response.text
+        expires_at = self.decode_expiry(token)
+        if expires_at is None:
+            logging.warning("Could not decode expiry of Webin auth token")
+            expires_at = time.time() + self.fallback_lifetime.total_seconds()
+        return token, expires_at
+
+    def get_token(self) -> str:
+        with self._lock:
+            if (
+                self._token is None
+                or time.time() >= self._expires_at - self.refresh_margin_seconds
+            ):
+                self._token, self._expires_at = self._fetch_token()
+            return self._token
+
+
+if holofood_config.biosamples.username:
+    WEBIN_TOKEN = WebinTokenProvider(
+        holofood_config.biosamples.auth_url,
+        holofood_config.biosamples.username,
+        holofood_config.biosamples.password,
+        holofood_config.biosamples.token_refresh_margin,
+    )
+else:
+    WEBIN_TOKEN = None
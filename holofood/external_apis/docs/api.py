@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, List, NamedTuple, Optional, Set
+
+import requests
+
+from holofood.external_apis.http import session
+from holofood.utils import holofood_config
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class _SectionsIndex(NamedTuple):
+    sections: List[dict]
+    texts: List[str]  # lowercased text of each section
+    trigrams: Dict[str, Set[int]]  # trigram -> positions of sections containing it
+
+    @classmethod
+    def build(cls, sections: List[dict]) -> "_SectionsIndex":
+        texts = [section.get("text", "").lower() for section in sections]
+        trigrams = defaultdict(set)
+        for position, text in enumerate(texts):
+            for trigram in _trigrams(text):
+                trigrams[trigram].add(position)
+        return cls(sections, texts, dict(trigrams))
+
+
+class DocsSearchIndex:
+    """
+    In-process search over the sections of the Quarto docs site (its search.json).
+
+    The sections are downloaded once and indexed by trigram. Once older than `ttl`, they are
+    revalidated in a background thread with a conditional request (ETag / Last-Modified).
+    Searches never wait for the docs site: they use whatever index is already in memory
+    (initially none, so nothing is found until the first download completes).
+    """
+
+    def __init__(
+        self, url: str, ttl: timedelta, error_ttl: timedelta, timeout: timedelta
+    ):
+        self.url = url
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.timeout = timeout
+        self._index = _SectionsIndex.build([])
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self._next_refresh_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Download (if modified) and re-index the docs sections now.
+        On failure, the previous index is kept and retried after `error_ttl`.
+        """
+        headers = {}
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified:
+            headers["If-Modified-Since"] = self._last_modified
+        try:
+            logging.info(f"Getting docs search JSON from {self.url}")
+            response = session.get(
+                self.url, headers=headers, timeout=self.timeout.total_seconds()
+            )
+            if response.status_code == requests.codes.not_modified:
+                logging.info("Docs search JSON is unchanged")
+            else:
+                response.raise_for_status()
+                index = _SectionsIndex.build(response.json())
+                self._index = index
+                self._etag = response.headers.get("ETag")
+                self._last_modified = response.headers.get("Last-Modified")
+                logging.info(f"Indexed {len(index.sections)} docs sections")
+        except Exception as e:
+            logging.error("Failed to retrieve docs search items from Quarto")
+            logging.error(e)
+            self._next_refresh_at = time.time() + self.error_ttl.total_seconds()
+        else:
+            self._next_refresh_at = time.time() + self.ttl.total_seconds()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or time.time() < self._next_refresh_at:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def search(self, query: str) -> List[dict]:
+        """
+        Find docs sections whose text contains the query, case-insensitively.
+        :param query: Text to search for, e.g. "metabolomics"
+        :return: List of Quarto search sections (dicts with title, section, text, href), in docs order.
+        """
+        self._refresh_in_background()
+        index = self._index
+        query = (query or "").lower()
+        if not query:
+            return []
+        if len(query) < 3:
+            positions = range(len(index.sections))
+        else:
+            candidate_sets = sorted(
+                (index.trigrams.get(trigram, set()) for trigram in _trigrams(query)),
+                key=len,
+            )
+            positions = sorted(set.intersection(*candidate_sets))
+        # Trigrams may match out of order, so confirm each candidate
+        return [
+            index.sections[position]
+            for position in positions
+            if query in index.texts[position]
+        ]
+
+
+docs_search_index = DocsSearchIndex(
+    url=holofood_config.docs.docs_url + "/search.json",
+    ttl=holofood_config.docs.search_index_ttl,
+    error_ttl=holofood_config.docs.search_index_error_ttl,
+    timeout=holofood_config.docs.search_index_timeout,
+)
@@ -7,6 +7,7 @@ from xsdata.formats.dataclass.parsers.config import ParserConfig
 from xsdata.formats.dataclass.parsers import XmlParser
 
 from holofood.external_apis.ena.auth import ENA_AUTH
+from holofood.external_apis.http import session
 from holofood.utils import holofood_config
 
 API_ROOT = holofood_config.ena.browser_api_root.rstrip("/")
@@ -66,7 +67,7 @@ def get_checklist_metadata(sample: str) -> List[SampleAttribute]:
     logging.info(
         f"Fetching checklist metadata from ENA {API_ROOT = } for sample {sample}"
     )
-    response = requests.get(f"{API_ROOT}/xml/{sample}", auth=ENA_AUTH)
+    response = session.get(f"{API_ROOT}/xml/{sample}", auth=ENA_AUTH)
     if response.status_code != requests.codes.ok:
         logging.info(
             f"No metadata available for {sample}. Status code {response.status_code}"
@@ -1,30 +1,111 @@
 from __future__ import annotations
 
 import logging
-from json import JSONDecodeError
-from typing import Optional
+from typing import List, Optional
 
 import requests
 
+from holofood.caching import StaleWhileRevalidateCache
 from holofood.external_apis.ena.auth import ENA_AUTH
+from holofood.external_apis.http import session
 from holofood.utils import holofood_config
 
 API_ROOT = holofood_config.ena.portal_api_root.rstrip("/")
 
 
+READ_RUN_FIELDS = [
+    "sample_accession",
+    "sample_title",
+    "experiment_accession",
+    "experiment_title",
+    "study_accession",
+    "study_title",
+    "run_accession",
+    "run_alias",
+    "read_count",
+    "base_count",
+]
+
+filereport_cache = StaleWhileRevalidateCache(
+    "ena-filereport",
+    ttl=holofood_config.ena.filereport_cache_ttl,
+    stale_ttl=holofood_config.ena.filereport_cache_stale_ttl,
+    negative_ttl=holofood_config.ena.filereport_cache_negative_ttl,
+    error_ttl=holofood_config.ena.filereport_cache_error_ttl,
+)
+
+
 def get_filereport(sample_accession: str) -> Optional[dict]:
     logging.info(f"Fetching sample filereport from ENA {API_ROOT = }")
     if ENA_AUTH:
         logging.info("Using authenticated ENA Portal API")
-    response = requests.get(
+    response = session.get(
         f"{API_ROOT}/filereport?result=read_run&accession={sample_accession}&format=json&"
-        f"fields=sample_title,experiment_accession,experiment_title,study_accession,study_title,"
-        f"run_accession,run_alias,read_count,base_count",
+        f"fields={','.join(READ_RUN_FIELDS[1:])}",
         auth=ENA_AUTH,
     )
-    try:
-        related_records = response.json()[0]
-    except (JSONDecodeError, KeyError):
+    # Errors (including malformed responses, like HTML error pages) raise,
+    # so that the filereport cache keeps serving any stale report rather than caching "no report"
+    response.raise_for_status()
+    if response.status_code == requests.codes.no_content or not response.text.strip():
+        # ENA's reply for a sample without any runs
         logging.warning(f"No ENA filereport response for {sample_accession}")
         return None
-    return related_records
+    related_records = response.json()
+    if not related_records:
+        logging.warning(f"No ENA filereport records for {sample_accession}")
+        return None
+    return related_records[0]
+
+
+def get_cached_filereport(sample_accession: str) -> Optional[dict]:
+    """
+    As `get_filereport`, but served from the filereport cache where possible.
+    Raises holofood.caching.UpstreamError if ENA failed (recently).
+    """
+    return filereport_cache.get(
+        sample_accession, lambda: get_filereport(sample_accession)
+    )
+
+
+def search_read_runs(
+    sample_accessions: List[str] = None, study_accession: str = None
+) -> List[dict]:
+    """
+    Fetch run-level records for many samples, or a whole study, in one ENA Portal API search.
+    :param sample_accessions: List of sample accessions (BioSamples or ENA), e.g. ["SAMEA1", "SAMEA2"].
+    :param study_accession: Study accession, e.g. "PRJEB1".
+    :return: List of read_run records, each with READ_RUN_FIELDS.
+    """
+    clauses = []
+    if study_accession:
+        clauses.append(f'study_accession="{study_accession}"')
+    if sample_accessions:
+        clauses.append(
+            " OR ".join(
+                f'sample_accession="{accession}"' for accession in sample_accessions
+            )
+        )
+    if not clauses:
+        raise ValueError("Either sample_accessions or study_accession is required")
+    query = " AND ".join(f"({clause})" for clause in clauses)
+
+    logging.info(f"Searching ENA for read runs {query[:100]}")
+    response = session.post(
+        f"{API_ROOT}/search",
+        data={
+            "result": "read_run",
+            "query": query,
+            "fields": ",".join(READ_RUN_FIELDS),
+            "format": "json",
+            "limit": 0,
+        },
+        auth=ENA_AUTH,
+    )
+    if response.status_code == requests.codes.no_content:
+        return []
+    if response.status_code != requests.codes.ok:
+        raise Exception(
+            f"ENA Portal API search failed with {response.status_code}: {response.text}"
+        )
+    return response.json()
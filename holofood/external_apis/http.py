@@ -0,0 +1,82 @@
+import logging
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+
+from holofood.instrumentation import record_http_call
+from holofood.utils import holofood_config
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter with keep-alive connection pools, retries, and a default timeout.
+    urllib3 keeps one pool per host, so TCP+TLS connections are reused between requests.
+    Calls are timed for the current request's metrics (see holofood.instrumentation).
+    """
+
+    def __init__(self, retries: int = None, timeout: float = None, **kwargs):
+        config = holofood_config.http
+        self.timeout = (
+            timeout if timeout is not None else config.request_timeout.total_seconds()
+        )
+        super().__init__(
+            pool_connections=config.pool_connections,
+            pool_maxsize=config.pool_maxsize,
+            max_retries=Retry(
+                total=retries if retries is not None else config.request_retries,
+                backoff_factor=config.retry_backoff_factor,
+                status_forcelist=config.retry_on_statuses,
+                raise_on_status=False,
+            ),
+            **kwargs,
+        )
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        with record_http_call(request.url) as call:
+            response = super().send(request, **kwargs)
+            call["status"] = response.status_code
+            return response
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = PooledHTTPAdapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Shared by all external API clients (and threads). urllib3 pools are thread-safe.
+session = _build_session()
+
+
+def get_pool_stats() -> Dict[str, dict]:
+    """
+    Summarise connection pool use per host, for all adapters mounted on the shared session.
+    :return: Dict keyed by host, e.g. {"www.ebi.ac.uk": {"requests": 10, "connections": 1, "reused": 9}}
+    """
+    stats = {}
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host_stats = stats.setdefault(
+                pool.host, {"requests": 0, "connections": 0, "reused": 0}
+            )
+            host_stats["requests"] += pool.num_requests
+            host_stats["connections"] += pool.num_connections
+            host_stats["reused"] += max(0, pool.num_requests - pool.num_connections)
+    return stats
+
+
+def log_pool_stats():
+    for host, host_stats in get_pool_stats().items():
+        logging.info(
+            f"HTTP pool for {host}: {host_stats['requests']} requests "
+            f"over {host_stats['connections']} connections"
+        )
@@ -1,12 +1,21 @@
 import csv
+import hashlib
 import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
 from contextlib import closing
 from json import JSONDecodeError
-from typing import List
+from typing import Callable, List, Optional
 
 import requests
+from django.core.cache import cache
+from django.utils.text import slugify
 
 from holofood.external_apis.metabolights.auth import MTBLS_AUTH
+from holofood.external_apis.http import session
+from holofood.metrics import observe_cache_lookup, HIT, STALE, MISS
 from holofood.utils import holofood_config, clean_keys
 
 API_ROOT = holofood_config.metabolights.api_root.rstrip("/")
@@ -31,76 +40,233 @@ def _parse_metabolights_response(response, as_json=True):
     return response.text
 
 
-def get_metabolights_assays(mtbls_accession: str, sample_accession: str) -> List[dict]:
-    logging.info(
-        f"Fetching metabolights details for {mtbls_accession} {sample_accession}"
-    )
+class SheetUnavailable(Exception):
+    pass
+
+
+STUDY_INDEX_CACHE_PREFIX = "metabolights-study-index"
+
+
+def _study_index_key(mtbls_accession: str) -> str:
+    return f"metabolights-study-sheets:{slugify(mtbls_accession)}"
+
+
+def _sheet_rows_key(mtbls_accession: str, sheet: dict, index_key: str) -> str:
+    # Hashed, since index keys (e.g. Sample Names) are free text
+    key_hash = hashlib.md5(index_key.encode()).hexdigest()
+    return f"{_study_index_key(mtbls_accession)}:{sheet['version']}:{key_hash}"
+
+
+def _download_sheet_index(
+    mtbls_accession: str,
+    filename: str,
+    index_by: Callable[[dict], Optional[str]],
+    previous: Optional[dict] = None,
+) -> Optional[dict]:
+    """
+    Download a metadata sheet (TSV), and cache its rows with one cache entry per index key.
+    If a previous download is given, the request is conditional (ETag / Last-Modified),
+    and the previous entries are reused if the sheet has not been modified.
+    :param mtbls_accession: MetaboLights study accession, e.g. MTBLS1
+    :param filename: Sheet filename within the study, e.g. s_MTBLS1.txt
+    :param index_by: Function returning the index key for a row (or None to skip the row).
+    :param previous: The previous result of this function for the same sheet, if any.
+    :return: Dict of etag, last_modified, version (of the cached rows), and when they expire.
+        None if the sheet does not exist (any more).
+    :raises SheetUnavailable: If the sheet could not be downloaded (e.g. MetaboLights is down).
+    """
+    headers = {}
+    if previous:
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+    with closing(
+        session.get(
+            f"{API_ROOT}/studies/{mtbls_accession}/download?file={filename}",
+            stream=True,
+            auth=MTBLS_AUTH,
+            headers=headers,
+        )
+    ) as stream:
+        if previous and stream.status_code == requests.codes.not_modified:
+            logging.info(f"Metabolights sheet {filename} is unchanged")
+            return previous
+        if stream.status_code in (requests.codes.not_found, requests.codes.forbidden):
+            logging.warning(
+                f"Metabolights sheet {filename} does not exist: {stream.status_code}"
+            )
+            return None
+        if stream.status_code != requests.codes.ok:
+            raise SheetUnavailable(
+                f"Could not download metabolights sheet {filename}: {stream.status_code}"
+            )
+        f = (line.decode("utf-8") for line in stream.iter_lines(decode_unicode=True))
+        reader = csv.DictReader(f, delimiter="\t")
+        index = {}
+        for row in reader:
+            key = index_by(row)
+            if key:
+                index.setdefault(key, []).append(row)
+
+        max_age = holofood_config.metabolights.study_index_max_age.total_seconds()
+        sheet = {
+            "etag": stream.headers.get("ETag"),
+            "last_modified": stream.headers.get("Last-Modified"),
+            # Entries of each download are kept apart, so that rows removed from the sheet are not found
+            "version": uuid.uuid4().hex,
+            "expires_at": time.time() + max_age,
+        }
+        cache.set_many(
+            {
+                _sheet_rows_key(mtbls_accession, sheet, key): rows
+                for key, rows in index.items()
+            },
+            timeout=max_age,
+        )
+        return sheet
+
+
+def _build_study_index(mtbls_accession: str, previous: Optional[dict] = None) -> dict:
+    logging.info(f"Indexing metabolights sheets for {mtbls_accession}")
     if MTBLS_AUTH:
         logging.info("Using authenticated metabolights API")
-    samples_metadata_filename = None
-    response = requests.get(
+    response = session.get(
         f"{API_ROOT}/studies/{mtbls_accession}/files?include_raw_data=false",
         auth=MTBLS_AUTH,
     )
     data = _parse_metabolights_response(response)
     metadata_files = data.get("study", [])
+
+    previous_sheets = previous.get("sheets", {}) if previous else {}
+    study_index = {"checked_at": time.time(), "sample_sheet": None, "sheets": {}}
+
+    biosample_column = (
+        holofood_config.metabolights.biosample_column_name_in_sample_table
+    )
     for file in metadata_files:
+        filename = file.get("file")
         if file.get("type") == "metadata_sample":
-            samples_metadata_filename = file.get("file")
+            study_index["sample_sheet"] = filename
+            index_by = lambda row: row.get(biosample_column)
+        elif file.get("type") == "metadata_assay":
+            index_by = lambda row: row.get("Sample Name")
+        else:
+            continue
+        sheet = _download_sheet_index(
+            mtbls_accession, filename, index_by, previous_sheets.get(filename)
+        )
+        if sheet is not None:
+            study_index["sheets"][filename] = sheet
 
-    if not samples_metadata_filename:
+    if not study_index["sample_sheet"]:
         logging.warning(f"Did not find sample metadata sheet for {mtbls_accession}")
-        return []
+    return study_index
 
-    sample_name = None
-    with closing(
-        requests.get(
-            f"{API_ROOT}/studies/{mtbls_accession}/download?file={samples_metadata_filename}",
-            stream=True,
-            auth=MTBLS_AUTH,
+
+def _store_study_index(mtbls_accession: str, study_index: dict):
+    # The index must not outlive the cached rows of any of its sheets
+    expires_at = min(
+        (sheet["expires_at"] for sheet in study_index["sheets"].values()),
+        default=time.time()
+        + holofood_config.metabolights.study_index_max_age.total_seconds(),
+    )
+    timeout = expires_at - time.time()
+    if timeout <= 0:
+        cache.delete(_study_index_key(mtbls_accession))
+        return
+    cache.set(_study_index_key(mtbls_accession), study_index, timeout=timeout)
+
+
+def _is_fresh(study_index: Optional[dict]) -> bool:
+    if study_index is None:
+        return False
+    if time.time() < study_index.get("retry_at", 0):
+        # Revalidation failed recently
+        return True
+    return (
+        time.time() - study_index["checked_at"]
+        < holofood_config.metabolights.study_index_ttl.total_seconds()
+    )
+
+
+_study_index_locks = defaultdict(threading.Lock)
+
+
+def get_metabolights_study_index(mtbls_accession: str) -> dict:
+    """
+    Get the index of a MetaboLights study's sample and assay sheets.
+    The sheets are downloaded once per study, and their rows kept in Django's cache
+    (shared between processes) with one entry per BioSamples accession (sample sheet)
+    or Sample Name (assay sheets). This returns only the small per-study entry with
+    each sheet's validators, so that lookups don't load the whole study.
+    After `study_index_ttl` the index is revalidated, re-downloading only sheets that have changed.
+    If that fails, the previous index is kept and revalidation is retried after `study_index_error_ttl`.
+    :param mtbls_accession: MetaboLights study accession, e.g. MTBLS1
+    :return: Dict with the sample sheet filename, and each sheet's validators and cached rows' version.
+    """
+    config = holofood_config.metabolights
+    cache_key = _study_index_key(mtbls_accession)
+    study_index = cache.get(cache_key)
+    if _is_fresh(study_index):
+        observe_cache_lookup(STUDY_INDEX_CACHE_PREFIX, HIT)
+        return study_index
+
+    with _study_index_locks[mtbls_accession]:
+        # Another thread may have rebuilt the index whilst this one waited
+        study_index = cache.get(cache_key)
+        if _is_fresh(study_index):
+            observe_cache_lookup(STUDY_INDEX_CACHE_PREFIX, HIT)
+            return study_index
+        observe_cache_lookup(
+            STUDY_INDEX_CACHE_PREFIX, MISS if study_index is None else STALE
         )
-    ) as stream:
-        f = (line.decode("utf-8") for line in stream.iter_lines(decode_unicode=True))
-        reader = csv.DictReader(f, delimiter="\t")
-        for row in reader:
-            if (
-                row.get(
-                    holofood_config.metabolights.biosample_column_name_in_sample_table
-                )
-                == sample_accession
-            ):
-                sample_name = row.get("Sample Name")
-                break
-
-    if not sample_name:
+        try:
+            new_study_index = _build_study_index(mtbls_accession, previous=study_index)
+        except Exception as e:
+            if study_index is None:
+                raise e
+            logging.error(
+                f"Could not revalidate metabolights index for {mtbls_accession}: {e}"
+            )
+            # Keep serving the previous index, without retrying MetaboLights until error_ttl has passed
+            study_index["retry_at"] = (
+                time.time() + config.study_index_error_ttl.total_seconds()
+            )
+            _store_study_index(mtbls_accession, study_index)
+            return study_index
+        _store_study_index(mtbls_accession, new_study_index)
+        return new_study_index
+
+
+def get_metabolights_assays(mtbls_accession: str, sample_accession: str) -> List[dict]:
+    logging.info(
+        f"Fetching metabolights details for {mtbls_accession} {sample_accession}"
+    )
+    study_index = get_metabolights_study_index(mtbls_accession)
+    sample_sheet = study_index["sheets"].get(study_index["sample_sheet"])
+    if not sample_sheet:
+        return []
+
+    sample_rows = cache.get(
+        _sheet_rows_key(mtbls_accession, sample_sheet, sample_accession)
+    )
+    if not sample_rows or not sample_rows[0].get("Sample Name"):
         logging.warning(
             f"Did not find biosample {sample_accession} in sample metadata sheet"
         )
         return []
+    sample_name = sample_rows[0]["Sample Name"]
 
-    assay_sheets = [
-        file.get("file")
-        for file in metadata_files
-        if file.get("type") == "metadata_assay"
+    assay_rows_keys = {
+        assay_sheet: _sheet_rows_key(mtbls_accession, sheet, sample_name)
+        for assay_sheet, sheet in study_index["sheets"].items()
+        if assay_sheet != study_index["sample_sheet"]
+    }
+    assay_rows = cache.get_many(assay_rows_keys.values())
+    return [
+        {"assay_sheet": assay_sheet, "sample_assay": clean_keys(row)}
+        for assay_sheet, rows_key in assay_rows_keys.items()
+        for row in assay_rows.get(rows_key, [])
     ]
-
-    assay_sheet_rows_for_sample = []
-    for assay_sheet in assay_sheets:
-        with closing(
-            requests.get(
-                f"{API_ROOT}/studies/{mtbls_accession}/download?file={assay_sheet}",
-                stream=True,
-                auth=MTBLS_AUTH,
-            )
-        ) as stream:
-            f = (
-                line.decode("utf-8") for line in stream.iter_lines(decode_unicode=True)
-            )
-            reader = csv.DictReader(f, delimiter="\t")
-            for row in reader:
-                if row.get("Sample Name") == sample_name:
-                    assay_sheet_rows_for_sample.append(
-                        {"assay_sheet": assay_sheet, "sample_assay": clean_keys(row)}
-                    )
-
-    return assay_sheet_rows_for_sample
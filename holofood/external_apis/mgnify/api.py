@@ -2,21 +2,34 @@ import logging
 from typing import List
 
 import requests
-from requests.adapters import HTTPAdapter, Retry
 
+from holofood.caching import StaleWhileRevalidateCache
+from holofood.external_apis.http import session, PooledHTTPAdapter
 from holofood.utils import holofood_config, clean_keys, CadenceEnforcer
 
+API_ROOT = holofood_config.mgnify.api_root.rstrip("/")
+
+session.mount(
+    API_ROOT,
+    PooledHTTPAdapter(
+        retries=holofood_config.mgnify.request_retries,
+        timeout=holofood_config.mgnify.request_timeout.total_seconds(),
+    ),
+)
+
+analyses_cache = StaleWhileRevalidateCache(
+    "mgnify-analyses",
+    ttl=holofood_config.mgnify.analyses_cache_ttl,
+    stale_ttl=holofood_config.mgnify.analyses_cache_stale_ttl,
+    negative_ttl=holofood_config.mgnify.analyses_cache_negative_ttl,
+    error_ttl=holofood_config.mgnify.analyses_cache_error_ttl,
+)
+
 
 class MgnifyApi:
     def __init__(self):
-        self.session = requests.Session()
-        self.api_root = holofood_config.mgnify.api_root.rstrip("/")
-        self.session.mount(
-            self.api_root,
-            HTTPAdapter(
-                max_retries=Retry(total=holofood_config.mgnify.request_retries)
-            ),
-        )
+        self.session = session
+        self.api_root = API_ROOT
         self.request_options = {
             "timeout": holofood_config.mgnify.request_timeout.total_seconds(),
         }
@@ -42,9 +55,25 @@ class MgnifyApi:
 
     def get_metagenomics_analyses_for_sample(self, sample: str) -> List[dict]:
         logging.info(f"Fetching analyses for {sample = } from {self}")
-        response = requests.get(
+        response = self.session.get(
             f"{self.api_root}/analyses?sample_accession={sample}&page_size=10",
             timeout=5,
         )
         self.assert_response_is_acceptable(response)
         return clean_keys(response.json()).get("data", [])
+
+    def get_cached_metagenomics_analyses_for_sample(self, sample: str) -> List[dict]:
+        """
+        As `get_metagenomics_analyses_for_sample`, but served from the analyses cache where possible.
+        Raises holofood.caching.UpstreamError if MGnify failed (recently).
+        """
+        return analyses_cache.get(
+            sample, lambda: self.get_metagenomics_analyses_for_sample(sample)
+        )
+
+    def refresh_cached_metagenomics_analyses_for_sample(
+        self, sample: str
+    ) -> List[dict]:
+        return analyses_cache.refresh(
+            sample, lambda: self.get_metagenomics_analyses_for_sample(sample)
+        )
@@ -14,8 +14,10 @@ from django.db.models import (
     Func,
 )
 from django.forms import NumberInput
+from django_filters.constants import EMPTY_VALUES
 from django.utils.safestring import mark_safe
 
+from holofood import search
 from holofood.forms import CazyAnnotationsFilterForm
 from holofood.models import (
     Sample,
@@ -28,6 +30,29 @@ from holofood.models import (
 from holofood.utils import holofood_config
 
 
+class IndexedContainsFilter(django_filters.CharFilter):
+    """
+    A case-insensitive substring filter, routed through the search backend's (trigram) indexes.
+    """
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        return qs.filter(search.contains(qs.model, self.field_name, value))
+
+
+class IndexedContainsFilterSet(django_filters.FilterSet):
+    """
+    A FilterSet whose `icontains` filters (e.g. from Meta.fields) are IndexedContainsFilters.
+    """
+
+    @classmethod
+    def filter_for_lookup(cls, field, lookup_type):
+        if lookup_type == "icontains":
+            return IndexedContainsFilter, {}
+        return super().filter_for_lookup(field, lookup_type)
+
+
 class MultiFieldSearchFilter(django_filters.FilterSet):
     search = django_filters.CharFilter(method="multiple_icontains", label="Search")
 
@@ -47,7 +72,7 @@ class MultiFieldSearchFilter(django_filters.FilterSet):
         )
 
 
-class MetadataMultiFilter(django_filters.FilterSet):
+class MetadataMultiFilter(IndexedContainsFilterSet):
     metadata_search = django_filters.CharFilter(
         method="metadata_icontains",
         label="Treatment Search",
@@ -82,10 +107,9 @@ class MetadataMultiFilter(django_filters.FilterSet):
 
 class SampleFilter(MetadataMultiFilter):
     animal_id_field = "animal_id"
-    animal_accession__icontains = django_filters.CharFilter(
+    animal_accession__icontains = IndexedContainsFilter(
         field_name="animal__accession",
         label="Animal accession contains",
-        lookup_expr="icontains",
         help_text=mark_safe(
             f'See <a class="vf-link" href="/animals">the list of animals</a> for details'
         ),
@@ -121,7 +145,7 @@ class AnimalFilter(MetadataMultiFilter):
         }
 
 
-class GenomeFilter(django_filters.FilterSet):
+class GenomeFilter(IndexedContainsFilterSet):
     class Meta:
         model = Genome
         form = CazyAnnotationsFilterForm
@@ -168,7 +192,7 @@ class GenomeSampleContainmentFilter(django_filters.FilterSet):
         }
 
 
-class ViralFragmentFilter(django_filters.FilterSet):
+class ViralFragmentFilter(IndexedContainsFilterSet):
     ALL = "Include species-cluster members"
     REPS = "Species-cluster representatives only"
 
@@ -200,8 +224,10 @@ class ViralFragmentFilter(django_filters.FilterSet):
             return queryset.filter(cluster_representative__isnull=True)
 
     def cluster_representative_id(self, queryset, name, value):
-        matches_representative = Q(id__icontains=value)
-        matches_member = Q(cluster_representative__id__icontains=value)
+        matches_representative = search.contains(queryset.model, "id", value)
+        matches_member = search.contains(
+            queryset.model, "cluster_representative__id", value
+        )
         return queryset.filter(matches_member | matches_representative)
 
     def __init__(self, data=None, *args, **kwargs):
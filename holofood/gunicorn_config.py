@@ -0,0 +1,21 @@
+"""
+Gunicorn server hooks, e.g. `gunicorn --config python:holofood.gunicorn_config holofood.wsgi`.
+Keeps the Prometheus metrics of multiple worker processes consistent (see holofood.metrics).
+"""
+import os
+import shutil
+
+
+def on_starting(server):
+    # Metrics files of a previous run would otherwise be aggregated too
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,216 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from django.db import transaction
+
+from holofood.models import (
+    SampleMetadataMarker,
+    AnimalStructuredDatum,
+    SampleStructuredDatum,
+    AbstractStructuredDatum,
+)
+
+MarkerKey = Tuple[str, Optional[str]]
+
+ENA_CHECKLIST = "ENA Checklist"
+
+
+# Sentinel for markers whose IRI should be left as-is (e.g. ENA checklist items)
+_UNCHANGED = object()
+
+
+class StructuredMetadataImporter:
+    """
+    Collects metadata markers and structured datums for many Animals and Samples,
+    and writes them to the database in bulk.
+
+    Markers are resolved through an in-memory cache (keyed by name and type),
+    so each one is only queried or created once per importer.
+    Datums are upserted with `bulk_create(update_conflicts=True)`,
+    relying on the (owner, marker) unique constraints.
+
+    Typical use is to queue a whole BioSamples page, then call `flush()`.
+    """
+
+    DATUM_UPDATE_FIELDS = [
+        "source",
+        "measurement",
+        "measurement_numeric",
+        "measurement_is_truthy",
+        "units",
+        "partner_name",
+        "partner_iri",
+    ]
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self._markers: Dict[MarkerKey, SampleMetadataMarker] = {}
+        self._markers_loaded = False
+        self._pending_markers: Dict[MarkerKey, object] = {}
+        self._animal_datums: Dict[Tuple[str, MarkerKey], dict] = {}
+        self._sample_datums: Dict[Tuple[str, MarkerKey], dict] = {}
+
+    def _queue_marker(self, name: str, marker_type: str, iri=_UNCHANGED) -> MarkerKey:
+        key = (name, marker_type)
+        if iri is not _UNCHANGED or key not in self._pending_markers:
+            self._pending_markers[key] = iri
+        return key
+
+    def _queue_biosamples_metadata(
+        self, datums: Dict[Tuple[str, MarkerKey], dict], owner: str, metadata: dict
+    ):
+        for metadata_type, metadata_content in metadata.items():
+            if not metadata_content:
+                logging.debug(f"{metadata_type=} from {owner} was null – skipping")
+                continue
+            for metadatum in metadata_content:
+                key = self._queue_marker(
+                    metadatum["marker"]["value"],
+                    metadata_type,
+                    metadatum["marker"].get("iri"),
+                )
+                datums[(owner, key)] = {
+                    "source": AbstractStructuredDatum.BIOSAMPLES,
+                    "measurement": metadatum["measurement"]["value"],
+                    "partner_name": (metadatum.get("partner") or {}).get("value"),
+                    "partner_iri": (metadatum.get("partner") or {}).get("iri"),
+                    "units": (metadatum.get("measurement_units") or {}).get("value"),
+                }
+
+    def add_animal_metadata(self, animal_accession: str, structured_metadata: dict):
+        """
+        Queue BioSamples structured metadata for an Animal.
+        :param animal_accession: Accession (pk) of an existing Animal.
+        :param structured_metadata: Dict of metadata sections, keyed by section type.
+        """
+        self._queue_biosamples_metadata(
+            self._animal_datums, animal_accession, structured_metadata
+        )
+
+    def add_sample_metadata(
+        self, sample_accession: str, structured_metadata: dict, checklist: list = None
+    ):
+        """
+        Queue BioSamples structured metadata and ENA checklist items for a Sample.
+        :param sample_accession: Accession (pk) of an existing Sample.
+        :param structured_metadata: Dict of metadata sections, keyed by section type.
+        :param checklist: Optional list of checklist items (with tag, value and units).
+        """
+        self._queue_biosamples_metadata(
+            self._sample_datums, sample_accession, structured_metadata
+        )
+        for metadatum in checklist or []:
+            key = self._queue_marker(metadatum.tag, ENA_CHECKLIST)
+            self._sample_datums[(sample_accession, key)] = {
+                "source": AbstractStructuredDatum.ENA,
+                "measurement": metadatum.value,
+                "units": metadatum.units,
+                "partner_name": None,
+                "partner_iri": None,
+            }
+
+    def _load_markers(self):
+        if self._markers_loaded:
+            return
+        self._markers = {
+            (marker.name, marker.type): marker
+            for marker in SampleMetadataMarker.objects.all()
+        }
+        self._markers_loaded = True
+
+    def _resolve_markers(self):
+        self._load_markers()
+        to_create: List[SampleMetadataMarker] = []
+        to_update: List[SampleMetadataMarker] = []
+        for (name, marker_type), iri in self._pending_markers.items():
+            marker = self._markers.get((name, marker_type))
+            if marker is None:
+                to_create.append(
+                    SampleMetadataMarker(
+                        name=name,
+                        type=marker_type,
+                        iri=None if iri is _UNCHANGED else iri,
+                    )
+                )
+            elif iri is not _UNCHANGED and marker.iri != iri:
+                marker.iri = iri
+                to_update.append(marker)
+
+        if to_create:
+            SampleMetadataMarker.objects.bulk_create(
+                to_create,
+                update_conflicts=True,
+                unique_fields=["name", "type"],
+                update_fields=["iri"],
+                batch_size=self.batch_size,
+            )
+            created_keys = {(marker.name, marker.type) for marker in to_create}
+            created_names = {name for name, _ in created_keys}
+            SampleMetadataMarker.objects.forget_names(created_names)
+            transaction.on_commit(
+                lambda: SampleMetadataMarker.objects.forget_names(created_names)
+            )
+            for marker in SampleMetadataMarker.objects.filter(
+                name__in={name for name, _ in created_keys}
+            ):
+                key = (marker.name, marker.type)
+                if key in created_keys:
+                    self._markers[key] = marker
+                    logging.info(f"Created new SampleMetadataMarker {marker}")
+        if to_update:
+            SampleMetadataMarker.objects.bulk_update(
+                to_update, ["iri"], batch_size=self.batch_size
+            )
+        self._pending_markers = {}
+
+    def _upsert_datums(
+        self,
+        model,
+        owner_field: str,
+        datums: Dict[Tuple[str, MarkerKey], dict],
+    ) -> int:
+        objects = [
+            model(
+                **{f"{owner_field}_id": owner},
+                marker=self._markers[marker_key],
+                measurement_numeric=model.parse_numeric_measurement(
+                    fields["measurement"]
+                ),
+                measurement_is_truthy=model.is_truthy_measurement(
+                    fields["measurement"]
+                ),
+                **fields,
+            )
+            for (owner, marker_key), fields in datums.items()
+        ]
+        model.objects.bulk_create(
+            objects,
+            update_conflicts=True,
+            unique_fields=[owner_field, "marker"],
+            update_fields=self.DATUM_UPDATE_FIELDS,
+            batch_size=self.batch_size,
+        )
+        return len(datums)
+
+    def flush(self) -> int:
+        """
+        Write all queued markers and datums, in a single transaction.
+        :return: Number of datums written.
+        """
+        try:
+            with transaction.atomic():
+                self._resolve_markers()
+                written = self._upsert_datums(
+                    AnimalStructuredDatum, "animal", self._animal_datums
+                )
+                written += self._upsert_datums(
+                    SampleStructuredDatum, "sample", self._sample_datums
+                )
+        except Exception:
+            # Markers created in the rolled-back transaction must not stay cached
+            self._markers_loaded = False
+            raise
+        logging.debug(f"Upserted {written} structured datums")
+        self._animal_datums = {}
+        self._sample_datums = {}
+        return written
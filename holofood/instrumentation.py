@@ -0,0 +1,234 @@
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from django.db import connections
+
+from holofood import metrics as prometheus_metrics
+from holofood.utils import holofood_config
+
+request_logger = logging.getLogger("holofood.requests")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    A request issued more SQL queries than its view's budget (see MonitoringConfig).
+    """
+
+    pass
+
+
+class RequestMetrics:
+    """
+    SQL and external HTTP activity of one request.
+    Thread-safe, since external lookups may run in other threads (see utils.run_concurrently).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.http_count = 0
+        self.http_time = 0.0
+        self._lock = threading.Lock()
+
+    def record_sql(self, duration: float):
+        with self._lock:
+            self.sql_count += 1
+            self.sql_time += duration
+
+    def record_http(self, duration: float):
+        with self._lock:
+            self.http_count += 1
+            self.http_time += duration
+
+    @property
+    def total_time(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def sql_execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record_sql(time.perf_counter() - started)
+
+    def server_timing(self) -> str:
+        """
+        The metrics as a Server-Timing header value (durations in ms), shown by browsers' dev tools.
+        """
+        return ", ".join(
+            [
+                f'sql;dur={self.sql_time * 1000:.1f};desc="{self.sql_count} queries"',
+                f'http;dur={self.http_time * 1000:.1f};desc="{self.http_count} calls"',
+                f"total;dur={self.total_time * 1000:.1f}",
+            ]
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "sql_count": self.sql_count,
+            "sql_ms": round(self.sql_time * 1000, 1),
+            "http_count": self.http_count,
+            "http_ms": round(self.http_time * 1000, 1),
+            "total_ms": round(self.total_time * 1000, 1),
+        }
+
+
+_current_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar(
+    "request_metrics", default=None
+)
+
+
+def current_request_metrics() -> Optional[RequestMetrics]:
+    return _current_metrics.get()
+
+
+@contextmanager
+def record_sql_queries(metrics: RequestMetrics) -> Iterator[RequestMetrics]:
+    """
+    Record the SQL queries made within the context on every DB connection of this thread.
+    """
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics.sql_execute_wrapper))
+        yield metrics
+
+
+@contextmanager
+def record_thread_queries() -> Iterator[Optional[RequestMetrics]]:
+    """
+    Record the SQL queries made within the context, in another thread than the request's
+    (e.g. by utils.run_concurrently), in the current request's metrics (if any).
+    """
+    metrics = current_request_metrics()
+    if metrics is None:
+        yield None
+    else:
+        with record_sql_queries(metrics):
+            yield metrics
+
+
+@contextmanager
+def record_request_metrics() -> Iterator[RequestMetrics]:
+    """
+    Record the SQL queries (on every DB connection of this thread) and external HTTP calls
+    made within the context, e.g. by one request.
+    """
+    metrics = RequestMetrics()
+    token = _current_metrics.set(metrics)
+    try:
+        with record_sql_queries(metrics):
+            yield metrics
+    finally:
+        metrics.finished = time.perf_counter()
+        _current_metrics.reset(token)
+
+
+@contextmanager
+def record_http_call(url: Optional[str] = None) -> Iterator[dict]:
+    """
+    Time an external HTTP call, for the current request's metrics (if any),
+    and for the external API metrics if the URL is given.
+    Set `status` on the yielded dict to the response's status code, to count 5xx responses as errors.
+    """
+    metrics = current_request_metrics()
+    call = {"status": None, "failed": False}
+    started = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        call["failed"] = True
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        if metrics is not None:
+            metrics.record_http(duration)
+        if url is not None:
+            prometheus_metrics.observe_external_api_call(
+                url,
+                duration,
+                failed=call["failed"] or (call["status"] or 0) >= 500,
+            )
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the SQL queries, external HTTP calls, and total time of every request.
+    Adds a Server-Timing header, logs the metrics (to the "holofood.requests" logger),
+    exports them to Prometheus (see holofood.metrics),
+    and warns (or raises QueryBudgetExceeded) if a view exceeds its query budget.
+    Streaming responses (e.g. exports) are recorded once their body has been sent,
+    including the queries made whilst streaming it.
+    The Server-Timing header can only cover the time until the headers are sent.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_request_metrics() as metrics:
+            response = self.get_response(request)
+
+        if holofood_config.monitoring.server_timing_header:
+            response["Server-Timing"] = metrics.server_timing()
+        if response.streaming and not getattr(response, "is_async", False):
+            response.streaming_content = self._record_streamed(
+                request, response, metrics, response.streaming_content
+            )
+        else:
+            self._record(request, response, metrics)
+        return response
+
+    def _record_streamed(
+        self, request, response, metrics: RequestMetrics, content: Iterator[bytes]
+    ) -> Iterator[bytes]:
+        try:
+            with record_sql_queries(metrics):
+                yield from content
+        finally:
+            # Body fully sent, or the client went away
+            metrics.finished = time.perf_counter()
+            self._record(request, response, metrics)
+
+    def _record(self, request, response, metrics: RequestMetrics):
+        config = holofood_config.monitoring
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        prometheus_metrics.observe_request(
+            view_name,
+            request.method,
+            response.status_code,
+            duration=metrics.total_time,
+            db_queries=metrics.sql_count,
+            db_duration=metrics.sql_time,
+        )
+
+        summary = {
+            "method": request.method,
+            "path": request.path,
+            "view": view_name,
+            "status": response.status_code,
+            **metrics.as_dict(),
+        }
+        request_logger.info(json.dumps(summary), extra={"request_metrics": summary})
+
+        if metrics.total_time > config.latency_budget.total_seconds():
+            request_logger.warning(
+                f"{view_name} took {summary['total_ms']}ms, "
+                f"over the latency budget of {config.latency_budget}"
+            )
+
+        query_budget = config.view_query_budgets.get(view_name, config.query_budget)
+        if metrics.sql_count > query_budget:
+            message = (
+                f"{view_name} made {metrics.sql_count} SQL queries, "
+                f"over its budget of {query_budget}"
+            )
+            if config.raise_over_query_budget:
+                raise QueryBudgetExceeded(message)
+            request_logger.warning(message)
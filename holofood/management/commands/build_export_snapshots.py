@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from holofood.export import build_export_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "(Re)build the gzipped TSV export snapshots of Genome and Viral Catalogues, "
+        "which the export API serves without querying the DB."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--catalogues",
+            type=str,
+            nargs="+",
+            help="IDs of the (Genome or Viral) Catalogues to build snapshots for. Default all.",
+            default=None,
+        )
+
+    def handle(self, *args, **options):
+        for built in build_export_snapshots(options["catalogues"]):
+            self.stdout.write(f"Built export snapshot of {built}")
+        self.stdout.write(self.style.SUCCESS("Done"))
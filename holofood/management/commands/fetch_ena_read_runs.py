@@ -0,0 +1,83 @@
+import logging
+from typing import List
+
+from django.core.management.base import BaseCommand
+
+from holofood.external_apis.ena.portal_api import search_read_runs
+from holofood.models import Sample, EnaReadRun
+from holofood.utils import holofood_config
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch ENA read run records for many sequencing Samples in bulk (via ENA Portal API searches), "
+        "and store them so that sample pages need not query ENA."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--samples",
+            type=str,
+            help="Sample accessions to fetch runs for. Default is all sequencing samples.",
+            nargs="+",
+            metavar="ACCESSION",
+        )
+        parser.add_argument(
+            "--study",
+            type=str,
+            help="ENA study accession to fetch all runs of, e.g. PRJEB1. Overrides `--samples`.",
+            metavar="ACCESSION",
+        )
+        parser.add_argument(
+            "--batch_size",
+            type=int,
+            help="Number of samples to query ENA for in each search request.",
+            default=holofood_config.ena.search_batch_size,
+        )
+
+    def store_runs(self, records: List[dict]) -> int:
+        known_samples = set(
+            Sample.objects.filter(
+                accession__in={record.get("sample_accession") for record in records}
+            ).values_list("accession", flat=True)
+        )
+        runs = [
+            EnaReadRun.from_ena_record(record)
+            for record in records
+            if record.get("run_accession")
+            and record.get("sample_accession") in known_samples
+        ]
+        if len(runs) < len(records):
+            logging.info(
+                f"Skipping {len(records) - len(runs)} ENA runs of samples not in the DB"
+            )
+        EnaReadRun.objects.bulk_create(
+            runs,
+            update_conflicts=True,
+            unique_fields=["run_accession"],
+            update_fields=EnaReadRun.UPDATE_FIELDS,
+        )
+        return len(runs)
+
+    def handle(self, *args, **options):
+        stored = 0
+        if options["study"]:
+            stored += self.store_runs(
+                search_read_runs(study_accession=options["study"])
+            )
+        else:
+            samples = Sample.objects.filter(
+                sample_type__in=Sample.SEQUENCING_SAMPLE_TYPES
+            ).order_by("accession")
+            if options["samples"]:
+                samples = samples.filter(accession__in=options["samples"])
+            accessions = list(samples.values_list("accession", flat=True))
+            batch_size = options["batch_size"]
+            for start in range(0, len(accessions), batch_size):
+                batch = accessions[start : start + batch_size]
+                stored += self.store_runs(search_read_runs(sample_accessions=batch))
+                logging.info(
+                    f"Fetched runs for {min(start + batch_size, len(accessions))}/{len(accessions)} samples"
+                )
+
+        self.stdout.write(self.style.SUCCESS(f"Stored {stored} ENA read runs."))
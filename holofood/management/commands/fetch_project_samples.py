@@ -1,11 +1,18 @@
 import logging
-from typing import Optional
+from typing import Optional, List
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
-from holofood.external_apis.biosamples.api import get_project_samples
-from holofood.models import Animal, Sample
-from holofood.utils import holofood_config
+from holofood.external_apis.biosamples.api import (
+    get_project_sample_pages,
+    structured_data_from_biosample,
+    checklist_from_biosample,
+)
+from holofood.external_apis.http import log_pool_stats
+from holofood.importers import StructuredMetadataImporter
+from holofood.models import Animal, Sample, deferred_animal_sample_summaries
+from holofood.utils import holofood_config, prefetch_in_background
 
 
 class Command(BaseCommand):
@@ -44,6 +51,12 @@ class Command(BaseCommand):
             help="ISO8601 formatted datetime, to limit samples to those updated since a certain date. E.g. 2023-04-31",
             default=None,
         )
+        parser.add_argument(
+            "--prefetch_pages",
+            type=int,
+            help="Number of biosamples pages to fetch ahead (in the background) whilst importing. 0 to disable.",
+            default=2,
+        )
 
     @staticmethod
     def is_animal(sample: dict) -> bool:
@@ -156,110 +169,103 @@ class Command(BaseCommand):
                 f"Could not determine experiment/sample type for {sample.get('accession')}"
             )
 
-    @staticmethod
-    def characteristics_to_checklist_obj(sample: dict):
-        characteristics = sample.get("characteristics")
+    def import_page(self, biosamples: List[dict]):
+        """
+        Import a page of biosamples as Animals and Samples, in a single transaction.
+        Structured metadata for the whole page are written in bulk at the end.
+        """
+        with transaction.atomic():
+            for biosample in biosamples:
+                logging.info(f"Importing biosample {biosample.get('accession')}")
+
+                structured_metadata = structured_data_from_biosample(biosample)
+
+                if self.is_animal(biosample):
+                    system = self.get_system(biosample)
+                    if not system:
+                        logging.warning(
+                            f"Could not determine system for {biosample.get('accession')}"
+                        )
+                        continue
+                    animal, created = Animal.objects.get_or_create(
+                        accession=biosample.get("accession"),
+                        defaults={
+                            "system": system,
+                        },
+                    )
+                    self.metadata_importer.add_animal_metadata(
+                        animal.accession, structured_metadata
+                    )
+                    if created:
+                        self.animals_added += 1
+                        logging.info(f"Made animal {animal}")
+
+                else:
+                    animal_accession = self.get_parent_animal(biosample)
+                    system = self.get_system(biosample)
+                    if not system:
+                        logging.warning(
+                            f"Could not determine system for {biosample.get('accession')}"
+                        )
+                        continue
 
-        class ChecklistItem:
-            tag = None
-            value = None
-            units = None
+                    animal, created = Animal.objects.update_or_create(
+                        accession=animal_accession,
+                        defaults={
+                            "system": system,
+                        },
+                    )
+                    if created:
+                        self.animals_added += 1
+                        logging.info(
+                            f"Made animal {animal} based on parentage of sample {biosample.get('accession')}"
+                        )
 
-            def __init__(self, tag, characteristic):
-                self.tag = tag
-                self.value = characteristic.get("text")
-                self.units = characteristic.get("unit")
+                    sample, created = Sample.objects.update_or_create(
+                        accession=biosample.get("accession"),
+                        defaults={
+                            "animal": animal,
+                            "title": self.get_from_characteristics(
+                                biosample, "title", raise_if_none=False
+                            )
+                            or biosample.get("name", biosample.get("accession")),
+                            "sample_type": self.get_sample_type(biosample),
+                        },
+                    )
+                    self.metadata_importer.add_sample_metadata(
+                        sample.accession,
+                        structured_metadata,
+                        checklist_from_biosample(biosample),
+                    )
+                    sample.refresh_external_references(
+                        biosample.get("externalReferences")
+                    )
+                    if created:
+                        self.samples_added += 1
+                        logging.info(f"Made sample {sample}")
 
-        return [
-            ChecklistItem(k, v[0]) for k, v in characteristics.items() if len(v) > 0
-        ]
+            self.metadata_importer.flush()
 
     def handle(self, *args, **options):
-        animals_added = 0
-        samples_added = 0
+        self.animals_added = 0
+        self.samples_added = 0
+        self.metadata_importer = StructuredMetadataImporter()
 
-        for biosample in get_project_samples(
+        pages = get_project_sample_pages(
             options["project_attr"],
             options["webin_filter"],
             options["max_pages"],
             options["biosamples_page_cursor"],
             options["updated_since"],
-        ):
-            logging.info(f"Importing biosample {biosample.get('accession')}")
-
-            if self.is_animal(biosample):
-                system = self.get_system(biosample)
-                if not system:
-                    logging.warning(
-                        f"Could not determine system for {biosample.get('accession')}"
-                    )
-                    continue
-                animal, created = Animal.objects.get_or_create(
-                    accession=biosample.get("accession"),
-                    defaults={
-                        "system": system,
-                    },
-                )
-                structured_metadata = {
-                    data_section.get("type"): data_section.get("content", [])
-                    for data_section in biosample.get("structuredData", [])
-                }
-
-                animal.refresh_structureddata(
-                    structured_metadata,
-                )
-                if created:
-                    animals_added += 1
-                    logging.info(f"Made animal {animal}")
-
-            else:
-                animal_accession = self.get_parent_animal(biosample)
-                system = self.get_system(biosample)
-                if not system:
-                    logging.warning(
-                        f"Could not determine system for {biosample.get('accession')}"
-                    )
-                    continue
-
-                animal, created = Animal.objects.update_or_create(
-                    accession=animal_accession,
-                    defaults={
-                        "system": system,
-                    },
-                )
-                if created:
-                    animals_added += 1
-                    logging.info(
-                        f"Made animal {animal} based on parentage of sample {biosample.get('accession')}"
-                    )
-
-                sample, created = Sample.objects.update_or_create(
-                    accession=biosample.get("accession"),
-                    defaults={
-                        "animal": animal,
-                        "title": self.get_from_characteristics(
-                            biosample, "title", raise_if_none=False
-                        )
-                        or biosample.get("name", biosample.get("accession")),
-                        "sample_type": self.get_sample_type(biosample),
-                    },
-                )
-                structured_metadata = {
-                    data_section.get("type"): data_section.get("content", [])
-                    for data_section in biosample.get("structuredData", [])
-                }
-
-                sample.refresh_structureddata(
-                    structured_metadata,
-                    self.characteristics_to_checklist_obj(biosample),
-                )
-                sample.refresh_external_references(biosample.get("externalReferences"))
-                if created:
-                    samples_added += 1
-                    logging.info(f"Made sample {sample}")
+        )
+        # Animals' sample counts/types are updated once at the end, not per sample saved
+        with deferred_animal_sample_summaries():
+            for page in prefetch_in_background(pages, options["prefetch_pages"]):
+                self.import_page(page)
 
+        log_pool_stats()
         self.stdout.write(
             self.style.SUCCESS(
-                f"Added {samples_added} samples and {animals_added} animals."
+                f"Added {self.samples_added} samples and {self.animals_added} animals."
             )
         )
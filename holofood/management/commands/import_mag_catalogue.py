@@ -5,6 +5,7 @@ from csv import DictReader
 
 from django.core.management.base import BaseCommand, CommandError
 
+from holofood.export import build_export_snapshots
 from holofood.models import GenomeCatalogue
 
 
@@ -121,4 +122,6 @@ class Command(BaseCommand):
             )
             logging.debug(f"Created genome {genome}")
         tsv_file.close()
+        for built in build_export_snapshots([catalogue.id]):
+            self.stdout.write(f"Built export snapshot of {built}")
         self.stdout.write(self.style.SUCCESS(f"Done"))
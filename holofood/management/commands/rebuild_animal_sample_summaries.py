@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from holofood.models import Animal
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the denormalised sample count and sample types of some or all Animals, "
+        "e.g. after samples were changed outside of the ORM."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--animals",
+            type=str,
+            help="Animal accessions to rebuild. Default is all animals.",
+            nargs="+",
+            metavar="ACCESSION",
+        )
+
+    def handle(self, *args, **options):
+        changed = Animal.objects.refresh_sample_summaries(options["animals"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Updated sample summaries of {changed} animals.")
+        )
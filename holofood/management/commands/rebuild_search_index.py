@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from holofood.models import SearchDocument
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the global search documents of all searchable objects, "
+        "e.g. after objects were changed outside of the ORM."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch_size",
+            type=int,
+            help="Number of objects to index at once. Default 1000.",
+            default=1000,
+        )
+
+    def handle(self, *args, **options):
+        indexed = SearchDocument.objects.rebuild(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} search documents."))
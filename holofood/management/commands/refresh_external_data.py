@@ -1,14 +1,33 @@
 import argparse
 import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, Union
 
 from django.core.management.base import BaseCommand
+from django.db.models import QuerySet
 
+from holofood.external_apis.biosamples.api import (
+    API_ROOT as BIOSAMPLES_API_ROOT,
+    get_biosample,
+    structured_data_from_biosample,
+    checklist_from_biosample,
+)
+from holofood.external_apis.http import log_pool_stats
+from holofood.importers import StructuredMetadataImporter
 from holofood.models import Sample, Animal
+from holofood.utils import HostRateLimiter
 
 
 class Command(BaseCommand):
     help = "(Re)fetch external data for some or all Samples/Animals, from BioSamples."
 
+    # Number of objects whose fetched metadata are written to the DB in one go
+    write_batch_size = 100
+    progress_every = 50
+
     def add_arguments(self, parser):
         parser.add_argument(
             "--samples",
@@ -50,8 +69,116 @@ class Command(BaseCommand):
             action=argparse.BooleanOptionalAction,
             help="Whether to refresh external references.",
         )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Number of threads fetching external data concurrently. "
+            "Writes to the database always happen on a single thread.",
+            default=1,
+        )
+        parser.add_argument(
+            "--max_requests_per_host",
+            type=int,
+            help="Maximum number of concurrent requests to any one external API host.",
+            default=4,
+        )
+        parser.add_argument(
+            "--min_request_interval",
+            type=float,
+            help="Minimum number of seconds between starting requests to any one external API host.",
+            default=0,
+        )
+
+    def fetch_sample_data(self, sample: Sample) -> dict:
+        """
+        Fetch the biosample document once,
+        and derive the structured data, checklist, and external references from it.
+        """
+        with self.limiter.limit(BIOSAMPLES_API_ROOT):
+            biosample = get_biosample(sample.accession)
+        data = {}
+        if self.options["structured"]:
+            data["structured_metadata"] = structured_data_from_biosample(biosample)
+            data["checklist"] = checklist_from_biosample(biosample)
+        if self.options["external_references"]:
+            data["external_references"] = biosample.get("externalReferences", [])
+        return data
+
+    def write_sample_data(self, sample: Sample, data: dict):
+        if "structured_metadata" in data:
+            self.importer.add_sample_metadata(
+                sample.accession, data["structured_metadata"], data["checklist"]
+            )
+        if "external_references" in data:
+            sample.refresh_external_references(data["external_references"])
+
+    def fetch_animal_data(self, animal: Animal) -> dict:
+        with self.limiter.limit(BIOSAMPLES_API_ROOT):
+            biosample = get_biosample(animal.accession)
+        return {"structured_metadata": structured_data_from_biosample(biosample)}
+
+    def write_animal_data(self, animal: Animal, data: dict):
+        self.importer.add_animal_metadata(animal.accession, data["structured_metadata"])
+
+    def report_progress(self, label: str, done: int, total: int, started: float):
+        elapsed = time.monotonic() - started
+        rate = done / elapsed if elapsed else 0
+        self.stdout.write(f"Refreshed {done}/{total} {label} ({rate:.2f} {label}/s)")
+
+    def refresh(
+        self,
+        objects: QuerySet,
+        label: str,
+        fetch: Callable[[Union[Sample, Animal]], dict],
+        write: Callable[[Union[Sample, Animal], dict], None],
+    ):
+        """
+        Fetch external data for each object on a pool of worker threads,
+        and write the results in order on this (the only DB-writing) thread.
+        At most 2 × workers fetches are queued at once, so memory use stays bounded.
+        Objects are read in pages of primary keys (collected first), rather than with a
+        server-side cursor, which is unsafe to keep open whilst writing on the same connection.
+        """
+        pks = list(objects.order_by("pk").values_list("pk", flat=True))
+        total = len(pks)
+        logging.info(f"Fetching metadata for {total} {label}")
+        workers = max(1, self.options["workers"])
+        started = time.monotonic()
+        done = 0
+        in_flight = deque()
+
+        def write_oldest():
+            nonlocal done
+            obj, future = in_flight.popleft()
+            write(obj, future.result())
+            done += 1
+            if done % self.write_batch_size == 0:
+                self.importer.flush()
+            if done % self.progress_every == 0:
+                self.report_progress(label, done, total, started)
+
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="refresher"
+        ) as executor:
+            for page_start in range(0, total, self.write_batch_size):
+                page_pks = pks[page_start : page_start + self.write_batch_size]
+                for obj in objects.model.objects.filter(pk__in=page_pks).order_by("pk"):
+                    in_flight.append((obj, executor.submit(fetch, obj)))
+                    if len(in_flight) >= 2 * workers:
+                        write_oldest()
+            while in_flight:
+                write_oldest()
+        self.importer.flush()
+        self.report_progress(label, done, total, started)
 
     def handle(self, *args, **options):
+        self.options = options
+        self.importer = StructuredMetadataImporter()
+        self.limiter = HostRateLimiter(
+            max_concurrent=options["max_requests_per_host"],
+            min_period=timedelta(seconds=options["min_request_interval"]),
+        )
+
         samples = None
         if options["samples"]:
             if "ALL" in options["samples"]:
@@ -62,12 +189,9 @@ class Command(BaseCommand):
             filters = dict(tuple(f.split("=")) for f in options["sample_filters"])
             samples = Sample.objects.filter(**filters)
         if samples:
-            logging.info(f"Fetching metadata for {samples.count()} samples")
-            for sample in samples:
-                if options["structured"]:
-                    sample.refresh_structureddata()
-                if options["external_references"]:
-                    sample.refresh_external_references()
+            self.refresh(
+                samples, "samples", self.fetch_sample_data, self.write_sample_data
+            )
             self.stdout.write(self.style.SUCCESS(f"Done for samples"))
 
         animals = None
@@ -80,7 +204,9 @@ class Command(BaseCommand):
             filters = dict(tuple(f.split("=")) for f in options["animal_filters"])
             animals = Animal.objects.filter(**filters)
         if animals:
-            logging.info(f"Fetching metadata for {animals.count()} animals")
-            for animal in animals:
-                animal.refresh_structureddata()
+            self.refresh(
+                animals, "animals", self.fetch_animal_data, self.write_animal_data
+            )
             self.stdout.write(self.style.SUCCESS(f"Done for animals"))
+
+        log_pool_stats()
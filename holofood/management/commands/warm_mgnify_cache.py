@@ -0,0 +1,53 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from holofood.caching import UpstreamError
+from holofood.external_apis.mgnify.api import MgnifyApi
+from holofood.models import Sample
+from holofood.utils import holofood_config, CadenceEnforcer
+
+
+class Command(BaseCommand):
+    help = (
+        "Pre-warm the cache of MGnify analyses, used by the sample detail pages, "
+        "for some or all metagenomic Samples."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--samples",
+            type=str,
+            help="Sample accessions to warm the cache for. Default is all metagenomic samples.",
+            nargs="+",
+            metavar="ACCESSION",
+        )
+
+    def handle(self, *args, **options):
+        samples = Sample.objects.filter(
+            sample_type__in=Sample.METAGENOMIC_SAMPLE_TYPES
+        ).order_by("accession")
+        if options["samples"]:
+            samples = samples.filter(accession__in=options["samples"])
+
+        mgnify = MgnifyApi()
+        request_slower = CadenceEnforcer(
+            min_period=holofood_config.mgnify.request_cadence
+        )
+        warmed = 0
+        failed = 0
+        for accession in samples.values_list("accession", flat=True):
+            request_slower()
+            try:
+                mgnify.refresh_cached_metagenomics_analyses_for_sample(accession)
+            except UpstreamError:
+                logging.warning(f"Could not fetch MGnify analyses for {accession}")
+                failed += 1
+            else:
+                warmed += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Cached MGnify analyses for {warmed} samples ({failed} failed)."
+            )
+        )
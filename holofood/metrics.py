@@ -0,0 +1,130 @@
+import hmac
+import os
+from typing import Optional
+
+from django.http import HttpResponse, HttpResponseForbidden, Http404
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from holofood.utils import holofood_config
+
+# With several (e.g. gunicorn) worker processes, set the PROMETHEUS_MULTIPROC_DIR env var
+# (to an empty directory, before starting) so that every worker's metrics are written there,
+# and aggregated by whichever worker serves /metrics. See holofood/gunicorn_config.py.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+REQUEST_DURATION = Histogram(
+    "holofood_request_duration_seconds",
+    "Time to respond to requests, by URL name (view or API operation).",
+    ["view", "method", "status"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+REQUEST_DB_QUERIES = Histogram(
+    "holofood_request_db_queries",
+    "Number of SQL queries made per request, by URL name.",
+    ["view"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+REQUEST_DB_DURATION = Histogram(
+    "holofood_request_db_duration_seconds",
+    "Time spent in SQL queries per request, by URL name.",
+    ["view"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+EXTERNAL_API_DURATION = Histogram(
+    "holofood_external_api_duration_seconds",
+    "Time taken by calls to external APIs (including retries), by API.",
+    ["api"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+EXTERNAL_API_ERRORS = Counter(
+    "holofood_external_api_errors_total",
+    "Calls to external APIs that failed (connection errors, timeouts, or 5xx responses), by API.",
+    ["api"],
+)
+CACHE_LOOKUPS = Counter(
+    "holofood_cache_lookups_total",
+    "Lookups of cached data, by cache and result (hit, stale, or miss).",
+    ["cache", "result"],
+)
+
+HIT = "hit"
+STALE = "stale"
+MISS = "miss"
+
+
+EXTERNAL_API_ROOTS = {
+    "biosamples": holofood_config.biosamples.api_root,
+    "webin_auth": holofood_config.biosamples.auth_url,
+    "ena_portal": holofood_config.ena.portal_api_root,
+    "ena_browser": holofood_config.ena.browser_api_root,
+    "mgnify": holofood_config.mgnify.api_root,
+    "metabolights": holofood_config.metabolights.api_root,
+    "docs": holofood_config.docs.docs_url,
+}
+
+
+def external_api_name(url: str) -> str:
+    """
+    Which external API (client) a URL belongs to, e.g. "mgnify". Many of them share a host.
+    """
+    for api_name, root in EXTERNAL_API_ROOTS.items():
+        if url.startswith(root):
+            return api_name
+    return "other"
+
+
+def observe_request(
+    view: Optional[str],
+    method: str,
+    status: int,
+    duration: float,
+    db_queries: int,
+    db_duration: float,
+):
+    view = view or "unmatched"
+    REQUEST_DURATION.labels(view, method, str(status)).observe(duration)
+    REQUEST_DB_QUERIES.labels(view).observe(db_queries)
+    REQUEST_DB_DURATION.labels(view).observe(db_duration)
+
+
+def observe_external_api_call(url: str, duration: float, failed: bool):
+    api_name = external_api_name(url)
+    EXTERNAL_API_DURATION.labels(api_name).observe(duration)
+    if failed:
+        EXTERNAL_API_ERRORS.labels(api_name).inc()
+
+
+def observe_cache_lookup(cache_name: str, result: str):
+    """
+    :param cache_name: e.g. "mgnify-analyses"
+    :param result: HIT, STALE or MISS
+    """
+    CACHE_LOOKUPS.labels(cache_name, result).inc()
+
+
+def metrics_view(request):
+    """
+    Prometheus metrics of all worker processes.
+    Only served if enabled, and to requests with the bearer token (if one is configured).
+    """
+    config = holofood_config.monitoring
+    if not config.metrics_endpoint:
+        raise Http404
+    if config.metrics_token and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {config.metrics_token}"
+    ):
+        return HttpResponseForbidden()
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,44 @@
+# Generated by Django 4.2 on 2026-10-18 13:57
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicate_datums(apps, schema_editor):
+    """
+    Keep only the most recent datum for each (owner, marker) pair,
+    so that the unique constraints can be applied.
+    """
+    for model_name, owner_field in [
+        ("AnimalStructuredDatum", "animal"),
+        ("SampleStructuredDatum", "sample"),
+    ]:
+        model = apps.get_model("holofood", model_name)
+        duplicates = (
+            model.objects.values(owner_field, "marker")
+            .annotate(count=Count("id"), latest_id=Max("id"))
+            .filter(count__gt=1)
+        )
+        for duplicate in duplicates:
+            model.objects.filter(
+                **{owner_field: duplicate[owner_field]},
+                marker=duplicate["marker"],
+            ).exclude(id=duplicate["latest_id"]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("holofood", "0038_genome_annotations"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_datums, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name="animalstructureddatum",
+            unique_together={("animal", "marker")},
+        ),
+        migrations.AlterUniqueTogether(
+            name="samplestructureddatum",
+            unique_together={("sample", "marker")},
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-18 14:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("holofood", "0039_alter_animalstructureddatum_unique_together_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EnaReadRun",
+            fields=[
+                (
+                    "run_accession",
+                    models.CharField(max_length=20, primary_key=True, serialize=False),
+                ),
+                ("sample_title", models.CharField(blank=True, max_length=200)),
+                ("experiment_accession", models.CharField(blank=True, max_length=20)),
+                ("experiment_title", models.CharField(blank=True, max_length=500)),
+                ("study_accession", models.CharField(blank=True, max_length=20)),
+                ("study_title", models.CharField(blank=True, max_length=500)),
+                ("run_alias", models.CharField(blank=True, max_length=200)),
+                ("read_count", models.BigIntegerField(blank=True, null=True)),
+                ("base_count", models.BigIntegerField(blank=True, null=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                (
+                    "sample",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ena_read_runs",
+                        to="holofood.sample",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ("sample", "run_accession"),
+            },
+        ),
+    ]
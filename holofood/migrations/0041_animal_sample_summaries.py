@@ -0,0 +1,64 @@
+# Generated by Django 4.2 on 2026-10-18 14:09
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+
+# Sample.SAMPLE_TYPE_CHOICES at the time of this migration, in bit order
+SAMPLE_TYPES = [
+    "metagenomic_assembly",
+    "metagenomic_amplicon",
+    "metabolomic",
+    "metabolomic_targeted",
+    "histological",
+    "host_genomic",
+    "transcriptomic",
+    "metatranscriptomic",
+    "iodine",
+    "fatty_acids",
+    "heavy_metals",
+    "inflammatory_markers",
+]
+
+
+def populate_sample_summaries(apps, schema_editor):
+    Animal = apps.get_model("holofood", "Animal")
+    Sample = apps.get_model("holofood", "Sample")
+    counts = defaultdict(int)
+    masks = defaultdict(int)
+    for group in (
+        Sample.objects.order_by()
+        .values("animal_id", "sample_type")
+        .annotate(count=Count("pk"))
+    ):
+        counts[group["animal_id"]] += group["count"]
+        if group["sample_type"] in SAMPLE_TYPES:
+            masks[group["animal_id"]] |= 1 << SAMPLE_TYPES.index(group["sample_type"])
+    animals = list(Animal.objects.filter(accession__in=counts.keys()))
+    for animal in animals:
+        animal.samples_count = counts[animal.accession]
+        animal.sample_types_mask = masks[animal.accession]
+    Animal.objects.bulk_update(
+        animals, ["samples_count", "sample_types_mask"], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("holofood", "0040_enareadrun"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="animal",
+            name="sample_types_mask",
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name="animal",
+            name="samples_count",
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(populate_sample_summaries, migrations.RunPython.noop),
+    ]
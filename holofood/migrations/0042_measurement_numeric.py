@@ -0,0 +1,62 @@
+# Generated by Django 4.2 on 2026-10-18 14:10
+
+import math
+
+from django.db import migrations, models
+
+
+def parse_numeric_measurement(measurement):
+    try:
+        number = float(str(measurement).strip())
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+
+def populate_measurement_numeric(apps, schema_editor):
+    for model_name in ["AnimalStructuredDatum", "SampleStructuredDatum"]:
+        model = apps.get_model("holofood", model_name)
+        batch = []
+        for datum in model.objects.only("id", "measurement").iterator(chunk_size=2000):
+            number = parse_numeric_measurement(datum.measurement)
+            if number is not None:
+                datum.measurement_numeric = number
+                batch.append(datum)
+            if len(batch) >= 2000:
+                model.objects.bulk_update(batch, ["measurement_numeric"])
+                batch = []
+        model.objects.bulk_update(batch, ["measurement_numeric"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("holofood", "0041_animal_sample_summaries"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="animalstructureddatum",
+            name="measurement_numeric",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="samplestructureddatum",
+            name="measurement_numeric",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(populate_measurement_numeric, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="animalstructureddatum",
+            index=models.Index(
+                fields=["marker", "measurement_numeric"],
+                name="holofood_an_marker__f03b4a_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="samplestructureddatum",
+            index=models.Index(
+                fields=["marker", "measurement_numeric"],
+                name="holofood_sa_marker__78ded7_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2 on 2026-10-18 14:11
+
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+FALSY_MEASUREMENTS = ("0", "false", "unknown", "n/a", "null")
+
+
+def populate_measurement_is_truthy(apps, schema_editor):
+    for model_name in ["AnimalStructuredDatum", "SampleStructuredDatum"]:
+        model = apps.get_model("holofood", model_name)
+        model.objects.annotate(measurement_lower=Lower("measurement")).filter(
+            measurement_lower__in=FALSY_MEASUREMENTS
+        ).update(measurement_is_truthy=False)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("holofood", "0042_measurement_numeric"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="animalstructureddatum",
+            name="measurement_is_truthy",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name="samplestructureddatum",
+            name="measurement_is_truthy",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(populate_measurement_is_truthy, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="animalstructureddatum",
+            index=models.Index(
+                condition=models.Q(("measurement_is_truthy", True)),
+                fields=["marker", "animal"],
+                name="animal_datum_truthy_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="samplestructureddatum",
+            index=models.Index(
+                condition=models.Q(("measurement_is_truthy", True)),
+                fields=["marker", "sample"],
+                name="sample_datum_truthy_idx",
+            ),
+        ),
+    ]
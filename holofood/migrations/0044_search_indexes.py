@@ -0,0 +1,83 @@
+import sqlite3
+
+from django.db import migrations
+
+# Frozen copy of the search indexes (see holofood.search) as of this migration,
+# so that replaying it does not depend on later changes there.
+# Later changes are applied by the post_migrate hook (holofood.models.create_search_indexes).
+SEARCH_INDEXED_COLUMNS = {
+    "holofood_sample": ["accession", "title", "animal_id"],
+    "holofood_animal": ["accession"],
+    "holofood_genome": ["accession", "cluster_representative", "taxonomy"],
+    "holofood_viralfragment": [
+        "id",
+        "contig_id",
+        "taxonomy",
+        "cluster_representative_id",
+    ],
+}
+
+
+def install_postgres_trigram_indexes(cursor, table, columns):
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for column in columns:
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{table}_{column}_trgm" '
+            f'ON "{table}" USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+        )
+
+
+def install_sqlite_fts5_table(cursor, table, columns):
+    fts = f"{table}_fts"
+    column_list = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+    for suffix in ["ai", "ad", "au"]:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+    cursor.execute(f"DROP TABLE IF EXISTS {fts}")
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({column_list}, "
+        f"content='{table}', tokenize='trigram')"
+    )
+    cursor.execute(
+        f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.rowid, {new_values}); "
+        f"END"
+    )
+    cursor.execute(
+        f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column_list}) "
+        f"VALUES ('delete', old.rowid, {old_values}); "
+        f"END"
+    )
+    cursor.execute(
+        f"CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column_list}) "
+        f"VALUES ('delete', old.rowid, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.rowid, {new_values}); "
+        f"END"
+    )
+    cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def create_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "postgresql":
+        install = install_postgres_trigram_indexes
+    elif connection.vendor == "sqlite" and sqlite3.sqlite_version_info >= (3, 34):
+        install = install_sqlite_fts5_table
+    else:
+        return
+    with connection.cursor() as cursor:
+        for table, columns in SEARCH_INDEXED_COLUMNS.items():
+            install(cursor, table, columns)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("holofood", "0043_measurement_is_truthy"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, migrations.RunPython.noop),
+    ]
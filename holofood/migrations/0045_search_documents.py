@@ -0,0 +1,123 @@
+# Generated by Django 4.2 on 2026-10-18 14:17
+
+import sqlite3
+
+from django.db import migrations, models
+
+# Frozen copy of holofood.search.SEARCH_DOCUMENT_FIELDS as of this migration,
+# so that replaying it does not depend on later changes there.
+# Later changes can be applied with the rebuild_search_index command.
+SEARCH_DOCUMENT_FIELDS = {
+    "holofood.Sample": ["accession", "title", "sample_type", "metabolights_study"],
+    "holofood.Animal": ["accession", "system"],
+    "holofood.GenomeCatalogue": [
+        "id",
+        "title",
+        "biome",
+        "related_mag_catalogue_id",
+        "system",
+    ],
+    "holofood.Genome": ["accession", "cluster_representative", "taxonomy"],
+    "holofood.ViralCatalogue": ["id", "title", "biome", "system"],
+    "holofood.ViralFragment": [
+        "id",
+        "contig_id",
+        "mgnify_analysis_accession",
+        "viral_type",
+        "taxonomy",
+    ],
+    "holofood.AnalysisSummary": ["slug", "title", "author", "content"],
+}
+
+
+def search_document_text(obj, field_names):
+    values = (getattr(obj, name) for name in field_names)
+    return "\n".join(str(value) for value in values if value not in (None, ""))
+
+
+def populate_search_documents(apps, schema_editor):
+    SearchDocument = apps.get_model("holofood", "SearchDocument")
+    for model_label, field_names in SEARCH_DOCUMENT_FIELDS.items():
+        model = apps.get_model(model_label)
+        SearchDocument.objects.bulk_create(
+            (
+                SearchDocument(
+                    entity_type=model._meta.model_name,
+                    object_id=str(obj.pk),
+                    text=search_document_text(obj, field_names),
+                )
+                for obj in model.objects.only(*field_names).iterator(chunk_size=2000)
+            ),
+            batch_size=2000,
+        )
+
+
+def create_search_indexes(apps, schema_editor):
+    """
+    Substring search index on SearchDocument.text (as in holofood.search, as of this migration).
+    """
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS "holofood_searchdocument_text_trgm" '
+                'ON "holofood_searchdocument" USING gin ((UPPER("text"::text)) gin_trgm_ops)'
+            )
+        elif connection.vendor == "sqlite" and sqlite3.sqlite_version_info >= (3, 34):
+            fts = "holofood_searchdocument_fts"
+            for suffix in ["ai", "ad", "au"]:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {fts}")
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5(text, "
+                f"content='holofood_searchdocument', tokenize='trigram')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER {fts}_ai AFTER INSERT ON holofood_searchdocument BEGIN "
+                f"INSERT INTO {fts}(rowid, text) VALUES (new.rowid, new.text); "
+                f"END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER {fts}_ad AFTER DELETE ON holofood_searchdocument BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, text) VALUES ('delete', old.rowid, old.text); "
+                f"END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER {fts}_au AFTER UPDATE ON holofood_searchdocument BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, text) VALUES ('delete', old.rowid, old.text); "
+                f"INSERT INTO {fts}(rowid, text) VALUES (new.rowid, new.text); "
+                f"END"
+            )
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("holofood", "0044_search_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchDocument",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("entity_type", models.CharField(max_length=30)),
+                ("object_id", models.CharField(max_length=200)),
+                ("text", models.TextField()),
+            ],
+            options={
+                "unique_together": {("entity_type", "object_id")},
+            },
+        ),
+        migrations.RunPython(populate_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_search_indexes, migrations.RunPython.noop),
+    ]
@@ -1,58 +1,134 @@
-import logging
-from typing import List
+from __future__ import annotations
 
-from django.db import models
-from django.db.models import Prefetch, Count, Subquery, OuterRef, F
+import hashlib
+import logging
+import math
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import connections, models, transaction
+from django.db.models import Count, Q, F, Window, Case, When, Value
+from django.db.models.functions import Length, RowNumber
+from django.db.models.signals import post_save, post_delete, post_migrate
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.text import slugify
 from martor.models import MartorField
 
+from holofood.export_snapshots import delete_snapshot
 from holofood.external_apis.biosamples.api import (
-    get_sample_structured_data,
     get_biosample,
+    structured_data_from_biosample,
+    checklist_from_biosample,
 )
-from holofood.external_apis.ena.browser_api import get_checklist_metadata
-from holofood.external_apis.ena.portal_api import get_filereport
+from holofood.external_apis.ena.portal_api import get_cached_filereport
 from holofood.external_apis.metabolights.api import get_metabolights_assays
 
 from holofood.external_apis.mgnify.api import MgnifyApi
-from holofood.utils import holofood_config, DistinctFunc
+from holofood.metrics import observe_cache_lookup, HIT, MISS
+from holofood import search
+from holofood.search import (
+    install_search_indexes,
+    SEARCH_DOCUMENT_FIELDS,
+    search_document_text,
+)
 
 _mgnify = MgnifyApi()
 
+# Cache key of the portal's object counts (see holofood.stats), forgotten when those objects change
+PORTAL_STATS_CACHE_KEY = "portal-stats"
+
+# Kinds of export snapshot (see export_snapshots.py), each keyed by catalogue ID
+GENOMES_EXPORT_SNAPSHOT = "genome-catalogue-genomes"
+VIRAL_FRAGMENTS_EXPORT_SNAPSHOT = "viral-catalogue-fragments"
+
 
 class AnimalManager(models.Manager):
-    def get_queryset(self):
-        prefetchable_markers = (
-            holofood_config.tables.animals_list.default_metadata_marker_columns
+    def attach_metadata(
+        self, animals: Iterable[Animal], marker_names: Iterable[str]
+    ) -> List[Animal]:
+        """
+        Fetch some metadata markers of several animals (e.g. those listed on a page) in one query.
+        Each animal gets a `metadata_by_marker` dict, of marker name -> AnimalStructuredDatum
+        (or None if the animal has no datum for that marker).
+        :param animals: Animals, e.g. [sample.animal for sample in page]. May repeat an animal.
+        :param marker_names: Names of the markers to fetch, e.g. ["Treatment name", "Sampling time"]
+        :return: The animals.
+        """
+        animals = [animal for animal in animals if animal is not None]
+        marker_names = list(marker_names)
+        animals_by_accession = defaultdict(list)
+        for animal in animals:
+            animal.metadata_by_marker = dict.fromkeys(marker_names)
+            animals_by_accession[animal.accession].append(animal)
+        if not animals or not marker_names:
+            return animals
+        for datum in AnimalStructuredDatum.objects.filter(
+            animal_id__in=animals_by_accession.keys(),
+            marker__name__in=marker_names,
+        ):
+            for animal in animals_by_accession[datum.animal_id]:
+                if animal.metadata_by_marker.get(datum.marker.name) is None:
+                    animal.metadata_by_marker[datum.marker.name] = datum
+        return animals
+
+    def with_sample_type(self, sample_type: str) -> Q:
+        """
+        A filter for animals with at least one sample of a type.
+        Looks up which (few) distinct sample type masks include the type, so that the filter
+        is an indexed IN lookup rather than a bitwise test of every row.
+        :param sample_type: One of Sample.SAMPLE_TYPE_CHOICES, e.g. "metagenomic_assembly"
+        :return: Q object filtering Animals.
+        """
+        bit = Sample.SAMPLE_TYPE_BITS[sample_type]
+        masks = (
+            self.model._base_manager.order_by()
+            .values_list("sample_types_mask", flat=True)
+            .distinct()
         )
-        primary_markers = AnimalStructuredDatum.objects.filter(
-            marker__name__in=prefetchable_markers
+        return Q(sample_types_mask__in=[mask for mask in masks if mask & bit])
+
+    def refresh_sample_summaries(self, accessions: Iterable[str] = None) -> int:
+        """
+        Recompute the denormalised samples_count and sample_types_mask of animals, from their samples.
+        :param accessions: Animal accessions to refresh. Default is all animals.
+        :return: Number of animals whose summaries changed.
+        """
+        animals = self.model._base_manager.only(
+            "accession", "samples_count", "sample_types_mask"
         )
-        samples = Sample.objects.filter(animal=OuterRef("pk")).order_by("sample_type")
-        return (
-            super()
-            .get_queryset()
-            .annotate(samples_count=Count("samples"))
-            .annotate(
-                sample_types=Subquery(
-                    samples.values_list("sample_type", flat=True)
-                    .annotate(
-                        all_types=DistinctFunc(
-                            F("sample_type"), function="GROUP_CONCAT"
-                        )
-                    )
-                    .values("all_types")
-                )
-            )
-            .prefetch_related(
-                Prefetch(
-                    "structured_metadata",
-                    queryset=primary_markers,
-                    to_attr="primary_metadata",
-                )
+        samples = Sample._base_manager.order_by()
+        if accessions is not None:
+            accessions = set(accessions)
+            animals = animals.filter(accession__in=accessions)
+            samples = samples.filter(animal_id__in=accessions)
+
+        counts = defaultdict(int)
+        masks = defaultdict(int)
+        for sample_type_count in samples.values("animal_id", "sample_type").annotate(
+            count=Count("pk")
+        ):
+            animal_id = sample_type_count["animal_id"]
+            counts[animal_id] += sample_type_count["count"]
+            masks[animal_id] |= Sample.SAMPLE_TYPE_BITS.get(
+                sample_type_count["sample_type"], 0
             )
+
+        changed = []
+        for animal in animals.iterator(chunk_size=2000):
+            count, mask = counts[animal.pk], masks[animal.pk]
+            if (animal.samples_count, animal.sample_types_mask) != (count, mask):
+                animal.samples_count = count
+                animal.sample_types_mask = mask
+                changed.append(animal)
+        self.model._base_manager.bulk_update(
+            changed, ["samples_count", "sample_types_mask"], batch_size=500
         )
+        return len(changed)
 
 
 class Animal(models.Model):
@@ -69,9 +145,21 @@ class Animal(models.Model):
     accession = models.CharField(primary_key=True, max_length=15)
     system = models.CharField(choices=SYSTEM_CHOICES, max_length=10, null=True)
 
+    # Denormalised from the animal's samples; see AnimalManager.refresh_sample_summaries
+    samples_count = models.PositiveIntegerField(default=0, db_index=True)
+    sample_types_mask = models.PositiveIntegerField(default=0, db_index=True)
+
     class Meta:
         ordering = ("accession",)
 
+    @property
+    def sample_types(self) -> List[str]:
+        return sorted(
+            sample_type
+            for sample_type, bit in Sample.SAMPLE_TYPE_BITS.items()
+            if self.sample_types_mask & bit
+        )
+
     def refresh_structureddata(self, structured_metadata: dict = None):
         """
         Set the metadata on Animal, either using a dict of structured metadata from BioSamples,
@@ -79,57 +167,21 @@ class Animal(models.Model):
         :param structured_metadata: Optional dict of metadata sections, e.g. if known from sample import.
         :return:
         """
-        if not structured_metadata:
-            metadata = get_sample_structured_data(self.accession)
+        if structured_metadata is None:
+            metadata = structured_data_from_biosample(get_biosample(self.accession))
         else:
             metadata = structured_metadata
 
-        for metadata_type, metadata_content in metadata.items():
-            if not metadata_content:
-                logging.debug(
-                    f"{metadata_type=} from {self.accession} was null – skipping"
-                )
-                continue
-            for metadatum in metadata_content:
-                marker, created = SampleMetadataMarker.objects.update_or_create(
-                    name=metadatum["marker"]["value"],
-                    type=metadata_type,
-                    defaults={"iri": metadatum["marker"]["iri"]},
-                )
-                if created:
-                    logging.info(f"Created new SampleMetadataMarker {marker}")
-                self.structured_metadata.update_or_create(
-                    marker=marker,
-                    defaults={
-                        "source": SampleStructuredDatum.BIOSAMPLES,
-                        "measurement": metadatum["measurement"]["value"],
-                        "partner_name": metadatum.get("partner", {}).get("value"),
-                        "partner_iri": metadatum.get("partner", {}).get("iri"),
-                        "units": metadatum.get("measurement_units", {}).get("value"),
-                    },
-                )
+        from holofood.importers import StructuredMetadataImporter
+
+        importer = StructuredMetadataImporter()
+        importer.add_animal_metadata(self.accession, metadata)
+        importer.flush()
 
 
 class SampleManager(models.Manager):
     def get_queryset(self):
-        prefetchable_markers = (
-            holofood_config.tables.animals_list.default_metadata_marker_columns
-        )
-        primary_markers = AnimalStructuredDatum.objects.filter(
-            marker__name__in=prefetchable_markers
-        )
-        return (
-            super()
-            .get_queryset()
-            .select_related("animal")
-            .prefetch_related(
-                Prefetch(
-                    "animal__structured_metadata",
-                    queryset=primary_markers,
-                    to_attr="primary_metadata",
-                )
-            )
-        )
+        return super().get_queryset().select_related("animal")
 
 
 class Sample(models.Model):
@@ -164,6 +216,23 @@ class Sample(models.Model):
         (HEAVY_METALS, HEAVY_METALS),
         (INFLAMMATORY_MARKERS, INFLAMMATORY_MARKERS),
     ]
+    # For Animal.sample_types_mask. Append new types, to keep existing bits stable.
+    SAMPLE_TYPE_BITS = {
+        sample_type: 1 << i for i, (sample_type, _) in enumerate(SAMPLE_TYPE_CHOICES)
+    }
+
+    METAGENOMIC_SAMPLE_TYPES = [
+        METAGENOMIC_ASSEMBLY,
+        METAGENOMIC_AMPLICON,
+        META_TRANSCRIPTOMIC,
+    ]
+    SEQUENCING_SAMPLE_TYPES = [
+        HOST_GENOMIC,
+        METAGENOMIC_AMPLICON,
+        METAGENOMIC_ASSEMBLY,
+        TRANSCRIPTOMIC,
+        META_TRANSCRIPTOMIC,
+    ]
 
     objects = SampleManager()
 
@@ -181,26 +250,23 @@ class Sample(models.Model):
     def __str__(self):
         return f"Sample {self.accession} - {self.title}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # So that the previous animal's summary can be updated if the sample is moved
+        instance._loaded_animal_id = instance.__dict__.get("animal_id")
+        return instance
+
     class Meta:
         ordering = ("accession",)
 
     @property
     def is_sequencing_sample(self):
-        return self.sample_type in [
-            self.HOST_GENOMIC,
-            self.METAGENOMIC_AMPLICON,
-            self.METAGENOMIC_ASSEMBLY,
-            self.TRANSCRIPTOMIC,
-            self.META_TRANSCRIPTOMIC,
-        ]
+        return self.sample_type in self.SEQUENCING_SAMPLE_TYPES
 
     @property
     def is_metagenomic_sample(self):
-        return self.sample_type in [
-            self.METAGENOMIC_ASSEMBLY,
-            self.METAGENOMIC_AMPLICON,
-            self.META_TRANSCRIPTOMIC,
-        ]
+        return self.sample_type in self.METAGENOMIC_SAMPLE_TYPES
 
     def refresh_structureddata(
         self, structured_metadata: dict = None, checklist: list = None
@@ -212,55 +278,24 @@ class Sample(models.Model):
         :param structured_metadata: Optional dict of metadata sections, e.g. if known from sample import.
         :return:
         """
-        if not structured_metadata:
-            metadata = get_sample_structured_data(self.accession)
+        if structured_metadata is None or checklist is None:
+            # Both are derived from a single fetch of the biosample document
+            biosample = get_biosample(self.accession)
+        if structured_metadata is None:
+            metadata = structured_data_from_biosample(biosample)
         else:
             metadata = structured_metadata
 
-        for metadata_type, metadata_content in metadata.items():
-            if not metadata_content:
-                logging.debug(
-                    f"{metadata_type=} from {self.accession} was null – skipping"
-                )
-                continue
-            for metadatum in metadata_content:
-                marker, created = SampleMetadataMarker.objects.update_or_create(
-                    name=metadatum["marker"]["value"],
-                    type=metadata_type,
-                    defaults={"iri": metadatum["marker"]["iri"]},
-                )
-                if created:
-                    logging.info(f"Created new SampleMetadataMarker {marker}")
-                self.structured_metadata.update_or_create(
-                    marker=marker,
-                    defaults={
-                        "source": SampleStructuredDatum.BIOSAMPLES,
-                        "measurement": metadatum["measurement"]["value"],
-                        "partner_name": metadatum.get("partner", {}).get("value"),
-                        "partner_iri": metadatum.get("partner", {}).get("iri"),
-                        "units": metadatum.get("measurement_units", {}).get("value"),
-                    },
-                )
-
-        if checklist:
+        if checklist is not None:
             checklist_metadata = checklist
         else:
-            checklist_metadata = get_checklist_metadata(self.accession)
+            checklist_metadata = checklist_from_biosample(biosample)
 
-        for metadatum in checklist_metadata:
-            marker, created = SampleMetadataMarker.objects.update_or_create(
-                name=metadatum.tag, type="ENA Checklist"
-            )
-            if created:
-                logging.info(f"Created new SampleMetadataMarker {marker}")
-            self.structured_metadata.update_or_create(
-                marker=marker,
-                defaults={
-                    "source": SampleStructuredDatum.ENA,
-                    "measurement": metadatum.value,
-                    "units": metadatum.units,
-                },
-            )
+        from holofood.importers import StructuredMetadataImporter
+
+        importer = StructuredMetadataImporter()
+        importer.add_sample_metadata(self.accession, metadata, checklist_metadata)
+        importer.flush()
 
     def refresh_external_references(self, external_references_list: List[dict] = None):
         """
@@ -270,7 +305,7 @@ class Sample(models.Model):
         :param external_references_list: Optional structure of `externalReferences` biosamples API response if already known.
         :return:
         """
-        if not external_references_list:
+        if external_references_list is None:
             refs = get_biosample(self.accession).get("externalReferences")
         else:
             refs = external_references_list
@@ -291,7 +326,104 @@ class Sample(models.Model):
         return assays
 
     def get_ena_records(self):
-        return get_filereport(self.accession)
+        """
+        The sample's (first) ENA read run: from the DB if it was bulk-fetched, otherwise from
+        the (cached) ENA Portal API filereport.
+        """
+        return self.get_stored_ena_records() or self.fetch_ena_records()
+
+    def get_stored_ena_records(self):
+        return self.ena_read_runs.first()
+
+    def fetch_ena_records(self):
+        return get_cached_filereport(self.accession)
+
+
+class EnaReadRun(models.Model):
+    """
+    A sequencing run (and its experiment and study) of a sample, as recorded in ENA's read_run report.
+    Stored locally so that sample pages need not query ENA.
+    """
+
+    run_accession = models.CharField(primary_key=True, max_length=20)
+    sample = models.ForeignKey(
+        Sample, on_delete=models.CASCADE, related_name="ena_read_runs"
+    )
+    sample_title = models.CharField(max_length=200, blank=True)
+    experiment_accession = models.CharField(max_length=20, blank=True)
+    experiment_title = models.CharField(max_length=500, blank=True)
+    study_accession = models.CharField(max_length=20, blank=True)
+    study_title = models.CharField(max_length=500, blank=True)
+    run_alias = models.CharField(max_length=200, blank=True)
+    read_count = models.BigIntegerField(null=True, blank=True)
+    base_count = models.BigIntegerField(null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    UPDATE_FIELDS = [
+        "sample",
+        "sample_title",
+        "experiment_accession",
+        "experiment_title",
+        "study_accession",
+        "study_title",
+        "run_alias",
+        "read_count",
+        "base_count",
+        "updated",
+    ]
+
+    class Meta:
+        ordering = ("sample", "run_accession")
+
+    def __str__(self):
+        return f"ENA run {self.run_accession} of {self.sample_id}"
+
+    @classmethod
+    def from_ena_record(cls, record: dict) -> EnaReadRun:
+        def count(value):
+            return int(value) if value not in (None, "") else None
+
+        return cls(
+            run_accession=record["run_accession"],
+            sample_id=record["sample_accession"],
+            sample_title=record.get("sample_title") or "",
+            experiment_accession=record.get("experiment_accession") or "",
+            experiment_title=record.get("experiment_title") or "",
+            study_accession=record.get("study_accession") or "",
+            study_title=record.get("study_title") or "",
+            run_alias=record.get("run_alias") or "",
+            read_count=count(record.get("read_count")),
+            base_count=count(record.get("base_count")),
+        )
+
+
+class SampleMetadataMarkerManager(models.Manager):
+    name_cache_timeout = 60 * 60
+
+    @staticmethod
+    def _name_cache_key(name: str) -> str:
+        # Hashed, since names can have characters that cache keys can't (and slugs would merge)
+        return f"marker-ids:{hashlib.md5(name.lower().encode()).hexdigest()}"
+
+    def ids_for_name(self, name: str) -> List[int]:
+        """
+        IDs of the markers with a name (case-insensitive; one per marker type), cached.
+        :param name: Marker name, e.g. "Treatment concentration"
+        :return: List of marker IDs, possibly empty.
+        """
+        key = self._name_cache_key(name)
+        ids = cache.get(key)
+        observe_cache_lookup("marker-ids", MISS if ids is None else HIT)
+        if ids is None:
+            ids = list(self.filter(name__iexact=name).values_list("id", flat=True))
+            cache.set(key, ids, timeout=self.name_cache_timeout)
+        return ids
+
+    def forget_names(self, names: Iterable[str]):
+        """
+        Invalidate cached marker IDs, e.g. after creating markers in bulk.
+        """
+        cache.delete_many([self._name_cache_key(name) for name in names])
 
 
 class SampleMetadataMarker(models.Model):
@@ -300,6 +432,8 @@ class SampleMetadataMarker(models.Model):
     Often the definition is linked via an IRI to an ontology/controlled vocabulary.
     """
 
+    objects = SampleMetadataMarkerManager()
+
     name = models.CharField(max_length=100)
     iri = models.CharField(max_length=100, null=True, blank=True)
     type = models.CharField(max_length=100, null=True, blank=True)
@@ -314,6 +448,13 @@ class SampleMetadataMarker(models.Model):
     def __str__(self):
         return f"Sample Metadata Marker {self.id}: {self.name} ({self.type})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # So that the cached IDs of the previous name can be forgotten if the marker is renamed
+        instance._loaded_name = instance.__dict__.get("name")
+        return instance
+
 
 class StructuredDatumManager(models.Manager):
     def get_queryset(self):
@@ -334,14 +475,51 @@ class AbstractStructuredDatum(models.Model):
 
     marker = models.ForeignKey(SampleMetadataMarker, on_delete=models.CASCADE)
     measurement = models.CharField(max_length=300)
+    # Parsed from measurement, if it is a number. For range filtering.
+    measurement_numeric = models.FloatField(null=True, blank=True)
+    # Whether measurement is not one of FALSY_MEASUREMENTS. For presence filtering.
+    measurement_is_truthy = models.BooleanField(default=True)
     units = models.CharField(max_length=100, null=True, blank=True)
 
     partner_name = models.CharField(max_length=100, null=True, blank=True)
     partner_iri = models.CharField(max_length=100, null=True, blank=True)
 
+    FALSY_MEASUREMENTS = ("0", "false", "unknown", "n/a", "null")
+
     class Meta:
         abstract = True
 
+    @classmethod
+    def is_truthy_measurement(cls, measurement) -> bool:
+        return str(measurement).lower() not in cls.FALSY_MEASUREMENTS
+
+    @staticmethod
+    def parse_numeric_measurement(measurement) -> Optional[float]:
+        """
+        Parse a measurement as a (finite) number, if it is one.
+        :param measurement: Measurement as stored, e.g. "3.14", "1e-3" or "big"
+        :return: The number, e.g. 3.14, or None if not numeric.
+        """
+        if measurement is None or isinstance(measurement, bool):
+            return None
+        try:
+            number = float(str(measurement).strip())
+        except ValueError:
+            return None
+        return number if math.isfinite(number) else None
+
+    def save(self, *args, **kwargs):
+        self.measurement_numeric = self.parse_numeric_measurement(self.measurement)
+        self.measurement_is_truthy = self.is_truthy_measurement(self.measurement)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "measurement" in update_fields:
+            kwargs["update_fields"] = {
+                *update_fields,
+                "measurement_numeric",
+                "measurement_is_truthy",
+            }
+        return super().save(*args, **kwargs)
+
 
 class SampleStructuredDatum(AbstractStructuredDatum):
     """
@@ -364,6 +542,15 @@ class SampleStructuredDatum(AbstractStructuredDatum):
             "marker__name",
             "id",
         )
+        unique_together = [("sample", "marker")]
+        indexes = [
+            models.Index(fields=["marker", "measurement_numeric"]),
+            models.Index(
+                fields=["marker", "sample"],
+                condition=Q(measurement_is_truthy=True),
+                name="sample_datum_truthy_idx",
+            ),
+        ]
 
 
 class AnimalStructuredDatum(AbstractStructuredDatum):
@@ -387,6 +574,15 @@ class AnimalStructuredDatum(AbstractStructuredDatum):
             "marker__name",
             "id",
         )
+        unique_together = [("animal", "marker")]
+        indexes = [
+            models.Index(fields=["marker", "measurement_numeric"]),
+            models.Index(
+                fields=["marker", "animal"],
+                condition=Q(measurement_is_truthy=True),
+                name="animal_datum_truthy_idx",
+            ),
+        ]
 
 
 class AnalysisSummary(models.Model):
@@ -464,25 +660,28 @@ class Genome(models.Model):
 
 class GenomeSampleContainmentManager(models.Manager):
     def get_queryset(self):
-        prefetchable_markers = (
-            holofood_config.tables.animals_list.default_metadata_marker_columns
-        )
-        primary_markers = AnimalStructuredDatum.objects.filter(
-            marker__name__in=prefetchable_markers
-        )
         return (
             super()
             .get_queryset()
             .select_related("sample")
             .select_related("genome")
             .select_related("sample__animal")
-            .prefetch_related(
-                Prefetch(
-                    "sample__animal__structured_metadata",
-                    queryset=primary_markers,
-                    to_attr="primary_metadata",
-                )
-            )
+        )
+
+    def catalogue_matrix(
+        self, catalogue_id: str, min_containment: Optional[float] = None
+    ) -> models.QuerySet:
+        """
+        The containments of all of a catalogue's genomes, as a sparse (COO) matrix.
+        :param catalogue_id: ID of the Genome Catalogue
+        :param min_containment: Leave out containments below this, e.g. 0.5
+        :return: (genome accession, sample accession, containment) tuples, ordered by genome then sample.
+        """
+        containments = self.filter(genome__catalogue_id=catalogue_id)
+        if min_containment is not None:
+            containments = containments.filter(containment__gte=min_containment)
+        return containments.order_by("genome_id", "sample_id").values_list(
+            "genome_id", "sample_id", "containment"
         )
 
 
@@ -576,3 +775,249 @@ class ViralFragment(models.Model):
 
     class Meta:
         ordering = ("id",)
+
+
+class SearchDocumentManager(models.Manager):
+    def index(self, objects: Iterable[models.Model], batch_size: int = 1000):
+        """
+        Create or update the search documents of some objects (of the SEARCH_DOCUMENT_FIELDS models).
+        :param objects: e.g. [sample] or Genome.objects.all()
+        :param batch_size: Number of documents to upsert per query.
+        """
+        documents = [
+            self.model(
+                entity_type=obj._meta.model_name,
+                object_id=str(obj.pk),
+                text=search_document_text(obj),
+            )
+            for obj in objects
+        ]
+        self.bulk_create(
+            documents,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["entity_type", "object_id"],
+            update_fields=["text"],
+        )
+
+    def unindex(self, obj: models.Model):
+        self.filter(entity_type=obj._meta.model_name, object_id=str(obj.pk)).delete()
+
+    def rebuild(self, batch_size: int = 1000) -> int:
+        """
+        Replace every search document, e.g. after objects were changed outside of the ORM.
+        :param batch_size: Number of objects to read and index at once.
+        :return: Number of documents indexed.
+        """
+        indexed = 0
+        with transaction.atomic():
+            self.all().delete()
+            for model_label, field_names in SEARCH_DOCUMENT_FIELDS.items():
+                model = apps.get_model(model_label)
+                batch = []
+                for obj in model._base_manager.only(*field_names).iterator(
+                    chunk_size=batch_size
+                ):
+                    batch.append(obj)
+                    if len(batch) >= batch_size:
+                        self.index(batch, batch_size)
+                        indexed += len(batch)
+                        batch = []
+                self.index(batch, batch_size)
+                indexed += len(batch)
+        return indexed
+
+    def search(
+        self, query: str, limit_per_type: int = 10
+    ) -> Dict[str, Tuple[List[models.Model], int]]:
+        """
+        Find objects of every searchable type whose search document contains the query (case-insensitively),
+        in a single query.
+        Within each type, objects whose ID matches the query exactly come first, then those whose ID starts
+        with it, then those with the shortest (i.e. most specific) documents.
+        :param query: Text to search for, e.g. "salmon"
+        :param limit_per_type: Maximum number of objects to return of each type.
+        :return: Dict of entity type (model name, e.g. "sample") to (best matching objects, total matches).
+        """
+        results = {
+            apps.get_model(model_label)._meta.model_name: ([], 0)
+            for model_label in SEARCH_DOCUMENT_FIELDS
+        }
+        if not query:
+            return results
+
+        relevance = Case(
+            When(object_id__iexact=query, then=Value(0)),
+            When(object_id__istartswith=query, then=Value(1)),
+            default=Value(2),
+        )
+        hits = (
+            self.filter(search.contains(self.model, "text", query))
+            .annotate(
+                total=Window(Count("pk"), partition_by=[F("entity_type")]),
+                rank=Window(
+                    RowNumber(),
+                    partition_by=[F("entity_type")],
+                    order_by=[
+                        relevance.asc(),
+                        Length("text").asc(),
+                        F("object_id").asc(),
+                    ],
+                ),
+            )
+            .filter(rank__lte=limit_per_type)
+            .order_by("entity_type", "rank")
+            .values_list("entity_type", "object_id", "total")
+        )
+
+        hit_ids = defaultdict(list)
+        totals = {}
+        for entity_type, object_id, total in hits:
+            hit_ids[entity_type].append(object_id)
+            totals[entity_type] = total
+        for entity_type, object_ids in hit_ids.items():
+            objects = apps.get_model("holofood", entity_type)._default_manager.in_bulk(
+                object_ids
+            )
+            results[entity_type] = (
+                [
+                    objects[object_id]
+                    for object_id in object_ids
+                    if object_id in objects
+                ],
+                totals[entity_type],
+            )
+        return results
+
+
+class SearchDocument(models.Model):
+    """
+    The denormalised text of one searchable object (Sample, Genome, etc.), for the global search.
+    Kept up to date by model signals, and trigram indexed (see holofood.search).
+    """
+
+    objects = SearchDocumentManager()
+
+    entity_type = models.CharField(max_length=30)
+    object_id = models.CharField(max_length=200)
+    text = models.TextField()
+
+    class Meta:
+        unique_together = [("entity_type", "object_id")]
+
+    def __str__(self):
+        return f"Search document for {self.entity_type} {self.object_id}"
+
+
+_sample_summaries = threading.local()
+
+
+@contextmanager
+def deferred_animal_sample_summaries():
+    """
+    Defer updating Animals' sample summaries (counts and types) until the end of a bulk import,
+    rather than on each Sample save/delete.
+    """
+    if getattr(_sample_summaries, "pending", None) is not None:
+        # Already deferred by an outer context
+        yield
+        return
+    _sample_summaries.pending = set()
+    try:
+        yield
+    finally:
+        pending, _sample_summaries.pending = _sample_summaries.pending, None
+        if pending:
+            Animal.objects.refresh_sample_summaries(pending)
+
+
+def _refresh_animal_sample_summaries(*accessions):
+    accessions = {accession for accession in accessions if accession}
+    pending = getattr(_sample_summaries, "pending", None)
+    if pending is not None:
+        pending.update(accessions)
+    else:
+        Animal.objects.refresh_sample_summaries(accessions)
+
+
+@receiver(post_save, sender=Sample)
+def update_animal_on_sample_save(sender, instance: Sample, raw=False, **kwargs):
+    if raw:
+        return
+    _refresh_animal_sample_summaries(
+        instance.animal_id, getattr(instance, "_loaded_animal_id", None)
+    )
+    instance._loaded_animal_id = instance.animal_id
+
+
+@receiver(post_delete, sender=Sample)
+def update_animal_on_sample_delete(sender, instance: Sample, **kwargs):
+    _refresh_animal_sample_summaries(instance.animal_id)
+
+
+@receiver(post_save, sender=SampleMetadataMarker)
+@receiver(post_delete, sender=SampleMetadataMarker)
+def forget_cached_marker_ids(sender, instance: SampleMetadataMarker, **kwargs):
+    # The new name, and the previous one if renamed
+    names = {instance.name, getattr(instance, "_loaded_name", None)} - {None}
+    instance._loaded_name = instance.name
+    SampleMetadataMarker.objects.forget_names(names)
+    # Again once committed, in case another request cached the old IDs in the meantime
+    transaction.on_commit(lambda: SampleMetadataMarker.objects.forget_names(names))
+
+
+def index_search_document(sender, instance: models.Model, raw=False, **kwargs):
+    if raw:
+        return
+    SearchDocument.objects.index([instance])
+
+
+def unindex_search_document(sender, instance: models.Model, **kwargs):
+    SearchDocument.objects.unindex(instance)
+
+
+for _model_label in SEARCH_DOCUMENT_FIELDS:
+    post_save.connect(index_search_document, sender=_model_label)
+    post_delete.connect(unindex_search_document, sender=_model_label)
+
+
+def forget_portal_stats(sender, raw=False, **kwargs):
+    if raw:
+        return
+    cache.delete(PORTAL_STATS_CACHE_KEY)
+    # Again once committed, in case another request cached the stats in the meantime
+    transaction.on_commit(lambda: cache.delete(PORTAL_STATS_CACHE_KEY))
+
+
+for _model in [Sample, Animal, Genome, ViralFragment, AnalysisSummary]:
+    post_save.connect(forget_portal_stats, sender=_model)
+    post_delete.connect(forget_portal_stats, sender=_model)
+
+
+def forget_export_snapshot(sender, instance, raw=False, **kwargs):
+    """
+    Delete the export snapshot of the catalogue whose (exported) data changed.
+    """
+    if raw:
+        return
+    if isinstance(instance, GenomeCatalogue):
+        delete_snapshot(GENOMES_EXPORT_SNAPSHOT, instance.id)
+    elif isinstance(instance, Genome):
+        delete_snapshot(GENOMES_EXPORT_SNAPSHOT, instance.catalogue_id)
+    elif isinstance(instance, ViralCatalogue):
+        delete_snapshot(VIRAL_FRAGMENTS_EXPORT_SNAPSHOT, instance.id)
+    elif isinstance(instance, ViralFragment):
+        delete_snapshot(VIRAL_FRAGMENTS_EXPORT_SNAPSHOT, instance.catalogue_id)
+
+
+for _model in [GenomeCatalogue, Genome, ViralCatalogue, ViralFragment]:
+    post_save.connect(forget_export_snapshot, sender=_model)
+    post_delete.connect(forget_export_snapshot, sender=_model)
+
+
+@receiver(post_migrate)
+def create_search_indexes(sender, app_config, using, **kwargs):
+    # Also after (re)migrations that re-create tables, and for test DBs created without migrations.
+    # `flush` sends the signal without the migration state's apps.
+    if app_config.label == "holofood":
+        install_search_indexes(connections[using], kwargs.get("apps", apps))
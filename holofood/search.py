@@ -0,0 +1,240 @@
+import logging
+import sqlite3
+from typing import Dict, Iterator, List, Optional
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import Q, Model, ForeignKey, Field
+from django.db.models.expressions import RawSQL
+
+# Fields (of each model) that substring ("contains") filters are indexed for.
+# Foreign keys are indexed by their ID column, e.g. for `animal__accession__icontains` on Samples.
+SEARCH_INDEXED_FIELDS: Dict[str, List[str]] = {
+    "holofood.Sample": ["accession", "title", "animal"],
+    "holofood.Animal": ["accession"],
+    "holofood.Genome": ["accession", "cluster_representative", "taxonomy"],
+    "holofood.ViralFragment": ["id", "contig_id", "taxonomy", "cluster_representative"],
+    "holofood.SearchDocument": ["text"],
+}
+
+# Models included in the global search, and the fields denormalised into each object's SearchDocument.
+# Large fields like ViralFragment.gff are deliberately left out.
+SEARCH_DOCUMENT_FIELDS: Dict[str, List[str]] = {
+    "holofood.Sample": ["accession", "title", "sample_type", "metabolights_study"],
+    "holofood.Animal": ["accession", "system"],
+    "holofood.GenomeCatalogue": [
+        "id",
+        "title",
+        "biome",
+        "related_mag_catalogue_id",
+        "system",
+    ],
+    "holofood.Genome": ["accession", "cluster_representative", "taxonomy"],
+    "holofood.ViralCatalogue": ["id", "title", "biome", "system"],
+    "holofood.ViralFragment": [
+        "id",
+        "contig_id",
+        "mgnify_analysis_accession",
+        "viral_type",
+        "taxonomy",
+    ],
+    "holofood.AnalysisSummary": ["slug", "title", "author", "content"],
+}
+
+
+def search_document_text(obj: Model) -> str:
+    """
+    The text of an object's global search document: its SEARCH_DOCUMENT_FIELDS values, one per line.
+    """
+    values = (getattr(obj, name) for name in SEARCH_DOCUMENT_FIELDS[obj._meta.label])
+    return "\n".join(str(value) for value in values if value not in (None, ""))
+
+
+def _indexed_models(apps) -> Iterator[tuple]:
+    for model_label, field_names in SEARCH_INDEXED_FIELDS.items():
+        try:
+            model = apps.get_model(model_label)
+        except LookupError:
+            # Not (yet) in this migration state
+            continue
+        yield model, field_names
+
+
+def _indexed_field(model, field_path: str) -> Optional[Field]:
+    """
+    The indexed model field that a (possibly related) field path filters on, if any.
+    E.g. "animal__accession" on Sample resolves to the `animal` foreign key,
+    because Sample.animal_id *is* the animal's accession.
+    """
+    parts = field_path.split("__")
+    field = model._meta.get_field(parts[0])
+    if len(parts) == 2 and isinstance(field, ForeignKey):
+        if parts[1] != field.target_field.name:
+            return None
+    elif len(parts) != 1:
+        return None
+    if field.name not in SEARCH_INDEXED_FIELDS.get(model._meta.label, []):
+        return None
+    return field
+
+
+class ContainsSearchBackend:
+    """
+    Case-insensitive substring search, using plain `icontains` lookups (i.e. sequential scans).
+    Subclasses install and use trigram indexes, for specific database vendors.
+    """
+
+    def install(self, connection, apps):
+        """
+        Create (or repair) the search indexes for SEARCH_INDEXED_FIELDS.
+        :param connection: Database connection (e.g. schema_editor.connection).
+        :param apps: App registry to read models from (e.g. historical models in a migration).
+        """
+        pass
+
+    def contains(self, model, field_path: str, value: str) -> Q:
+        """
+        A filter for objects whose field contains a value, case-insensitively.
+        :param model: Model being filtered, e.g. Sample
+        :param field_path: Field (lookup path) to filter, e.g. "accession" or "animal__accession"
+        :param value: Substring to search for, e.g. "SAMEA123"
+        :return: Q object, equivalent to Q(<field_path>__icontains=value)
+        """
+        return Q(**{f"{field_path}__icontains": value})
+
+
+class PostgresTrigramSearchBackend(ContainsSearchBackend):
+    """
+    On Postgres, `icontains` becomes `UPPER(column::text) LIKE UPPER('%value%')`,
+    which can use a pg_trgm GIN index on exactly that expression.
+    """
+
+    def install(self, connection, apps):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for model, field_names in _indexed_models(apps):
+                table = model._meta.db_table
+                for field_name in field_names:
+                    column = model._meta.get_field(field_name).column
+                    cursor.execute(
+                        f'CREATE INDEX IF NOT EXISTS "{table}_{column}_trgm" '
+                        f'ON "{table}" USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+                    )
+
+
+class SqliteFts5SearchBackend(ContainsSearchBackend):
+    """
+    On SQLite, each model's indexed fields are mirrored into an FTS5 "shadow" table with a
+    trigram tokenizer (kept in sync by triggers), which can find substrings of 3+ characters.
+    Shorter searches fall back to `icontains`.
+    """
+
+    min_length = 3
+
+    def __init__(self):
+        self._installed_tables = set()
+
+    @staticmethod
+    def fts_table(model) -> str:
+        return f"{model._meta.db_table}_fts"
+
+    def install(self, connection, apps):
+        with connection.cursor() as cursor:
+            for model, field_names in _indexed_models(apps):
+                table = model._meta.db_table
+                fts = self.fts_table(model)
+                columns = [model._meta.get_field(name).column for name in field_names]
+                column_list = ", ".join(columns)
+                new_values = ", ".join(f"new.{column}" for column in columns)
+                old_values = ", ".join(f"old.{column}" for column in columns)
+
+                # Django re-creates SQLite tables for some schema changes, dropping triggers
+                # and renumbering rowids, so the shadow table is rebuilt from scratch.
+                for suffix in ["ai", "ad", "au"]:
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+                cursor.execute(f"DROP TABLE IF EXISTS {fts}")
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE {fts} USING fts5({column_list}, "
+                    f"content='{table}', tokenize='trigram')"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+                    f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.rowid, {new_values}); "
+                    f"END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, {column_list}) "
+                    f"VALUES ('delete', old.rowid, {old_values}); "
+                    f"END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, {column_list}) "
+                    f"VALUES ('delete', old.rowid, {old_values}); "
+                    f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.rowid, {new_values}); "
+                    f"END"
+                )
+                cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        self._installed_tables.clear()
+
+    def _is_installed(self, model) -> bool:
+        fts = self.fts_table(model)
+        if fts not in self._installed_tables:
+            with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name=%s", [fts]
+                )
+                if cursor.fetchone() is None:
+                    return False
+            self._installed_tables.add(fts)
+        return True
+
+    def contains(self, model, field_path: str, value: str) -> Q:
+        field = _indexed_field(model, field_path)
+        if (
+            field is None
+            or len(value) < self.min_length
+            or not self._is_installed(model)
+        ):
+            return super().contains(model, field_path, value)
+        table = model._meta.db_table
+        fts = self.fts_table(model)
+        phrase = '"' + value.replace('"', '""') + '"'
+        return Q(
+            pk__in=RawSQL(
+                f"SELECT {model._meta.pk.column} FROM {table} WHERE rowid IN "
+                f"(SELECT rowid FROM {fts} WHERE {field.column} MATCH %s)",
+                [phrase],
+            )
+        )
+
+
+def _make_search_backend(connection) -> ContainsSearchBackend:
+    if connection.vendor == "postgresql":
+        return PostgresTrigramSearchBackend()
+    if connection.vendor == "sqlite" and sqlite3.sqlite_version_info >= (3, 34):
+        return SqliteFts5SearchBackend()
+    logging.warning(
+        f"No indexed search backend for {connection.vendor}, using plain icontains"
+    )
+    return ContainsSearchBackend()
+
+
+_search_backends: Dict[str, ContainsSearchBackend] = {}
+
+
+def get_search_backend(using: str = DEFAULT_DB_ALIAS) -> ContainsSearchBackend:
+    if using not in _search_backends:
+        _search_backends[using] = _make_search_backend(connections[using])
+    return _search_backends[using]
+
+
+def contains(model: Model, field_path: str, value: str) -> Q:
+    """
+    Index-backed equivalent of Q(<field_path>__icontains=value). See ContainsSearchBackend.contains.
+    """
+    return get_search_backend().contains(model, field_path, value)
+
+
+def install_search_indexes(connection, apps):
+    get_search_backend(connection.alias).install(connection, apps)
@@ -0,0 +1,84 @@
+import logging
+from collections import Counter
+from typing import Dict, Tuple
+
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from holofood.models import (
+    PORTAL_STATS_CACHE_KEY,
+    Sample,
+    Animal,
+    Genome,
+    ViralFragment,
+    AnalysisSummary,
+)
+from holofood.metrics import observe_cache_lookup, HIT, MISS
+from holofood.utils import holofood_config
+
+
+def _count_by(model, *group_by: str) -> Dict[Tuple, int]:
+    # Base manager, because default managers' annotations and prefetches would spoil the GROUP BY
+    groups = model._base_manager.order_by().values_list(*group_by).annotate(Count("pk"))
+    return {group[:-1]: group[-1] for group in groups}
+
+
+def _breakdown(counts: Dict[Tuple, int], position: int) -> Dict[str, int]:
+    breakdown = Counter()
+    for group, count in counts.items():
+        if group[position]:
+            breakdown[group[position]] += count
+    return dict(sorted(breakdown.items()))
+
+
+def compute_portal_stats() -> dict:
+    """
+    Count the portal's main data types, with per-system (and for samples, per-sample-type) breakdowns.
+    Uses one grouped query per data type.
+    """
+    samples = _count_by(Sample, "animal__system", "sample_type")
+    animals = _count_by(Animal, "system")
+    genomes = _count_by(Genome, "catalogue__system")
+    viral_fragments = _count_by(ViralFragment, "catalogue__system")
+    return {
+        "samples": {
+            "total": sum(samples.values()),
+            "by_system": _breakdown(samples, 0),
+            "by_sample_type": _breakdown(samples, 1),
+        },
+        "animals": {
+            "total": sum(animals.values()),
+            "by_system": _breakdown(animals, 0),
+        },
+        "genomes": {
+            "total": sum(genomes.values()),
+            "by_system": _breakdown(genomes, 0),
+        },
+        "viral_fragments": {
+            "total": sum(viral_fragments.values()),
+            "by_system": _breakdown(viral_fragments, 0),
+        },
+        "analysis_summaries": {
+            "total": AnalysisSummary.objects.filter(is_published=True).count(),
+        },
+        "computed_at": timezone.now(),
+    }
+
+
+def get_portal_stats() -> dict:
+    """
+    The portal stats (see compute_portal_stats), from Django's cache if possible.
+    The cached stats are forgotten whenever any of the counted objects are saved or deleted.
+    """
+    stats = cache.get(PORTAL_STATS_CACHE_KEY)
+    observe_cache_lookup("portal-stats", MISS if stats is None else HIT)
+    if stats is None:
+        logging.info("Computing portal stats")
+        stats = compute_portal_stats()
+        cache.set(
+            PORTAL_STATS_CACHE_KEY,
+            stats,
+            timeout=holofood_config.portal.stats_cache_ttl.total_seconds(),
+        )
+    return stats
@@ -15,36 +15,22 @@ def animal_metadatum(animal: Animal, marker_name: str) -> Union[str, None]:
     :param marker_name: Metadata marker name.
     Can include '||' to denote a list of marker names that will be checked in order.
     The first present marker will be returned,
+    Uses the animal's `metadata_by_marker` where the view attached it (see AnimalMetadataListMixin),
+    otherwise queries the animal's metadata.
     :return: Value if one of the marker_names exists.
     """
-    primary_marker_list = (
-        holofood_config.tables.animals_list.default_metadata_marker_columns
-    )
+    metadata_by_marker = getattr(animal, "metadata_by_marker", {})
     datum = None
-    possible_marker_names = marker_name.split("||")
-    for possible_marker_name in possible_marker_names:
-        if (
-            hasattr(animal, "primary_metadata")
-            and possible_marker_name in primary_marker_list
-        ):
-            try:
-                datum = next(
-                    m
-                    for m in animal.primary_metadata
-                    if m.marker.name == possible_marker_name
-                )
-            except StopIteration:
-                # Metadata was prefetched but didn't exist on this sample
-                continue
-            else:
-                break
+    for possible_marker_name in marker_name.split("||"):
+        if possible_marker_name in metadata_by_marker:
+            # Fetched for the whole page, see AnimalManager.attach_metadata
+            datum = metadata_by_marker[possible_marker_name]
         else:
-            # Metadata not prefetched
             datum = animal.structured_metadata.filter(
                 marker__name=possible_marker_name
             ).first()
-            if datum:
-                break
+        if datum:
+            break
 
     if datum is None:
         return None
@@ -61,7 +47,7 @@ def data_type_icons(sample: Union[Sample, Animal]) -> dict:
     if type(sample) is Sample:
         data_types[sample.sample_type] = True
     elif type(sample) is Animal and hasattr(sample, "sample_types"):
-        for sample_type in sample.sample_types.split(","):
+        for sample_type in sample.sample_types:
             data_types[sample_type] = True
     return data_types
 
@@ -2,7 +2,9 @@ import io
 from typing import List
 
 import pytest
+from django.core.cache import cache
 
+from holofood.utils import holofood_config
 from holofood.models import (
     Sample,
     SampleMetadataMarker,
@@ -18,6 +20,20 @@ from holofood.models import (
 )
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def export_snapshots_dir(tmp_path, monkeypatch):
+    snapshots_dir = tmp_path / "export-snapshots"
+    monkeypatch.setattr(holofood_config.exports, "snapshots_dir", str(snapshots_dir))
+    return snapshots_dir
+
+
 @pytest.fixture()
 def salmon_animal():
     return Animal.objects.create(
@@ -1,9 +1,25 @@
+from holofood.config import MonitoringConfig
 from holofood.settings import *
 
 UNIT_TESTING = True
 
 HOLOFOOD_CONFIG = HolofoodConfig(
     _env_file=holofood_config_env,
+    monitoring=MonitoringConfig(
+        # Fail tests on N+1 query regressions in pages that list many objects
+        raise_over_query_budget=True,
+        view_query_budgets={
+            "samples_list": 8,
+            "animals_list": 8,
+            "genome_detail": 10,
+        },
+    ),
 )
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
 del STORAGES  # disable whitenoise static file serving
@@ -1,12 +1,43 @@
+import gzip
+import io
+import json
+import logging
+import shutil
+from datetime import timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from holofood.models import (
     SampleStructuredDatum,
     SampleMetadataMarker,
     AnimalStructuredDatum,
     Sample,
+    Genome,
+    SearchDocument,
+    ViralFragment,
+    GENOMES_EXPORT_SNAPSHOT,
+    VIRAL_FRAGMENTS_EXPORT_SNAPSHOT,
+)
+from holofood.api import ViralFragmentSchema
+from holofood.export import CSVRenderer, build_export_snapshots
+from holofood.export_snapshots import get_snapshot, write_snapshot
+from holofood.instrumentation import (
+    QueryBudgetExceeded,
+    record_request_metrics,
+    record_http_call,
 )
 from holofood.tests.conftest import set_metabolights_project_for_sample
+from holofood.utils import holofood_config, run_concurrently
+
+
+def streamed_content(response) -> str:
+    assert response.streaming
+    return b"".join(response.streaming_content).decode()
 
 
 def assert_response_has_n_items(response, n: int):
@@ -117,7 +148,7 @@ def test_animal_api_detail(
 def test_animals_export(client, salmon_animal):
     response = client.get("/export/animals")
     assert response.status_code == 200
-    data = response.content.decode()
+    data = streamed_content(response)
     assert "accession" in data
     assert salmon_animal.accession in data
 
@@ -132,11 +163,31 @@ def test_animal_metadata_export(client, salmon_animal, structured_metadata_marke
     )
     response = client.get(f"/export/animals/{salmon_animal.accession}/metadata")
     assert response.status_code == 200
-    data = response.content.decode()
+    data = streamed_content(response)
     assert "marker" in data
     assert "really quite big" in data
 
 
+@pytest.mark.django_db
+def test_animals_metadata_matrix_export(
+    client, salmon_animal, chicken_animal, structured_metadata_marker
+):
+    salmon_animal.structured_metadata.create(
+        marker=structured_metadata_marker,
+        measurement="really quite big",
+        source=AnimalStructuredDatum.BIOSAMPLES,
+    )
+    response = client.get("/export/animals/metadata")
+    assert response.status_code == 200
+    assert streamed_content(response).splitlines() == [
+        "accession\tsystem\tSize of donut",
+        "SAMEG04\tsalmon\treally quite big",
+    ]
+
+    response = client.get("/export/animals/metadata?system=chicken")
+    assert streamed_content(response) == ""
+
+
 # ------- SAMPLE TESTS -------- #
 
 
@@ -203,6 +254,122 @@ def test_samples_api_list_filters(client, salmon_metagenomic_sample):
     assert_response_has_n_items(response, 1)
 
 
+@pytest.mark.django_db
+def test_samples_api_list_metadata_range_filters(
+    client,
+    salmon_metagenomic_sample,
+    salmon_metabolomic_sample,
+    structured_metadata_marker,
+):
+    salmon_metagenomic_sample.structured_metadata.create(
+        marker=structured_metadata_marker, measurement="3.5", units="cm"
+    )
+    datum = salmon_metabolomic_sample.structured_metadata.create(
+        marker=structured_metadata_marker, measurement="big"
+    )
+    assert datum.measurement_numeric is None
+
+    marker = "metadata_marker=size of donut"
+    assert_response_has_n_items(client.get(f"/api/samples?{marker}"), 1)
+    assert_response_has_n_items(client.get(f"/api/samples?{marker}&min=3.5"), 1)
+    assert_response_has_n_items(client.get(f"/api/samples?{marker}&max=3"), 0)
+    data = assert_response_has_n_items(
+        client.get(f"/api/samples?{marker}&min=1&max=1e1"), 1
+    )
+    assert data["items"][0]["accession"] == salmon_metagenomic_sample.accession
+
+    datum.measurement = "4"
+    datum.save()
+    assert_response_has_n_items(client.get(f"/api/samples?{marker}&min=1&max=10"), 2)
+
+    # range filters work for animal metadata too
+    salmon_metagenomic_sample.animal.structured_metadata.create(
+        marker=structured_metadata_marker, measurement="-2"
+    )
+    assert_response_has_n_items(client.get(f"/api/animals?{marker}&max=0"), 1)
+    assert_response_has_n_items(client.get(f"/api/animals?{marker}&min=0"), 0)
+
+    # a range without a marker is an error, rather than ignored
+    for endpoint in ["samples", "animals"]:
+        response = client.get(f"/api/{endpoint}?min=1&max=10")
+        assert response.status_code == 422
+        assert [error["loc"] for error in response.json()["detail"]] == [
+            ["query", "min"],
+            ["query", "max"],
+        ]
+
+
+@pytest.mark.django_db
+def test_marker_ids_are_cached(django_assert_num_queries):
+    assert SampleMetadataMarker.objects.ids_for_name("Roundness") == []
+    roundness = SampleMetadataMarker.objects.create(name="roundness", type="SHAPE")
+    with django_assert_num_queries(1):
+        assert SampleMetadataMarker.objects.ids_for_name("Roundness") == [roundness.id]
+    with django_assert_num_queries(0):
+        assert SampleMetadataMarker.objects.ids_for_name("ROUNDNESS") == [roundness.id]
+
+
+@pytest.mark.django_db
+def test_marker_ids_cache_forgets_renamed_markers():
+    marker = SampleMetadataMarker.objects.create(name="Roundness")
+    assert SampleMetadataMarker.objects.ids_for_name("Roundness") == [marker.id]
+
+    marker = SampleMetadataMarker.objects.get(id=marker.id)
+    marker.name = "Sphericity"
+    marker.save()
+    assert SampleMetadataMarker.objects.ids_for_name("Roundness") == []
+    assert SampleMetadataMarker.objects.ids_for_name("Sphericity") == [marker.id]
+
+    # and again, if the same instance is renamed again
+    marker.name = "Ovalness"
+    marker.save()
+    assert SampleMetadataMarker.objects.ids_for_name("Sphericity") == []
+
+
+@pytest.mark.django_db
+def test_marker_ids_cache_distinguishes_punctuation():
+    for name, similar_name in [
+        ("Na+", "Na"),
+        ("Weight (g)", "Weight g"),
+        ("δ13C", "13C"),
+    ]:
+        marker = SampleMetadataMarker.objects.create(name=name)
+        similar_marker = SampleMetadataMarker.objects.create(name=similar_name)
+        assert SampleMetadataMarker.objects.ids_for_name(name) == [marker.id]
+        assert SampleMetadataMarker.objects.ids_for_name(similar_name) == [
+            similar_marker.id
+        ]
+
+
+@pytest.mark.django_db
+def test_samples_api_list_indexed_contains_filters(client, salmon_metagenomic_sample):
+    with CaptureQueriesContext(connection) as queries:
+        assert_response_has_n_items(client.get("/api/samples?accession=ea0000000"), 1)
+    if connection.vendor == "sqlite":
+        assert any("holofood_sample_fts" in query["sql"] for query in queries)
+
+    assert_response_has_n_items(client.get("/api/samples?title=salmon.met"), 1)
+    assert_response_has_n_items(client.get("/api/samples?title=trout"), 0)
+    assert_response_has_n_items(client.get("/api/samples?animal_accession=eg04"), 1)
+
+    # search index follows updates
+    salmon_metagenomic_sample.title = "HF_DONUT.TROUT"
+    salmon_metagenomic_sample.save()
+    assert_response_has_n_items(client.get("/api/samples?title=trout"), 1)
+    assert_response_has_n_items(client.get("/api/samples?title=salmon"), 0)
+
+    # short values, below the trigram length, still work
+    assert_response_has_n_items(client.get("/api/samples?title=tr"), 1)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_search_indexes_survive_flush(client, salmon_metagenomic_sample):
+    call_command("flush", interactive=False)
+    salmon_metagenomic_sample.animal.save()
+    salmon_metagenomic_sample.save()
+    assert_response_has_n_items(client.get("/api/samples?accession=ea0000000"), 1)
+
+
 @pytest.mark.django_db
 def test_samples_api_detail(
     client, salmon_metagenomic_sample, structured_metadata_marker
@@ -305,7 +472,7 @@ def test_non_processed_samples(client, salmon_histological_sample, salmon_host_s
 def test_samples_export(client, salmon_host_sample):
     response = client.get("/export/samples")
     assert response.status_code == 200
-    data = response.content.decode()
+    data = streamed_content(response)
     assert "accession" in data
     assert salmon_host_sample.accession in data
 
@@ -320,11 +487,100 @@ def test_sample_metadata_export(client, salmon_host_sample, structured_metadata_
     )
     response = client.get(f"/export/samples/{salmon_host_sample.accession}/metadata")
     assert response.status_code == 200
-    data = response.content.decode()
+    data = streamed_content(response)
     assert "marker" in data
     assert "really quite big" in data
 
 
+@pytest.mark.django_db
+def test_sample_metadata_arrow_export(
+    client, salmon_host_sample, structured_metadata_marker
+):
+    salmon_host_sample.structured_metadata.create(
+        marker=structured_metadata_marker,
+        measurement="really quite big",
+        units="cm",
+        source=AnimalStructuredDatum.BIOSAMPLES,
+    )
+    response = client.get(
+        f"/export/samples/{salmon_host_sample.accession}/metadata?format=arrow"
+    )
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/vnd.apache.arrow.stream"
+    table = pa.ipc.open_stream(b"".join(response.streaming_content)).read_all()
+    assert table.column_names == [
+        "marker__name",
+        "marker__type",
+        "marker__canonical_url",
+        "measurement",
+        "units",
+    ]
+    assert pa.types.is_dictionary(table.schema.field("marker__name").type)
+    assert table.to_pylist()[0]["measurement"] == "really quite big"
+
+
+@pytest.mark.django_db
+def test_samples_metadata_matrix_export(
+    client,
+    django_assert_num_queries,
+    salmon_host_sample,
+    salmon_metagenomic_sample,
+    chicken_metagenomic_sample,
+    structured_metadata_marker,
+):
+    glaze = SampleMetadataMarker.objects.create(name="Glaze", type="TOPPINGS")
+    lab_glaze = SampleMetadataMarker.objects.create(name="Glaze", type="LAB")
+    for sample, size in [
+        (salmon_host_sample, "12"),
+        (salmon_metagenomic_sample, "8"),
+        (chicken_metagenomic_sample, "10"),
+    ]:
+        sample.structured_metadata.create(
+            marker=structured_metadata_marker,
+            measurement=size,
+            source=SampleStructuredDatum.BIOSAMPLES,
+        )
+    salmon_host_sample.structured_metadata.create(
+        marker=glaze, measurement="sugar", source=SampleStructuredDatum.BIOSAMPLES
+    )
+    chicken_metagenomic_sample.structured_metadata.create(
+        marker=lab_glaze, measurement="none", source=SampleStructuredDatum.ENA
+    )
+
+    response = client.get("/export/samples/metadata")
+    assert response.status_code == 200
+    # markers, then one scan over the data
+    with django_assert_num_queries(2):
+        lines = streamed_content(response).splitlines()
+    assert lines[0].split("\t") == [
+        "accession",
+        "animal",
+        "sample_type",
+        "Size of donut",
+        "Glaze (LAB)",
+        "Glaze (TOPPINGS)",
+    ]
+    assert lines[1:] == [
+        "SAMEA00000002\tSAMEG04\tmetagenomic_assembly\t8\t\t",
+        "SAMEA00000005\tSAMEG04\thost_genomic\t12\t\tsugar",
+        "SAMEA00000006\tSAMEG01\tmetagenomic_assembly\t10\tnone\t",
+    ]
+
+    response = client.get(
+        "/export/samples/metadata?system=salmon&sample_type=host_genomic"
+    )
+    lines = streamed_content(response).splitlines()
+    assert len(lines) == 2
+    assert lines[1].startswith("SAMEA00000005")
+
+    response = client.get("/export/samples/metadata?marker_type=LAB")
+    lines = streamed_content(response).splitlines()
+    assert lines == [
+        "accession\tanimal\tsample_type\tGlaze",
+        "SAMEA00000006\tSAMEG01\tmetagenomic_assembly\tnone",
+    ]
+
+
 # ------- ANALYSIS SUMMARY TESTS -------- #
 
 
@@ -397,22 +653,135 @@ def test_mag_catalogues_export(client, chicken_mag_catalogue):
         f"/export/genome-catalogues/{chicken_mag_catalogue.id}/genomes"
     )
     assert response.status_code == 200
-    data = response.content.decode()
+    data = streamed_content(response)
     assert "accession" in data
     assert chicken_mag_catalogue.genomes.first().accession in data
 
 
+@pytest.mark.django_db
+def test_mag_catalogues_parquet_export(client, chicken_mag_catalogue):
+    url = f"/export/genome-catalogues/{chicken_mag_catalogue.id}/genomes"
+    build_export_snapshots()  # only used for TSV
+
+    response = client.get(f"{url}?format=parquet", HTTP_ACCEPT_ENCODING="gzip")
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/vnd.apache.parquet"
+    assert "Content-Encoding" not in response
+    table = pq.read_table(io.BytesIO(b"".join(response.streaming_content)))
+
+    genome = chicken_mag_catalogue.genomes.first()
+    assert table.num_rows == chicken_mag_catalogue.genomes.count()
+    assert table.schema.field("accession").type == pa.string()
+    assert pa.types.is_dictionary(table.schema.field("taxonomy").type)
+    row = table.to_pylist()[0]
+    assert row["accession"] == genome.accession
+    assert row["taxonomy"] == genome.taxonomy
+    assert json.loads(row["metadata"]) == genome.metadata
+
+    response = client.get(f"{url}?format=xlsx")
+    assert response.status_code == 422
+
+
+@pytest.fixture()
+def containment_matrix_catalogue(chicken_mag_catalogue, salmon_metagenomic_sample):
+    genome = chicken_mag_catalogue.genomes.get(accession="MGYG999")
+    genome.samples_containing.create(sample=salmon_metagenomic_sample, containment=0.2)
+    chicken_mag_catalogue.genomes.create(
+        accession="MGYG998", cluster_representative="MGYG002", taxonomy="Root"
+    )
+    return chicken_mag_catalogue
+
+
+@pytest.mark.django_db
+def test_mag_catalogue_containment_export(
+    client, django_assert_num_queries, containment_matrix_catalogue
+):
+    url = f"/export/genome-catalogues/{containment_matrix_catalogue.id}/containment"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert streamed_content(response).splitlines() == [
+        "genome\tsample\tcontainment",
+        "MGYG999\tSAMEA00000002\t0.2",
+        "MGYG999\tSAMEA00000006\t0.7",
+    ]
+
+    response = client.get(f"{url}?min_containment=0.5")
+    assert len(streamed_content(response).splitlines()) == 2
+
+    response = client.get(f"{url}?layout=dense")
+    assert "Content-Encoding" not in response
+    # samples, then one scan over the genomes
+    with django_assert_num_queries(2):
+        lines = streamed_content(response).splitlines()
+    assert lines == [
+        "genome\tSAMEA00000002\tSAMEA00000006",
+        "MGYG998\t0.0\t0.0",
+        "MGYG999\t0.2\t0.7",
+    ]
+
+    response = client.get(
+        f"{url}?layout=dense&min_containment=0.5", HTTP_ACCEPT_ENCODING="gzip"
+    )
+    assert response["Content-Encoding"] == "gzip"
+    assert gzip.decompress(b"".join(response.streaming_content)).decode().split() == [
+        "genome",
+        "SAMEA00000006",
+        "MGYG998",
+        "0.0",
+        "MGYG999",
+        "0.7",
+    ]
+
+    response = client.get(f"{url}?min_containment=2")
+    assert response.status_code == 422
+
+
+@pytest.mark.django_db
+def test_mag_containment_parquet_export(client, chicken_mag_catalogue):
+    response = client.get(
+        f"/export/genome-catalogues/{chicken_mag_catalogue.id}/genomes/MGYG999/samples_containing?format=parquet"
+    )
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(b"".join(response.streaming_content)))
+    assert table.schema.field("containment").type == pa.float64()
+    assert "SAMEA00000006" in table.column("sample").to_pylist()
+
+
 @pytest.mark.django_db
 def test_mag_containment_export(client, chicken_mag_catalogue):
     response = client.get(
         f"/export/genome-catalogues/{chicken_mag_catalogue.id}/genomes/MGYG999/samples_containing"
     )
     assert response.status_code == 200
-    data = response.content.decode()
+    data = streamed_content(response)
     assert "sample" in data
     assert "SAMEA00000006" in data
 
 
+@pytest.mark.django_db
+def test_mag_catalogue_containment_api(client, containment_matrix_catalogue):
+    response = client.get(
+        f"/api/genome-catalogues/{containment_matrix_catalogue.id}/containment"
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "genomes": ["MGYG999"],
+        "samples": ["SAMEA00000002", "SAMEA00000006"],
+        "genome_index": [0, 0],
+        "sample_index": [0, 1],
+        "containment": [0.2, 0.7],
+    }
+
+    response = client.get(
+        f"/api/genome-catalogues/{containment_matrix_catalogue.id}/containment?min_containment=0.5"
+    )
+    assert response.json()["samples"] == ["SAMEA00000006"]
+
+    response = client.get("/api/genome-catalogues/not-a-catalogue/containment")
+    assert response.status_code == 404
+
+
 @pytest.mark.django_db
 def test_viral_catalogues(client, chicken_viral_catalogue):
     response = client.get("/api/viral-catalogues")
@@ -460,6 +829,378 @@ def test_viral_catalogues_export(client, chicken_viral_catalogue):
         f"/export/viral-catalogues/{chicken_viral_catalogue.id}/fragments"
     )
     assert response.status_code == 200
-    data = response.content.decode()
+    data = streamed_content(response)
     assert "id" in data
     assert chicken_viral_catalogue.viral_fragments.first().id in data
+
+    # same TSV as rendering the whole (serialized) list at once
+    fragments = [
+        ViralFragmentSchema.from_orm(fragment).dict()
+        for fragment in chicken_viral_catalogue.viral_fragments.all()
+    ]
+    assert data == CSVRenderer().render(None, fragments, response_status=200)
+    assert len(data.splitlines()) == 3
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("export_format", ["tsv", "parquet"])
+def test_viral_catalogues_export_queries(
+    client, django_assert_num_queries, chicken_viral_catalogue, export_format
+):
+    representative = chicken_viral_catalogue.viral_fragments.first()
+    ViralFragment.objects.bulk_create(
+        ViralFragment(
+            id=f"MGYC002-start-{i}-end-{i + 100}",
+            catalogue=chicken_viral_catalogue,
+            start_within_contig=i,
+            end_within_contig=i + 100,
+            contig_id="MGYC002",
+            viral_type=ViralFragment.PROPHAGE,
+            mgnify_analysis_accession="MGYA002",
+            cluster_representative=representative,
+        )
+        for i in range(20)
+    )
+    url = f"/export/viral-catalogues/{chicken_viral_catalogue.id}/fragments?format={export_format}"
+    # the catalogue, and its fragments with their cluster representatives, however many
+    with django_assert_num_queries(2):
+        response = client.get(url)
+        b"".join(response.streaming_content)
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_genome_catalogue_export_snapshot(
+    client, django_assert_num_queries, chicken_mag_catalogue, export_snapshots_dir
+):
+    url = f"/export/genome-catalogues/{chicken_mag_catalogue.id}/genomes"
+    generated = streamed_content(client.get(url))
+
+    built = build_export_snapshots([chicken_mag_catalogue.id])
+    assert len(built) == 1
+    assert export_snapshots_dir.exists()
+
+    # served gzipped, as built, without touching the DB
+    with django_assert_num_queries(0):
+        response = client.get(url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        compressed = b"".join(response.streaming_content)
+    assert response.status_code == 200
+    assert response["Content-Encoding"] == "gzip"
+    assert response["Accept-Ranges"] == "bytes"
+    assert int(response["Content-Length"]) == len(compressed)
+    assert gzip.decompress(compressed).decode() == generated
+    etag = response["ETag"]
+
+    # or decompressed for clients that don't accept gzip
+    with django_assert_num_queries(0):
+        response = client.get(url)
+        assert streamed_content(response) == generated
+    assert "Content-Encoding" not in response
+    assert response["ETag"] != etag
+
+    response = client.get(url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    response = client.get(url, HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=10-")
+    assert response.status_code == 206
+    assert (
+        response["Content-Range"] == f"bytes 10-{len(compressed) - 1}/{len(compressed)}"
+    )
+    assert b"".join(response.streaming_content) == compressed[10:]
+
+    response = client.get(url, HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=-5")
+    assert b"".join(response.streaming_content) == compressed[-5:]
+
+    response = client.get(
+        url, HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE=f"bytes={len(compressed)}-"
+    )
+    assert response.status_code == 416
+
+    # range of an outdated version: whole (current) file
+    response = client.get(
+        url, HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=10-", HTTP_IF_RANGE='"old"'
+    )
+    assert response.status_code == 200
+
+    # changing the catalogue's data invalidates the snapshot
+    genome = chicken_mag_catalogue.genomes.first()
+    genome.taxonomy = "Root > Donuts"
+    genome.save()
+    assert get_snapshot(GENOMES_EXPORT_SNAPSHOT, chicken_mag_catalogue.id) is None
+    response = client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+    assert "Content-Encoding" not in response
+    assert "Root > Donuts" in streamed_content(response)
+
+
+@pytest.mark.django_db
+def test_viral_catalogue_export_snapshot(client, chicken_viral_catalogue):
+    url = f"/export/viral-catalogues/{chicken_viral_catalogue.id}/fragments"
+    generated = streamed_content(client.get(url))
+
+    build_export_snapshots()
+    snapshot = get_snapshot(VIRAL_FRAGMENTS_EXPORT_SNAPSHOT, chicken_viral_catalogue.id)
+    assert snapshot is not None
+
+    response = client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+    assert response["ETag"] == snapshot.gzip_etag
+    assert gzip.decompress(b"".join(response.streaming_content)).decode() == generated
+
+    chicken_viral_catalogue.viral_fragments.first().delete()
+    assert (
+        get_snapshot(VIRAL_FRAGMENTS_EXPORT_SNAPSHOT, chicken_viral_catalogue.id)
+        is None
+    )
+
+
+def test_export_snapshots_dir_is_relative_to_project(tmp_path, monkeypatch, settings):
+    settings.BASE_DIR = tmp_path / "project"
+    monkeypatch.setattr(holofood_config.exports, "snapshots_dir", "export-snapshots")
+    monkeypatch.chdir(tmp_path)
+    snapshot = write_snapshot("donuts", "glazed", ["flavour\n", "sugar\n"])
+    assert snapshot.path.parent == tmp_path / "project/export-snapshots/donuts/glazed"
+    assert get_snapshot("donuts", "glazed") == snapshot
+
+    # e.g. on a volume
+    monkeypatch.setattr(
+        holofood_config.exports, "snapshots_dir", str(tmp_path / "volume")
+    )
+    snapshot = write_snapshot("donuts", "glazed", ["flavour\n", "sugar\n"])
+    assert snapshot.path.parent == tmp_path / "volume/donuts/glazed"
+
+
+@pytest.mark.django_db
+def test_export_snapshots_need_slugs(client, export_snapshots_dir):
+    with pytest.raises(ValueError):
+        write_snapshot(GENOMES_EXPORT_SNAPSHOT, "..", ["flavour\n"])
+    assert not export_snapshots_dir.exists()
+
+    # a snapshot where a catalogue ID of ".." would lead
+    snapshot = write_snapshot(GENOMES_EXPORT_SNAPSHOT, "glazed", ["flavour\n"])
+    for path in snapshot.path.parent.iterdir():
+        shutil.copy(path, export_snapshots_dir)
+
+    # IDs from URLs are never used as paths
+    assert get_snapshot(GENOMES_EXPORT_SNAPSHOT, "..") is None
+    response = client.get("/export/genome-catalogues/../genomes")
+    assert response.status_code == 404
+
+
+# ------- GLOBAL SEARCH -------- #
+
+
+@pytest.mark.django_db
+def test_global_search(client, requests_mock, chicken_viral_catalogue):
+    requests_mock.get(f"{holofood_config.docs.docs_url}/search.json", json=[])
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get("/search/?query=donut")
+    assert response.status_code == 200
+    assert response.context["mag_catalogues_count"] == 1
+    assert response.context["viral_catalogues_count"] == 1
+    assert response.context["mags_count"] == 1
+    assert response.context["mags"][0].accession == "MGYG999"
+    assert response.context["samples_count"] == 1
+    assert response.context["animals_count"] == 0
+    assert response.context["animals"] == []
+    # one query over the search documents, for every type
+    assert (
+        len([q for q in queries if 'FROM "holofood_searchdocument"' in q["sql"]]) == 1
+    )
+
+    # exact ID matches rank first
+    response = client.get("/search/?query=MGYC001-start-3000")
+    assert [frag.id for frag in response.context["viral_fragments"]] == [
+        "MGYC001-start-3000-end-4000"
+    ]
+    response = client.get("/search/?query=mgyc001")
+    assert response.context["viral_fragments_count"] == 2
+
+    # GFF content is not searched
+    response = client.get("/search/?query=viphog")
+    assert response.context["viral_fragments_count"] == 0
+
+    # the index follows saves and deletes
+    genome = Genome.objects.get(accession="MGYG999")
+    genome.taxonomy = "Root > Foods > Bagels"
+    genome.save()
+    response = client.get("/search/?query=bagel")
+    assert response.context["mags_count"] == 1
+    response = client.get("/search/?query=sugar monster")
+    assert response.context["mags_count"] == 0
+
+    chicken_viral_catalogue.delete()
+    response = client.get("/search/?query=mgyc001")
+    assert response.context["viral_fragments_count"] == 0
+
+    SearchDocument.objects.all().delete()
+    assert SearchDocument.objects.rebuild() == SearchDocument.objects.count() > 0
+    response = client.get("/search/?query=bagel")
+    assert response.context["mags_count"] == 1
+
+
+# ------- STATS -------- #
+
+
+@pytest.mark.django_db
+def test_stats(
+    client,
+    django_assert_num_queries,
+    salmon_metagenomic_sample,
+    salmon_host_sample,
+    chicken_mag_catalogue,
+):
+    response = client.get("/api/stats")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["samples"] == {
+        "total": 3,
+        "by_system": {"chicken": 1, "salmon": 2},
+        "by_sample_type": {"host_genomic": 1, "metagenomic_assembly": 2},
+    }
+    assert data["animals"] == {"total": 2, "by_system": {"chicken": 1, "salmon": 1}}
+    assert data["genomes"] == {"total": 1, "by_system": {"chicken": 1}}
+    assert data["viral_fragments"] == {"total": 0, "by_system": {}}
+    assert data["analysis_summaries"] == {"total": 0}
+
+    # cached for the homepage too
+    with django_assert_num_queries(0):
+        response = client.get("/")
+    assert response.context["samples_count"] == 3
+    assert "(1 chicken, 2 salmon)" in response.content.decode()
+
+    # and forgotten when data change
+    salmon_host_sample.delete()
+    response = client.get("/api/stats")
+    assert response.json()["samples"]["total"] == 2
+
+
+# ------- WEBSITE LISTS -------- #
+
+
+@pytest.mark.django_db
+def test_animal_metadata_columns_are_fetched_per_page(
+    client,
+    salmon_metagenomic_sample,
+    salmon_host_sample,
+    chicken_metagenomic_sample,
+    chicken_mag_catalogue,
+):
+    treatment = SampleMetadataMarker.objects.create(name="Treatment description")
+    AnimalStructuredDatum.objects.create(
+        animal=salmon_metagenomic_sample.animal,
+        marker=treatment,
+        measurement="Sprinkles",
+    )
+
+    pages = [
+        "/samples/",
+        "/animals/",
+        f"/genome-catalogue/{chicken_mag_catalogue.id}/MGYG999",
+    ]
+    for page in pages:
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(page)
+        assert response.status_code == 200
+        metadata_queries = [
+            q for q in queries if "holofood_animalstructureddatum" in q["sql"]
+        ]
+        # one query for all rows and columns, however many rows are listed
+        assert len(metadata_queries) == 1, page
+
+    response = client.get("/samples/")
+    assert response.content.decode().count("Sprinkles") == 2
+
+
+# ------- REQUEST METRICS -------- #
+
+
+@pytest.mark.django_db
+def test_request_metrics(client, caplog, salmon_metagenomic_sample):
+    with caplog.at_level(logging.INFO, logger="holofood.requests"):
+        response = client.get("/samples/")
+    assert response.status_code == 200
+    assert response["Server-Timing"].startswith("sql;dur=")
+    assert 'http;dur=0.0;desc="0 calls"' in response["Server-Timing"]
+    logged = json.loads(
+        next(r for r in caplog.records if r.name == "holofood.requests").message
+    )
+    assert logged["view"] == "samples_list"
+    assert logged["status"] == 200
+    assert logged["sql_count"] > 0
+
+    with record_request_metrics() as metrics:
+        with record_http_call():
+            pass
+        Sample.objects.count()
+    assert metrics.http_count == 1
+    assert metrics.sql_count == 1
+
+    # views over their query budget fail tests
+    monitoring = holofood_config.monitoring
+    budgets = monitoring.view_query_budgets
+    monitoring.view_query_budgets = {**budgets, "samples_list": 1}
+    try:
+        with pytest.raises(QueryBudgetExceeded):
+            client.get("/samples/")
+    finally:
+        monitoring.view_query_budgets = budgets
+
+
+@pytest.mark.django_db
+def test_request_metrics_of_streamed_responses(client, caplog, chicken_viral_catalogue):
+    url = f"/export/viral-catalogues/{chicken_viral_catalogue.id}/fragments"
+    with caplog.at_level(logging.INFO, logger="holofood.requests"):
+        response = client.get(url)
+        assert not [r for r in caplog.records if r.name == "holofood.requests"]
+        streamed_content(response)
+    logged = json.loads(
+        next(r for r in caplog.records if r.name == "holofood.requests").message
+    )
+    assert logged["view"] == "export:viral_fragments_list"
+    # the catalogue, and its fragments (queried whilst streaming)
+    assert logged["sql_count"] == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_request_metrics_of_concurrent_calls(salmon_metagenomic_sample):
+    with record_request_metrics() as metrics:
+        results, errors = run_concurrently(
+            {"samples": Sample.objects.count}, deadline=timedelta(seconds=5)
+        )
+    assert not errors
+    assert results["samples"] == 1
+    assert metrics.sql_count == 1
+
+
+@pytest.mark.django_db
+def test_prometheus_metrics(client, monkeypatch, salmon_metagenomic_sample):
+    # off by default
+    assert client.get("/metrics").status_code == 404
+    monkeypatch.setattr(holofood_config.monitoring, "metrics_endpoint", True)
+
+    client.get("/samples/")
+    client.get("/api/samples")
+    client.get("/api/stats")
+    client.get("/api/stats")
+    with pytest.raises(ConnectionError):
+        with record_http_call(f"{holofood_config.mgnify.api_root}/analyses"):
+            raise ConnectionError
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    metrics = response.content.decode()
+    for view in ["samples_list", "api:list_samples"]:
+        assert (
+            f'holofood_request_duration_seconds_count{{method="GET",status="200",view="{view}"}}'
+            in metrics
+        )
+        assert f'holofood_request_db_queries_count{{view="{view}"}}' in metrics
+    assert 'holofood_external_api_errors_total{api="mgnify"}' in metrics
+    assert 'holofood_cache_lookups_total{cache="portal-stats",result="hit"}' in metrics
+
+    # only with the token, if one is set
+    monkeypatch.setattr(holofood_config.monitoring, "metrics_token", "sprinkles")
+    assert client.get("/metrics").status_code == 403
+    assert client.get("/metrics", HTTP_AUTHORIZATION="Bearer glaze").status_code == 403
+    response = client.get("/metrics", HTTP_AUTHORIZATION="Bearer sprinkles")
+    assert response.status_code == 200
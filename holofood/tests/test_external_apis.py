@@ -0,0 +1,396 @@
+import base64
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import pytest
+
+from holofood import caching
+from holofood.caching import StaleWhileRevalidateCache, UpstreamError
+from holofood.external_apis.biosamples.auth import WebinTokenProvider
+from holofood.external_apis.docs.api import DocsSearchIndex
+from holofood.external_apis.ena.portal_api import (
+    API_ROOT as ENA_PORTAL_API_ROOT,
+    filereport_cache,
+    get_cached_filereport,
+)
+from holofood.external_apis.http import session, PooledHTTPAdapter
+from holofood.external_apis.metabolights.api import (
+    API_ROOT as MTBLS_API_ROOT,
+    get_metabolights_assays,
+)
+from holofood.external_apis.mgnify.api import API_ROOT as MGNIFY_API_ROOT, MgnifyApi
+from holofood.tests.conftest import (
+    metabolights_study_file_response,
+    metabolights_study_sheet_response,
+    metabolights_assay_sheet_response,
+    ena_sample_file_report_response,
+)
+from holofood.utils import holofood_config
+
+WEBIN_AUTH_URL = "https://www.example.com/webin/auth/token"
+
+
+def _fake_jwt(expires_at: float) -> str:
+    def encode(part: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip("=")
+
+    return f"{encode({'alg': 'none'})}.{encode({'exp': expires_at})}.signature"
+
+
+def test_webin_token_is_cached(requests_mock):
+    token = _fake_jwt(time.time() + 3600)
+    auth = requests_mock.post(WEBIN_AUTH_URL, text=token)
+    provider = WebinTokenProvider(WEBIN_AUTH_URL, "Webin-donut", "jam")
+
+    assert provider.decode_expiry(token) > time.time()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        tokens = list(executor.map(lambda _: provider.get_token(), range(20)))
+    assert set(tokens) == {token}
+    assert auth.call_count == 1
+
+
+def test_webin_token_is_refreshed_before_expiry(requests_mock):
+    auth = requests_mock.post(
+        WEBIN_AUTH_URL,
+        [
+            {"text": _fake_jwt(time.time() + 30)},
+            {"text": _fake_jwt(time.time() + 3600)},
+        ],
+    )
+    provider = WebinTokenProvider(
+        WEBIN_AUTH_URL, "Webin-donut", "jam", refresh_margin=timedelta(minutes=1)
+    )
+    provider.get_token()
+    # first token expires within the refresh margin, so is replaced
+    provider.get_token()
+    provider.get_token()
+    assert auth.call_count == 2
+
+
+def test_webin_token_without_expiry(requests_mock):
+    auth = requests_mock.post(WEBIN_AUTH_URL, text="not-a-jwt")
+    provider = WebinTokenProvider(WEBIN_AUTH_URL, "Webin-donut", "jam")
+
+    assert provider.decode_expiry("not-a-jwt") is None
+    assert provider.get_token() == "not-a-jwt"
+    assert provider.get_token() == "not-a-jwt"
+    assert auth.call_count == 1
+
+
+def test_shared_session_adapters():
+    adapter = session.get_adapter("https://www.ebi.ac.uk/biosamples/samples/SAMEA1")
+    assert isinstance(adapter, PooledHTTPAdapter)
+    assert adapter.max_retries.total == holofood_config.http.request_retries
+    assert adapter.timeout == holofood_config.http.request_timeout.total_seconds()
+
+    mgnify_adapter = session.get_adapter(f"{MGNIFY_API_ROOT}/analyses")
+    assert mgnify_adapter is not adapter
+    assert mgnify_adapter.max_retries.total == holofood_config.mgnify.request_retries
+
+
+def test_stale_while_revalidate_cache():
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return ["donut"] if len(calls) == 1 else ["cronut"]
+
+    swr_cache = StaleWhileRevalidateCache(
+        "donuts", ttl=timedelta(hours=1), stale_ttl=timedelta(hours=1)
+    )
+    assert swr_cache.get("SAMEA1", fetch) == ["donut"]
+    assert swr_cache.get("SAMEA1", fetch) == ["donut"]
+    assert len(calls) == 1
+
+    # stale: old value is served immediately, and a replacement fetched in the background
+    swr_cache.ttl = timedelta(0)
+    swr_cache.refresh("SAMEA1", lambda: ["donut"])
+    calls.clear()
+    calls.append(1)
+    assert swr_cache.get("SAMEA1", fetch) == ["donut"]
+    for _ in range(50):
+        if len(calls) == 2:
+            break
+        time.sleep(0.01)
+    swr_cache.ttl = timedelta(hours=1)
+    assert len(calls) == 2
+
+
+def test_stale_while_revalidate_cache_errors():
+    calls = []
+
+    def broken_fetch():
+        calls.append(1)
+        raise Exception("MGnify is down")
+
+    swr_cache = StaleWhileRevalidateCache(
+        "donuts", ttl=timedelta(hours=1), error_ttl=timedelta(minutes=1)
+    )
+    for _ in range(3):
+        with pytest.raises(UpstreamError):
+            swr_cache.get("SAMEA1", broken_fetch)
+    # error was cached, so upstream was only called once
+    assert len(calls) == 1
+
+
+class _SynchronousThread:
+    def __init__(self, target, daemon=False):
+        self.target = target
+
+    def start(self):
+        self.target()
+
+
+def test_stale_while_revalidate_cache_keeps_stale_on_error(monkeypatch):
+    monkeypatch.setattr(caching.threading, "Thread", _SynchronousThread)
+    calls = []
+
+    def broken_fetch():
+        calls.append(1)
+        raise Exception("MGnify is down")
+
+    swr_cache = StaleWhileRevalidateCache(
+        "donuts",
+        ttl=timedelta(0),
+        stale_ttl=timedelta(hours=1),
+        error_ttl=timedelta(minutes=1),
+    )
+    swr_cache.refresh("SAMEA1", lambda: ["donut"])
+
+    # revalidation fails, but the stale value is still served
+    assert swr_cache.get("SAMEA1", broken_fetch) == ["donut"]
+    assert swr_cache.get("SAMEA1", broken_fetch) == ["donut"]
+    # and upstream is not retried until the error TTL has passed
+    assert len(calls) == 1
+
+
+def test_ena_filereport_errors_keep_stale_report(requests_mock, monkeypatch):
+    monkeypatch.setattr(caching.threading, "Thread", _SynchronousThread)
+    monkeypatch.setattr(filereport_cache, "ttl", timedelta(0))
+    report = [{"run_accession": "ERR1"}]
+    requests_mock.get(re.compile(f"{ENA_PORTAL_API_ROOT}/filereport"), json=report)
+    assert get_cached_filereport("SAMEA1") == report[0]
+
+    # ENA is down whilst revalidating the (stale) report
+    filereport = requests_mock.get(
+        re.compile(f"{ENA_PORTAL_API_ROOT}/filereport"),
+        status_code=503,
+        text="<html>Service Unavailable</html>",
+    )
+    assert get_cached_filereport("SAMEA1") == report[0]
+    assert filereport.call_count == 1
+    # stale report is kept, and ENA not retried until the error TTL has passed
+    assert get_cached_filereport("SAMEA1") == report[0]
+    assert filereport.call_count == 1
+
+    # without a stale report, the error is cached (not a "no report" result)
+    with pytest.raises(UpstreamError):
+        get_cached_filereport("SAMEA2")
+
+    requests_mock.get(re.compile(f"{ENA_PORTAL_API_ROOT}/filereport"), json=[])
+    assert get_cached_filereport("SAMEA3") is None
+
+
+def test_ena_filereport_without_runs(requests_mock):
+    # ENA replies to samples without runs with no content, or an empty body
+    requests_mock.get(re.compile(f"{ENA_PORTAL_API_ROOT}/filereport"), text="")
+    assert get_cached_filereport("SAMEA1") is None
+    requests_mock.get(re.compile(f"{ENA_PORTAL_API_ROOT}/filereport"), status_code=204)
+    assert get_cached_filereport("SAMEA2") is None
+
+    # a no-runs result is cached as such, rather than as an error
+    filereport = requests_mock.get(
+        re.compile(f"{ENA_PORTAL_API_ROOT}/filereport"), status_code=503
+    )
+    assert get_cached_filereport("SAMEA1") is None
+    assert filereport.call_count == 0
+
+    # but a malformed (non-empty) body is an error
+    requests_mock.get(
+        re.compile(f"{ENA_PORTAL_API_ROOT}/filereport"), text="<html>Oops</html>"
+    )
+    with pytest.raises(UpstreamError):
+        get_cached_filereport("SAMEA3")
+
+
+def test_docs_search_index(requests_mock):
+    url = "https://docs.example.com/search.json"
+    sections = [
+        {"title": "Samples", "href": "samples.html", "text": "Metagenomic samples"},
+        {"title": "Genomes", "href": "mags.html", "text": "MAG catalogues of samples"},
+    ]
+    docs = requests_mock.get(url, json=sections, headers={"ETag": '"v1"'})
+    index = DocsSearchIndex(
+        url,
+        ttl=timedelta(hours=1),
+        error_ttl=timedelta(minutes=5),
+        timeout=timedelta(seconds=1),
+    )
+
+    # nothing indexed yet, but searching must not wait for the docs site
+    index._next_refresh_at = time.time() + 60
+    assert index.search("samples") == []
+    assert docs.call_count == 0
+
+    index.refresh()
+    assert docs.call_count == 1
+    assert index.search("SAMPLES") == sections
+    assert index.search("mag cat") == [sections[1]]
+    assert index.search("ag") == [sections[0], sections[1]]
+    assert index.search("samples catalogues") == []
+    assert index.search("") == []
+
+    # revalidation is conditional, and keeps the index if unchanged or unavailable
+    docs = requests_mock.get(url, status_code=304)
+    index.refresh()
+    assert docs.last_request.headers["If-None-Match"] == '"v1"'
+    assert index.search("genomic") == [sections[0]]
+
+    requests_mock.get(url, status_code=404)
+    index.refresh()
+    assert index.search("genomic") == [sections[0]]
+    assert index._next_refresh_at < time.time() + 5 * 60 + 1
+
+
+@pytest.mark.django_db
+def test_metabolights_study_index(
+    requests_mock, salmon_metabolomic_sample, salmon_metagenomic_sample
+):
+    files = requests_mock.get(
+        f"{MTBLS_API_ROOT}/studies/MTBLSDONUT/files?include_raw_data=false",
+        json=metabolights_study_file_response(),
+    )
+    sample_sheet = requests_mock.get(
+        f"{MTBLS_API_ROOT}/studies/MTBLSDONUT/download?file=s_mtbls.txt",
+        body=metabolights_study_sheet_response(salmon_metabolomic_sample),
+        headers={"ETag": '"s1"'},
+    )
+    assay_sheet = requests_mock.get(
+        f"{MTBLS_API_ROOT}/studies/MTBLSDONUT/download?file=a_assay.txt",
+        body=metabolights_assay_sheet_response(),
+        headers={"Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"},
+    )
+
+    assays = get_metabolights_assays("MTBLSDONUT", salmon_metabolomic_sample.accession)
+    assert len(assays) == 1
+    assert assays[0]["assay_sheet"] == "a_assay.txt"
+    assert assays[0]["sample_assay"]["Raw_Spectral_Data_File"] == "raw.sheet"
+
+    # other lookups in the same study are served from the index
+    assert (
+        get_metabolights_assays("MTBLSDONUT", salmon_metagenomic_sample.accession) == []
+    )
+    assert get_metabolights_assays("MTBLSDONUT", salmon_metabolomic_sample.accession)
+    assert files.call_count == sample_sheet.call_count == assay_sheet.call_count == 1
+
+    # once expired, sheets are revalidated with conditional requests
+    requests_mock.get(
+        f"{MTBLS_API_ROOT}/studies/MTBLSDONUT/download?file=s_mtbls.txt",
+        status_code=304,
+    )
+    requests_mock.get(
+        f"{MTBLS_API_ROOT}/studies/MTBLSDONUT/download?file=a_assay.txt",
+        status_code=304,
+    )
+    ttl = holofood_config.metabolights.study_index_ttl
+    holofood_config.metabolights.study_index_ttl = timedelta(0)
+    try:
+        assays = get_metabolights_assays(
+            "MTBLSDONUT", salmon_metabolomic_sample.accession
+        )
+    finally:
+        holofood_config.metabolights.study_index_ttl = ttl
+    assert len(assays) == 1
+    assert files.call_count == 2
+    conditional_headers = {
+        request.url.split("=")[-1]: request.headers
+        for request in requests_mock.request_history
+        if "download" in request.url
+    }
+    assert conditional_headers["s_mtbls.txt"]["If-None-Match"] == '"s1"'
+    assert (
+        conditional_headers["a_assay.txt"]["If-Modified-Since"]
+        == "Wed, 21 Oct 2015 07:28:00 GMT"
+    )
+
+
+@pytest.mark.django_db
+def test_metabolights_study_index_revalidation_errors(
+    requests_mock, monkeypatch, salmon_metabolomic_sample
+):
+    files = requests_mock.get(
+        f"{MTBLS_API_ROOT}/studies/MTBLSCRONUT/files?include_raw_data=false",
+        json=metabolights_study_file_response(),
+    )
+    requests_mock.get(
+        f"{MTBLS_API_ROOT}/studies/MTBLSCRONUT/download?file=s_mtbls.txt",
+        body=metabolights_study_sheet_response(salmon_metabolomic_sample),
+        headers={"ETag": '"s1"'},
+    )
+    requests_mock.get(
+        f"{MTBLS_API_ROOT}/studies/MTBLSCRONUT/download?file=a_assay.txt",
+        body=metabolights_assay_sheet_response(),
+        headers={"ETag": '"a1"'},
+    )
+    assert get_metabolights_assays("MTBLSCRONUT", salmon_metabolomic_sample.accession)
+
+    # once expired, the assay sheet can't be downloaded
+    monkeypatch.setattr(holofood_config.metabolights, "study_index_ttl", timedelta(0))
+    requests_mock.get(
+        f"{MTBLS_API_ROOT}/studies/MTBLSCRONUT/download?file=s_mtbls.txt",
+        status_code=304,
+    )
+    assay_sheet = requests_mock.get(
+        f"{MTBLS_API_ROOT}/studies/MTBLSCRONUT/download?file=a_assay.txt",
+        status_code=503,
+    )
+    # the previous sheet is still served
+    assays = get_metabolights_assays("MTBLSCRONUT", salmon_metabolomic_sample.accession)
+    assert len(assays) == 1
+    assert assays[0]["sample_assay"]["Raw_Spectral_Data_File"] == "raw.sheet"
+    assert files.call_count == 2
+    assert assay_sheet.call_count == 1
+
+    # and MetaboLights is not retried until the error TTL has passed
+    assert get_metabolights_assays("MTBLSCRONUT", salmon_metabolomic_sample.accession)
+    assert files.call_count == 2
+    assert assay_sheet.call_count == 1
+
+
+@pytest.mark.django_db
+def test_sample_detail_lookups_have_shared_deadline(
+    requests_mock, monkeypatch, client, salmon_metagenomic_sample
+):
+    # (requests_mock serialises requests, so the slow upstream is simulated above it)
+    def slow_mgnify(self, sample):
+        time.sleep(1)
+        return []
+
+    monkeypatch.setattr(
+        MgnifyApi, "get_cached_metagenomics_analyses_for_sample", slow_mgnify
+    )
+    requests_mock.get(
+        re.compile(f"{ENA_PORTAL_API_ROOT}/filereport"),
+        json=ena_sample_file_report_response(salmon_metagenomic_sample),
+    )
+
+    deadline = holofood_config.http.detail_page_lookups_deadline
+    holofood_config.http.detail_page_lookups_deadline = timedelta(seconds=0.5)
+    try:
+        started = time.time()
+        response = client.get(f"/sample/{salmon_metagenomic_sample.accession}")
+        elapsed = time.time() - started
+    finally:
+        holofood_config.http.detail_page_lookups_deadline = deadline
+
+    assert response.status_code == 200
+    assert elapsed < 1
+    # ENA finished in time, MGnify did not
+    assert response.context["ena_records"]["run_accession"] == "ERR1"
+    assert not response.context.get("ena_records_error")
+    assert response.context["analyses"] == []
+    assert response.context["analyses_error"]
@@ -1,13 +1,20 @@
 import logging
 import os.path
+import re
 from io import StringIO
+from urllib.parse import parse_qs
 
 
 import pytest
 from django.core.management import call_command
 
 
+from holofood.export_snapshots import get_snapshot
 from holofood.external_apis.biosamples.api import API_ROOT as BSAPIROOT
+from holofood.external_apis.ena.portal_api import API_ROOT as ENAPORTALAPIROOT
+from holofood.management.commands.refresh_external_data import (
+    Command as RefreshCommand,
+)
 from holofood.models import (
     Sample,
     ViralCatalogue,
@@ -15,6 +22,9 @@ from holofood.models import (
     Animal,
     GenomeSampleContainment,
     Genome,
+    SampleMetadataMarker,
+    EnaReadRun,
+    GENOMES_EXPORT_SNAPSHOT,
 )
 from holofood.utils import holofood_config
 
@@ -121,6 +131,228 @@ def test_fetch_project_samples(requests_mock):
     assert Animal.objects.count() == 1
     assert Animal.objects.first().accession == "SAMEG1"
 
+    # structured data and checklist (characteristics) are stored as metadata
+    assert sample.structured_metadata.count() == 3
+    experiment = sample.structured_metadata.get(marker__name="Experiment")
+    assert experiment.marker.type == "SAMPLE"
+    assert experiment.measurement == "histology"
+    assert sample.structured_metadata.get(marker__name="Organism").source == "ena"
+
+    # re-importing updates rather than duplicates metadata
+    out = _call_command("fetch_project_samples", webin_filter=["Webin-good"])
+    logging.info(out)
+    assert Sample.objects.count() == 1
+    assert sample.structured_metadata.count() == 3
+    assert SampleMetadataMarker.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_fetch_project_samples_multiple_pages(requests_mock):
+    def biosample_page(accession: str, next_href: str = None):
+        return {
+            "_links": {"next": {"href": next_href}},
+            "_embedded": {
+                "samples": [
+                    {
+                        "accession": accession,
+                        "name": f"HF_DONUT.{accession}",
+                        "webinSubmissionAccountId": "Webin-good",
+                        "relationships": [],
+                        "characteristics": {"Organism": [{"text": "Gallus gallus"}]},
+                    }
+                ]
+            },
+        }
+
+    requests_mock.get(
+        f"{BSAPIROOT}/samples?filter=attr:project:HoloFood&size=200",
+        json=biosample_page("SAMEG1", f"{BSAPIROOT}/samples?cursor=2"),
+    )
+    requests_mock.get(
+        f"{BSAPIROOT}/samples?cursor=2",
+        json=biosample_page("SAMEG2", f"{BSAPIROOT}/samples?cursor=3"),
+    )
+    requests_mock.get(f"{BSAPIROOT}/samples?cursor=3", json=biosample_page("SAMEG3"))
+
+    for prefetch_pages in [0, 1, 5]:
+        Animal.objects.all().delete()
+        out = _call_command(
+            "fetch_project_samples",
+            webin_filter=["Webin-good"],
+            prefetch_pages=prefetch_pages,
+        )
+        assert "Added 0 samples and 3 animals" in out
+        assert list(Animal.objects.values_list("accession", flat=True)) == [
+            "SAMEG1",
+            "SAMEG2",
+            "SAMEG3",
+        ]
+        assert all(animal.system == "chicken" for animal in Animal.objects.all())
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("write_batch_size", [100, 1])
+def test_refresh_external_data(
+    requests_mock,
+    monkeypatch,
+    salmon_metagenomic_sample,
+    salmon_metabolomic_sample,
+    write_batch_size,
+):
+    # objects are read (and written) one page at a time
+    monkeypatch.setattr(RefreshCommand, "write_batch_size", write_batch_size)
+
+    def biosample(external_references: list):
+        return {
+            "characteristics": {"Organism": [{"text": "Salmo salar"}]},
+            "structuredData": [
+                {
+                    "type": "SAMPLE",
+                    "content": [
+                        {
+                            "marker": {"value": "Donut flavour", "iri": None},
+                            "measurement": {"value": "jam", "iri": None},
+                        }
+                    ],
+                }
+            ],
+            "externalReferences": external_references,
+        }
+
+    requests_mock.get(
+        f"{BSAPIROOT}/samples/{salmon_metabolomic_sample.accession}",
+        json=biosample([{"url": "fake://fakebiosamples/MTBLSDONUT"}]),
+    )
+    requests_mock.get(
+        f"{BSAPIROOT}/samples/{salmon_metagenomic_sample.accession}",
+        json=biosample([]),
+    )
+
+    out = _call_command(
+        "refresh_external_data",
+        samples=["ALL"],
+        structured=True,
+        external_references=True,
+        workers=2,
+    )
+    logging.info(out)
+    assert "Refreshed 2/2 samples" in out
+
+    for sample in Sample.objects.all():
+        assert sample.structured_metadata.get(marker__name="Donut flavour")
+        assert sample.structured_metadata.get(marker__name="Organism").source == "ena"
+    assert SampleMetadataMarker.objects.count() == 2
+    salmon_metabolomic_sample.refresh_from_db()
+    assert salmon_metabolomic_sample.metabolights_study == "MTBLSDONUT"
+
+    # a single biosample document fetch per sample provides everything
+    assert requests_mock.call_count == 2
+
+
+@pytest.mark.django_db
+def test_warm_mgnify_cache(
+    requests_mock, client, salmon_metagenomic_sample, salmon_histological_sample
+):
+    analyses = requests_mock.get(
+        f"{MGAPIROOT}/analyses?sample_accession={salmon_metagenomic_sample.accession}&page_size=10",
+        json={"data": [{"id": "MGYA1", "attributes": {"experiment-type": "donut"}}]},
+    )
+    out = _call_command("warm_mgnify_cache")
+    assert "Cached MGnify analyses for 1 samples (0 failed)" in out
+    assert analyses.call_count == 1
+
+    # sample page is served from the cache
+    requests_mock.get(
+        re.compile(f"{ENAPORTALAPIROOT}/filereport"),
+        json=[{"run_accession": "ERR1"}],
+    )
+    response = client.get(f"/sample/{salmon_metagenomic_sample.accession}")
+    assert response.status_code == 200
+    assert response.context["analyses"][0]["attributes"]["experiment_type"] == "donut"
+    assert analyses.call_count == 1
+
+
+@pytest.mark.django_db
+def test_fetch_ena_read_runs(
+    requests_mock, client, salmon_metagenomic_sample, salmon_host_sample
+):
+    search = requests_mock.post(
+        f"{ENAPORTALAPIROOT}/search",
+        json=[
+            {
+                "sample_accession": salmon_metagenomic_sample.accession,
+                "run_accession": "ERR1",
+                "experiment_accession": "ERX1",
+                "study_accession": "PRJ1",
+                "read_count": "99999999",
+                "base_count": "8888888888",
+            },
+            {
+                "sample_accession": "SAMEA-NOT-IN-DB",
+                "run_accession": "ERR2",
+            },
+        ],
+    )
+    out = _call_command("fetch_ena_read_runs", batch_size=1)
+    # one search per batch of samples (the mock returns the same runs for each)
+    assert search.call_count == 2
+    assert "Stored 2 ENA read runs" in out
+    # last batch is the host sample (ordered by accession)
+    assert parse_qs(search.last_request.text)["query"] == [
+        f'(sample_accession="{salmon_host_sample.accession}")'
+    ]
+    assert EnaReadRun.objects.count() == 1
+
+    run = salmon_metagenomic_sample.ena_read_runs.get()
+    assert run.run_accession == "ERR1"
+    assert run.base_count == 8888888888
+
+    # sample page reads the stored run instead of ENA
+    filereport = requests_mock.get(re.compile(f"{ENAPORTALAPIROOT}/filereport"))
+    requests_mock.get(re.compile(f"{MGAPIROOT}/analyses"), json={"data": []})
+    response = client.get(f"/sample/{salmon_metagenomic_sample.accession}")
+    assert response.status_code == 200
+    assert response.context["ena_records"].run_accession == "ERR1"
+    assert filereport.call_count == 0
+
+    out = _call_command("fetch_ena_read_runs", study="PRJ1")
+    assert "Stored 1 ENA read runs" in out
+    assert parse_qs(search.last_request.text)["query"] == ['(study_accession="PRJ1")']
+
+
+@pytest.mark.django_db
+def test_animal_sample_summaries(
+    salmon_animal, chicken_animal, salmon_metagenomic_sample, salmon_metabolomic_sample
+):
+    salmon_animal.refresh_from_db()
+    assert salmon_animal.samples_count == 2
+    assert salmon_animal.sample_types == [
+        Sample.METABOLOMIC,
+        Sample.METAGENOMIC_ASSEMBLY,
+    ]
+
+    # moving a sample updates both animals
+    sample = Sample.objects.get(pk=salmon_metabolomic_sample.pk)
+    sample.animal = chicken_animal
+    sample.save()
+    salmon_animal.refresh_from_db()
+    chicken_animal.refresh_from_db()
+    assert salmon_animal.sample_types == [Sample.METAGENOMIC_ASSEMBLY]
+    assert chicken_animal.samples_count == 1
+    assert chicken_animal.sample_types == [Sample.METABOLOMIC]
+
+    sample.delete()
+    chicken_animal.refresh_from_db()
+    assert chicken_animal.samples_count == 0
+    assert chicken_animal.sample_types_mask == 0
+
+    # bulk updates bypass signals, so need a rebuild
+    Sample.objects.update(sample_type=Sample.HISTOLOGICAL)
+    out = _call_command("rebuild_animal_sample_summaries")
+    assert "Updated sample summaries of 1 animals" in out
+    salmon_animal.refresh_from_db()
+    assert salmon_animal.sample_types == [Sample.HISTOLOGICAL]
+
 
 @pytest.mark.django_db
 def test_import_viral_catalogue(chicken_mag_catalogue):
@@ -173,6 +405,7 @@ def test_import_mag_catalogue():
     assert created_catalogue.system == "chicken"
     assert created_catalogue.related_mag_catalogue_id == "public-donut-v1-0"
     assert created_catalogue.genomes.count() == 11
+    assert get_snapshot(GENOMES_EXPORT_SNAPSHOT, "hf-donut-mag-cat-1") is not None
     assert (
         created_catalogue.genomes.order_by("-accession").first().taxonomy
         == "Bacteria > Firmicutes_A > Clostridia > Oscillospirales > Acutalibacteraceae > RUG420 > RUG420 sp900317985"
@@ -36,6 +36,7 @@ from django.views.defaults import page_not_found
 
 from holofood.api import api
 from holofood.export import export_api
+from holofood.metrics import metrics_view
 from holofood.views import (
     SampleListView,
     SampleDetailView,
@@ -104,6 +105,7 @@ urlpatterns = [
         name="viral_catalogues_empty_state",
     ),
     path("search/", GlobalSearchView.as_view(), name="global_search"),
+    path("metrics", metrics_view, name="metrics"),
     path("api/", api.urls),
     path("export/", export_api.urls),
     path(
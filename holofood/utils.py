@@ -1,11 +1,17 @@
+import contextvars
 import logging
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import timedelta
 from functools import reduce
-from typing import Any
+from typing import Any, Callable, Dict, Iterable, Iterator, Tuple, TypeVar
+from urllib.parse import urlparse
 
 from django.conf import settings
-from django.db.models import Aggregate, Func
+from django.db.models import Aggregate
 
 from holofood.config import HolofoodConfig
 
@@ -32,22 +38,158 @@ class CadenceEnforcer:
     def __init__(self, min_period: timedelta = timedelta(0)):
         """
         Ensures that at least min_period time has passed between invocations.
+        Thread-safe: concurrent callers are each given their own slot.
         :param min_period: Any timedelta e.g. datetime.timedelta(seconds=3)
         """
         self.cadence_seconds = min_period.total_seconds()
         self.prev_return = None
+        self._lock = threading.Lock()
 
     def __call__(self):
-        now = time.time()
-        if self.prev_return:
-            since = now - self.prev_return
-            if since < self.cadence_seconds:
-                logging.debug(f"Sleeping for {self.cadence_seconds - since:.2f}s")
-                time.sleep(self.cadence_seconds - since)
-        self.prev_return = now
+        with self._lock:
+            now = time.time()
+            wait = 0
+            if self.prev_return:
+                since = now - self.prev_return
+                if since < self.cadence_seconds:
+                    wait = self.cadence_seconds - since
+            self.prev_return = now + wait
+        if wait:
+            logging.debug(f"Sleeping for {wait:.2f}s")
+            time.sleep(wait)
         return
 
 
+class HostRateLimiter:
+    def __init__(self, max_concurrent: int = 4, min_period: timedelta = timedelta(0)):
+        """
+        Limits concurrent requests to each host, and spaces them out by a minimum period (per host).
+        Use as `with limiter.limit(url): requests.get(url)`.
+        :param max_concurrent: Max number of requests in flight to any one host.
+        :param min_period: Minimum time between starting requests to any one host.
+        """
+        self.max_concurrent = max_concurrent
+        self.min_period = min_period
+        self._hosts: Dict[str, Tuple[threading.BoundedSemaphore, CadenceEnforcer]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def limit(self, url: str):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = (
+                    threading.BoundedSemaphore(self.max_concurrent),
+                    CadenceEnforcer(self.min_period),
+                )
+            semaphore, cadence = self._hosts[host]
+        with semaphore:
+            cadence()
+            yield
+
+
+T = TypeVar("T")
+
+
+def prefetch_in_background(iterable: Iterable[T], buffer_size: int = 2) -> Iterator[T]:
+    """
+    Iterate over `iterable` in a background thread, keeping up to `buffer_size` items ready ahead of the consumer.
+    Useful to overlap slow network fetching (e.g. API pagination) with processing (e.g. DB writes).
+    The buffer is bounded, so memory use is capped at roughly `buffer_size` + 2 items.
+    Exceptions raised whilst producing items are re-raised in the consumer.
+    The background thread must not use the DB, since Django connections are per-thread.
+    :param iterable: Any iterable, e.g. a generator of API response pages.
+    :param buffer_size: Max number of items to fetch ahead. 0 disables prefetching.
+    :return: Iterator over the same items, in the same order.
+    """
+    if buffer_size < 1:
+        yield from iterable
+        return
+
+    buffer = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+    finished = object()
+
+    def put(entry) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((finished, e))
+        else:
+            put((finished, None))
+
+    producer = threading.Thread(target=produce, name="prefetcher", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is finished:
+                if error:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+_lookup_executor = ThreadPoolExecutor(
+    max_workers=holofood_config.http.concurrent_lookups_workers,
+    thread_name_prefix="lookup",
+)
+
+
+def _recorded(call: Callable[[], Any]) -> Any:
+    # Imported here, since instrumentation uses this module's config
+    from holofood.instrumentation import record_thread_queries
+
+    # Count any queries in the request's metrics too, although they are on this thread's connections
+    with record_thread_queries():
+        return call()
+
+
+def run_concurrently(
+    calls: Dict[str, Callable[[], Any]], deadline: timedelta
+) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+    """
+    Run several (slow, e.g. external API) calls at once, waiting at most until a shared deadline.
+    Calls still running at the deadline are left to finish in the background (e.g. to fill caches),
+    but their results are discarded.
+    The calls run in other threads, so any DB queries are on those threads' own connections.
+    :param calls: Dict of name -> function (without args), e.g. {"analyses": lambda: get_analyses("SAMEA1")}
+    :param deadline: Maximum time to wait for all calls.
+    :return: Tuple of (dict of name -> result, dict of name -> exception) for the finished/failed calls.
+    """
+    # Each call runs in a copy of this context, e.g. to count its HTTP calls in the request's metrics
+    futures = {
+        _lookup_executor.submit(contextvars.copy_context().run, _recorded, call): name
+        for name, call in calls.items()
+    }
+    done, not_done = wait(futures, timeout=deadline.total_seconds())
+    results = {}
+    errors = {}
+    for future in done:
+        name = futures[future]
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            errors[name] = e
+    for future in not_done:
+        name = futures[future]
+        errors[name] = TimeoutError(f"{name} did not complete within {deadline}")
+    return results, errors
+
+
 class StringAgg(Aggregate):
     dbengine = settings.DATABASES["default"]["ENGINE"].lower()
     if "postgres" in dbengine:
@@ -60,10 +202,6 @@ class StringAgg(Aggregate):
     name = "Concat"
 
 
-class DistinctFunc(Func):
-    template = "%(function)s(DISTINCT %(expressions)s)"
-
-
 def find_by_path(object, attr_path: str):
     def getter(item, attr_or_key):
         if hasattr(item, attr_or_key):
@@ -1,11 +1,8 @@
 import logging
-import operator
-from functools import reduce
-from typing import List, Type
+from functools import partial
+from typing import List
 
-import requests
 from django.core.paginator import Paginator
-from django.db.models import Q, Model, CharField, QuerySet, TextField
 from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
@@ -18,6 +15,7 @@ from django.views.generic import (
 from django.views.generic.detail import BaseDetailView
 from django.views.generic.list import MultipleObjectMixin
 
+from holofood.external_apis.docs.api import docs_search_index
 from holofood.external_apis.mgnify.api import MgnifyApi
 from holofood.filters import (
     SampleFilter,
@@ -35,8 +33,16 @@ from holofood.models import (
     ViralFragment,
     Genome,
     Animal,
+    GenomeSampleContainment,
+    SearchDocument,
+)
+from holofood.stats import get_portal_stats
+from holofood.utils import (
+    holofood_config,
+    find_by_path,
+    write_signpost,
+    run_concurrently,
 )
-from holofood.utils import holofood_config, find_by_path, write_signpost
 
 
 class ListFilterView(ListView):
@@ -53,6 +59,25 @@ class ListFilterView(ListView):
         return context
 
 
+class AnimalMetadataListMixin:
+    """
+    Fetches the metadata columns (default_metadata_marker_columns) of every animal listed on a page
+    in one query, for the `animal_metadatum` template filter.
+    Override `get_listed_animal` if the listed objects are not animals.
+    """
+
+    def get_listed_animal(self, obj) -> Animal:
+        return obj
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        Animal.objects.attach_metadata(
+            map(self.get_listed_animal, context["object_list"]),
+            holofood_config.tables.animals_list.default_metadata_marker_columns,
+        )
+        return context
+
+
 class SignpostedDetailView(DetailView):
     """
     Adds signposting.org headers to a detail view request.
@@ -101,7 +126,7 @@ class SignpostedDetailView(DetailView):
         return super().render_to_response(context, **response_kwargs)
 
 
-class SampleListView(ListFilterView):
+class SampleListView(AnimalMetadataListMixin, ListFilterView):
     model = Sample
     context_object_name = "samples"
     paginate_by = 10
@@ -124,6 +149,9 @@ class SampleListView(ListFilterView):
 
         return context
 
+    def get_listed_animal(self, obj: Sample) -> Animal:
+        return obj.animal
+
 
 class SampleDetailView(SignpostedDetailView):
     model = Sample
@@ -134,34 +162,48 @@ class SampleDetailView(SignpostedDetailView):
     api_url_args_from_context_path = {"sample_accession": "sample.pk"}
     api_list_url_name = "api:list_samples"
 
+    # Context key of each external lookup -> name of the service, for logging
+    external_lookup_services = {
+        "analyses": "MGnify",
+        "assays": "MetaboLights",
+        "ena_records": "ENA",
+    }
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         model: Sample = context["sample"]
 
+        # External lookups run concurrently (and without DB access), with a shared deadline
+        lookups = {}
         if model.is_metagenomic_sample:
             mgnify = MgnifyApi()
-
-            try:
-                context["analyses"] = mgnify.get_metagenomics_analyses_for_sample(
-                    model.accession
-                )
-
-            except Exception as e:
-                logging.error(f"Could not retrieve analyses from MGnify for {model}")
-                logging.error(e)
-                context["analyses"] = []
-                context["analyses_error"] = True
+            lookups["analyses"] = partial(
+                mgnify.get_cached_metagenomics_analyses_for_sample, model.accession
+            )
 
         if model.sample_type in [Sample.METABOLOMIC, Sample.METABOLOMIC_TARGETED]:
-            context["assays"] = model.get_metabolights_files()
+            lookups["assays"] = model.get_metabolights_files
 
         if model.is_sequencing_sample:
-            context["ena_records"] = model.get_ena_records()
+            context["ena_records"] = model.get_stored_ena_records()
+            if not context["ena_records"]:
+                lookups["ena_records"] = model.fetch_ena_records
+
+        results, errors = run_concurrently(
+            lookups, deadline=holofood_config.http.detail_page_lookups_deadline
+        )
+        context.update(results)
+        for section, error in errors.items():
+            service = self.external_lookup_services[section]
+            logging.error(f"Could not retrieve {section} from {service} for {model}")
+            logging.error(error)
+            context[section] = [] if section != "ena_records" else None
+            context[f"{section}_error"] = True
 
         return context
 
 
-class AnimalListView(ListFilterView):
+class AnimalListView(AnimalMetadataListMixin, ListFilterView):
     model = Animal
     context_object_name = "animals"
     paginate_by = 10
@@ -235,12 +277,12 @@ class HomeView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["samples_count"] = Sample.objects.count()
-        context["mags_count"] = Genome.objects.count()
-        context["viral_count"] = ViralFragment.objects.count()
-        context["analysis_summaries_count"] = AnalysisSummary.objects.filter(
-            is_published=True
-        ).count()
+        stats = get_portal_stats()
+        context["stats"] = stats
+        context["samples_count"] = stats["samples"]["total"]
+        context["mags_count"] = stats["genomes"]["total"]
+        context["viral_count"] = stats["viral_fragments"]["total"]
+        context["analysis_summaries_count"] = stats["analysis_summaries"]["total"]
         return context
 
 
@@ -304,7 +346,11 @@ class GenomeCataloguesView(RedirectView):
         return reverse("genome_catalogue", kwargs={"pk": catalogue.id})
 
 
-class GenomeDetailView(SignpostedDetailView, DetailViewWithPaginatedRelatedList):
+class GenomeDetailView(
+    AnimalMetadataListMixin,
+    SignpostedDetailView,
+    DetailViewWithPaginatedRelatedList,
+):
     model = Genome
     context_object_name = "genome"
     paginate_by = 10
@@ -345,6 +391,9 @@ class GenomeDetailView(SignpostedDetailView, DetailViewWithPaginatedRelatedList)
             context["cazy_annotations"] = {}
         return context
 
+    def get_listed_animal(self, obj: GenomeSampleContainment) -> Animal:
+        return obj.sample.animal
+
 
 class ViralCatalogueView(DetailViewWithPaginatedRelatedList):
     model = ViralCatalogue
@@ -407,54 +456,22 @@ class ViralSequenceAnnotationView(BaseDetailView):
 
 class GlobalSearchView(TemplateView):
     template_name = "holofood/pages/search.html"
-
-    def multi_search_model(
-        self, model: Type[Model], fields: List[str] = None, limit: int = 10
-    ) -> QuerySet:
-        query = self.request.GET.get("query")
-        if not query:
-            return model.objects.none()
-
-        fields = fields or list(
-            map(
-                lambda field: field.name,
-                filter(
-                    lambda field: isinstance(field, CharField)
-                    or isinstance(field, TextField),
-                    model._meta.fields,
-                ),
-            )
-        )
-
-        logging.info(f"Will search model {model._meta.label} {fields = } for {query}")
-
-        return model.objects.filter(
-            reduce(
-                operator.or_,
-                (Q(**{f"{field}__icontains": query}) for field in fields),
-            )
-        )
+    results_per_type = 10
+
+    # Template context names for each type of search result (SearchDocument.entity_type)
+    search_result_names = {
+        "sample": "samples",
+        "animal": "animals",
+        "genomecatalogue": "mag_catalogues",
+        "genome": "mags",
+        "viralcatalogue": "viral_catalogues",
+        "viralfragment": "viral_fragments",
+        "analysissummary": "analysis_summaries",
+    }
 
     def get_docs_results(self) -> List[dict]:
         query = self.request.GET.get("query")
-        try:
-            logging.info(
-                f"Getting docs search JSON from {holofood_config.docs.docs_url}"
-            )
-            quarto_search_response = requests.get(
-                holofood_config.docs.docs_url + "/search.json", timeout=5
-            )
-            quarto_sections = quarto_search_response.json()
-        except Exception as e:
-            logging.error("Failed to retrieve docs search items from Quarto")
-            logging.error(e)
-            return []
-        matches = list(
-            filter(
-                lambda sec: query.lower() in sec.get("text", "").lower(),
-                quarto_sections,
-            )
-        )
+        matches = docs_search_index.search(query)
         logging.info(f"Found {len(matches)} docs matches for {query}")
         return matches
 
@@ -495,13 +512,13 @@ class GlobalSearchView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["query"] = self.request.GET.get("query")
-        context["samples"] = self.multi_search_model(Sample)
-        context["animals"] = self.multi_search_model(Animal)
-        context["mag_catalogues"] = self.multi_search_model(GenomeCatalogue)
-        context["mags"] = self.multi_search_model(Genome)
-        context["viral_catalogues"] = self.multi_search_model(ViralCatalogue)
-        context["viral_fragments"] = self.multi_search_model(ViralFragment)
-        context["analysis_summaries"] = self.multi_search_model(AnalysisSummary)
+        results = SearchDocument.objects.search(
+            context["query"], limit_per_type=self.results_per_type
+        )
+        for entity_type, (objects, total) in results.items():
+            name = self.search_result_names[entity_type]
+            context[name] = objects
+            context[f"{name}_count"] = total
         context["docs_sections"] = self.get_docs_results()
 
         return context